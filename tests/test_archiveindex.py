@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+##
+## tests for archiveindex module
+##
+
+import unittest
+import os
+import json
+import tempfile
+import unittest.mock
+import winbackup.archiveindex
+import winbackup.restore
+
+LISTING = """
+7-Zip 23.01 (x64) : Copyright (c) 1999-2023 Igor Pavlov : 2023-06-20
+
+Listing archive: Docs.7z.001
+
+--
+Path = Docs.7z.001
+Type = Split
+Physical Size = 1000
+Volumes = 3
+Total Physical Size = 2500
+----
+Path = Docs.7z
+Size = 2500
+--
+Path = Docs.7z
+Type = 7z
+Physical Size = 2500
+Headers Size = 100
+Method = LZMA2:24
+Solid = +
+Blocks = 3
+
+----------
+Path = docs
+Size = 0
+Packed Size = 0
+Folder = +
+Attributes = D
+
+Path = docs\\a.txt
+Size = 600
+Packed Size = 900
+Folder = -
+Block = 0
+
+Path = docs\\b.txt
+Size = 400
+Packed Size =
+Folder = -
+Block = 0
+
+Path = docs\\empty.txt
+Size = 0
+Packed Size = 0
+Folder = -
+
+Path = docs\\photo.jpg
+Size = 1200
+Packed Size = 1150
+Folder = -
+Block = 1
+
+Path = docs\\tax = 2023.pdf
+Size = 300
+Packed Size = 250
+Folder = -
+Block = 2
+
+"""
+
+
+class TestArchiveIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.records = winbackup.archiveindex.ArchiveIndex.parse_listing(LISTING.splitlines())
+        self.index = winbackup.archiveindex.ArchiveIndex.index_listing(
+            "Docs.7z.001", self.records, 1000
+        )
+        self.index["volumes"] = 3
+
+    def test_parse_listing(self):
+        self.assertEqual(len(self.records), 6)
+        self.assertEqual(self.records[0]["Folder"], "+")
+        self.assertEqual(self.records[2]["Packed Size"], "")
+        self.assertEqual(self.records[5]["Path"], "docs\\tax = 2023.pdf")
+
+    def test_blocks(self):
+        self.assertEqual(
+            [(b["offset"], b["packed_size"], b["size"]) for b in self.index["blocks"]],
+            [(32, 900, 1000), (932, 1150, 1200), (2082, 250, 300)],
+        )
+        self.assertEqual(
+            [(b["first_volume"], b["last_volume"]) for b in self.index["blocks"]],
+            [(1, 1), (1, 3), (3, 3)],
+        )
+        self.assertEqual(
+            self.index["files"]["docs\\b.txt"], {"size": 400, "block": 0, "offset": 600}
+        )
+        # empty files and folders have no block
+        self.assertNotIn("docs\\empty.txt", self.index["files"])
+        self.assertNotIn("docs", self.index["files"])
+
+    def test_lookup_and_volumes(self):
+        index = {"version": 1, "target": "Docs.7z", "archives": [self.index]}
+        matches = winbackup.archiveindex.ArchiveIndex.lookup(index, "DOCS/*.txt")
+        self.assertEqual([path for _, path, _ in matches], ["docs\\a.txt", "docs\\b.txt"])
+        # the last volume is read for the archive headers
+        self.assertEqual(
+            winbackup.archiveindex.ArchiveIndex.volumes_needed(self.index, 0), [1, 3]
+        )
+        self.assertEqual(
+            winbackup.archiveindex.ArchiveIndex.volumes_needed(self.index, 1), [1, 2, 3]
+        )
+
+    def test_volume_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for i in range(1, 4):
+                open(os.path.join(temp_dir, f"Docs.7z.{i:03d}"), "w").close()
+            volumes = winbackup.archiveindex.ArchiveIndex.volume_files(
+                os.path.join(temp_dir, "Docs.7z.001")
+            )
+            self.assertEqual(
+                [os.path.basename(v) for v in volumes],
+                ["Docs.7z.001", "Docs.7z.002", "Docs.7z.003"],
+            )
+
+    def test_restore_file(self):
+        archiver = unittest.mock.Mock()
+        archiver.load_manifest.side_effect = lambda path, password: json.load(open(path))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "PC_Docs_Index.manifest.json"), "w") as fout:
+                json.dump(
+                    {"version": 1, "target": "PC_Docs.7z", "archives": [self.index]}, fout
+                )
+            restorer = winbackup.restore.Restorer(archiver, unittest.mock.Mock())
+            restored = restorer.restore_file(
+                temp_dir, "docs\\tax*", os.path.join(temp_dir, "out"), quiet=True
+            )
+            self.assertEqual(
+                restored, [os.path.join(temp_dir, "out", "PC_Docs", "docs\\tax = 2023.pdf")]
+            )
+            archiver.extract_archive.assert_called_once_with(
+                os.path.join(temp_dir, "Docs.7z.001"),
+                os.path.join(temp_dir, "out", "PC_Docs"),
+                "",
+                members=["docs\\tax = 2023.pdf"],
+                quiet=True,
+            )
+            with self.assertRaises(FileNotFoundError):
+                restorer.restore_file(temp_dir, "missing.txt", temp_dir, quiet=True)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+##
+## tests for blockmap module
+##
+
+import unittest
+import io
+import os
+import tempfile
+import winbackup.blockmap
+import winbackup.restore
+import winbackup.segmentarchiver
+
+
+class TestValidOutput(unittest.TestCase):
+    def setUp(self) -> None:
+        self.block_size = 65536
+        self.block_map = winbackup.blockmap.BlockMap(block_size=self.block_size, workers=4)
+        self.segment_archiver = winbackup.segmentarchiver.SegmentArchiver(
+            segment_size=self.block_size * 3
+        )
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.temp_path = self.temp_directory.name
+        self.image_path = os.path.join(self.temp_path, "disk.vhdx")
+        with open(self.image_path, "wb") as fout:
+            for i in range(16):
+                # every fourth block is zeros
+                if i % 4 == 3:
+                    fout.write(bytes(self.block_size))
+                else:
+                    fout.write(os.urandom(self.block_size))
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def _write_block(self, index: int, data: bytes) -> None:
+        with open(self.image_path, "r+b") as fout:
+            fout.seek(index * self.block_size)
+            fout.write(data)
+
+    def _archive(self, block_map: dict, changed: list) -> dict:
+        """
+        Archive the changed blocks to memory as the segment archives would hold them.
+        """
+        extents = self.block_map.block_extents(block_map, changed)
+        segments = []
+        for group in self.segment_archiver.plan_extent_groups(extents, self.block_size * 3):
+            buffer = io.BytesIO()
+            self.segment_archiver.copy_extents(self.image_path, group, buffer)
+            segments.append({"extents": group, "data": buffer.getvalue()})
+        return {"size": block_map["size"], "segments": segments, "incremental": block_map}
+
+    def test_hash_image_zero_blocks_are_none(self):
+        response = self.block_map.hash_image(self.image_path)
+        self.assertTrue(
+            [h is None for h in response["hashes"]] == [i % 4 == 3 for i in range(16)]
+        )
+
+    def test_hash_image_parallel_matches_single_worker(self):
+        single = winbackup.blockmap.BlockMap(block_size=self.block_size, workers=1)
+        response = self.block_map.hash_image(self.image_path)
+        self.assertTrue(response["hashes"] == single.hash_image(self.image_path)["hashes"])
+
+    def test_changed_blocks_without_previous_map(self):
+        response = self.block_map.changed_blocks(self.block_map.hash_image(self.image_path))
+        self.assertTrue(len(response) == 12)
+
+    def test_changed_blocks_detects_changes(self):
+        old_map = self.block_map.hash_image(self.image_path)
+        self._write_block(1, os.urandom(self.block_size))
+        self._write_block(3, os.urandom(self.block_size))
+        response = self.block_map.changed_blocks(
+            self.block_map.hash_image(self.image_path), old_map
+        )
+        self.assertTrue(response == [1, 3])
+
+    def test_changed_blocks_detects_change_before_hole(self):
+        # block 0 holds data, a sparse hole and more data
+        hole_path = os.path.join(self.temp_path, "holes.vhdx")
+        with open(hole_path, "wb") as fout:
+            fout.write(os.urandom(self.block_size // 4))
+            fout.seek(self.block_size // 2)
+            fout.write(os.urandom(self.block_size // 2))
+        old_map = self.block_map.hash_image(hole_path)
+        with open(hole_path, "r+b") as fout:
+            fout.seek(100)
+            fout.write(b"changed")
+        response = self.block_map.changed_blocks(self.block_map.hash_image(hole_path), old_map)
+        self.assertTrue(response == [0])
+
+    def test_block_extents_merged(self):
+        block_map = self.block_map.hash_image(self.image_path)
+        response = self.block_map.block_extents(block_map, [0, 1, 2, 5])
+        self.assertTrue(
+            response == [[0, self.block_size * 3], [self.block_size * 5, self.block_size]]
+        )
+
+    def test_save_and_load_previous(self):
+        block_map = self.block_map.hash_image(self.image_path)
+        image_id = self.block_map.image_id(self.image_path)
+        state_dir = os.path.join(self.temp_path, "state")
+        self.block_map.save(state_dir, image_id, block_map)
+        self.assertTrue(self.block_map.load_previous(state_dir, image_id) == block_map)
+
+    def test_incremental_chain_rebuilds_image(self):
+        """
+        A full run followed by an incremental run restores the latest image exactly,
+        including a block that was zeroed between the runs.
+        """
+        full_map = self.block_map.hash_image(self.image_path)
+        runs = [self._archive(full_map, self.block_map.changed_blocks(full_map))]
+        self._write_block(2, os.urandom(self.block_size))
+        self._write_block(5, bytes(self.block_size))
+        new_map = self.block_map.hash_image(self.image_path)
+        changed = self.block_map.changed_blocks(new_map, full_map)
+        with self.subTest(msg="only the changed block is archived"):
+            self.assertTrue(changed == [2])
+        runs.append(self._archive(new_map, changed))
+
+        dst_path = os.path.join(self.temp_path, "restored.vhdx")
+        self.segment_archiver.reader.create_sparse_file(dst_path, new_map["size"])
+        for run in runs:
+            for segment in run["segments"]:
+                self.segment_archiver.write_segment_extents(
+                    io.BytesIO(segment["data"]), dst_path, segment["extents"]
+                )
+        self.segment_archiver._clear_zeroed_blocks(dst_path, [(None, run) for run in runs])
+        with self.subTest(msg="restored image matches"):
+            with open(dst_path, "rb") as fin, open(self.image_path, "rb") as original:
+                self.assertTrue(fin.read() == original.read())
+
+    def test_parent_run_needs_image_segments(self):
+        """
+        A run folder is only a usable parent if its Segments manifest holds the image,
+        the folder exists even when the target with the image was discarded.
+        """
+        restorer = winbackup.restore.Restorer()
+        image_id = self.block_map.image_id(self.image_path)
+        run_path = os.path.join(self.temp_path, "run")
+        os.mkdir(run_path)
+        self.assertIsNone(restorer.find_image_entry(run_path, image_id))
+        entry = {"path": "disk.vhdx", "incremental": {"image_id": image_id, "parent": None}}
+        restorer.archiver.save_manifest({"files": [entry]}, "t_Segments", run_path)
+        self.assertEqual(restorer.find_image_entry(run_path, image_id), entry)
+        self.assertIsNone(restorer.find_image_entry(run_path, "other"))
+        self.assertIsNone(
+            restorer.find_image_entry(os.path.join(self.temp_path, "x"), image_id)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
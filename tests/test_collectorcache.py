@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+##
+## tests for collectorcache module
+##
+
+import unittest
+import os
+import tempfile
+import winbackup.collectorcache
+
+
+class TestCollectorCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.temp_directory.name, "cache")
+        self.cache = winbackup.collectorcache.CollectorCache(self.cache_path)
+        self.calls = 0
+        self.content = "systeminfo output"
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def _collector(self, out_path):
+        self.calls += 1
+        with open(os.path.join(out_path, "systeminfo.txt"), "w") as fout:
+            fout.write(self.content)
+
+    def _out_path(self, name: str) -> str:
+        path = os.path.join(self.temp_directory.name, name)
+        os.mkdir(path)
+        return path
+
+    def _read(self, out_path: str) -> str:
+        with open(os.path.join(out_path, "systeminfo.txt"), "r") as fin:
+            return fin.read()
+
+    def test_fresh_output_reused(self):
+        first = self.cache.run("systeminfo", self._collector, self._out_path("run1"), 3600)
+        second = self.cache.run("systeminfo", self._collector, self._out_path("run2"), 3600)
+        self.assertIsNone(first)
+        self.assertEqual(second, winbackup.collectorcache.CollectorCache.CACHED)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(
+            self._read(os.path.join(self.temp_directory.name, "run2")), self.content
+        )
+
+    def test_expired_ttl_reruns(self):
+        self.cache.run("systeminfo", self._collector, self._out_path("run1"), 0)
+        self.cache.run("systeminfo", self._collector, self._out_path("run2"), 0)
+        self.assertEqual(self.calls, 2)
+
+    def test_trigger_change_reruns(self):
+        trigger = {"value": 1}
+        for run in ("run1", "run2"):
+            self.cache.run(
+                "programs",
+                self._collector,
+                self._out_path(run),
+                3600,
+                lambda: trigger["value"],
+            )
+        self.assertEqual(self.calls, 1)
+        trigger["value"] = 2
+        self.cache.run(
+            "programs", self._collector, self._out_path("run3"), 3600, lambda: trigger["value"]
+        )
+        self.assertEqual(self.calls, 2)
+
+    def test_unknown_trigger_uses_ttl(self):
+        for run in ("run1", "run2"):
+            self.cache.run(
+                "programs", self._collector, self._out_path(run), 3600, lambda: None
+            )
+        self.assertEqual(self.calls, 1)
+
+    def test_unchanged_output_not_rewritten(self):
+        self.cache.run("systeminfo", self._collector, self._out_path("run1"), 0)
+        stored = os.path.join(self.cache_path, "systeminfo", "systeminfo.txt")
+        stored_inode = os.stat(stored).st_ino
+        self.cache.run("systeminfo", self._collector, self._out_path("run2"), 0)
+        self.assertEqual(os.stat(stored).st_ino, stored_inode)
+
+    def test_changed_output_replaced(self):
+        self.cache.run("systeminfo", self._collector, self._out_path("run1"), 0)
+        self.content = "new output"
+        out_path = self._out_path("run2")
+        self.cache.run("systeminfo", self._collector, out_path, 0)
+        self.assertEqual(self._read(out_path), "new output")
+        self.assertEqual(self._read(os.path.join(self.cache_path, "systeminfo")), "new output")
+
+    def test_failed_collector_keeps_cache(self):
+        self.cache.run("systeminfo", self._collector, self._out_path("run1"), 0)
+
+        def failing(out_path):
+            raise OSError("failed")
+
+        with self.assertRaises(OSError):
+            self.cache.run("systeminfo", failing, self._out_path("run2"), 0)
+        self.assertEqual(self._read(os.path.join(self.cache_path, "systeminfo")), self.content)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_path, "systeminfo.new")))
+
+    def test_invalidate(self):
+        self.cache.run("systeminfo", self._collector, self._out_path("run1"), 3600)
+        self.cache.invalidate("systeminfo")
+        self.cache.run("systeminfo", self._collector, self._out_path("run2"), 3600)
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
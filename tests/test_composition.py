@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+##
+## tests for composition module
+##
+
+import unittest
+import os
+import json
+import tempfile
+import winbackup.composition
+from winbackup.filescanner import FileScanner
+
+
+class TestCompositionReport(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.temp_directory.name, "target")
+        for sub in ["docs", "media", os.path.join("media", "raw")]:
+            os.makedirs(os.path.join(self.folder, sub))
+        for i in range(5):
+            with open(os.path.join(self.folder, "docs", f"note_{i}.txt"), "wb") as fout:
+                fout.write(b"winbackup " * 2000)
+            with open(
+                os.path.join(self.folder, "media", "raw", f"clip_{i}.mp4"), "wb"
+            ) as fout:
+                fout.write(os.urandom(50000))
+        with open(os.path.join(self.folder, "media", "big.iso"), "wb") as fout:
+            fout.write(os.urandom(300000))
+        self.entries = FileScanner().scan(self.folder)
+        self.total = sum(entry.size for entry in self.entries)
+        self.stats = {
+            "name": "Target",
+            "duration": 10.0,
+            "source_bytes": self.total,
+            "archive_bytes": 560000,
+            "status": "ok",
+        }
+        self.composition = winbackup.composition.CompositionReport(big_file_threshold=100000)
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_directories(self):
+        directories = self.composition.directories(self.entries)
+        self.assertEqual(
+            [(d["path"], d["bytes"], d["files"]) for d in directories],
+            [
+                (os.path.join(self.folder, "media"), 550000, 6),
+                (os.path.join(self.folder, "media", "raw"), 250000, 5),
+                (os.path.join(self.folder, "docs"), 100000, 5),
+            ],
+        )
+
+    def test_extensions_worst_first(self):
+        extensions = self.composition.extensions(self.entries, 560000)
+        self.assertEqual(extensions[-1]["extension"], ".txt")
+        self.assertLess(extensions[-1]["ratio"], 0.1)
+        self.assertEqual({e["extension"] for e in extensions[:2]}, {".iso", ".mp4"})
+        # scaled to the real archive size, never above the original size
+        self.assertAlmostEqual(
+            sum(e["est_archive_bytes"] for e in extensions), 560000, delta=20000
+        )
+        self.assertTrue(all(e["ratio"] <= 1.0 for e in extensions))
+
+    def test_build(self):
+        config_stats = dict(self.stats, name="Config", source_bytes=None, duration=30.0)
+        report = self.composition.build(
+            {"target": self.stats, "01_config": config_stats}, {"target": self.entries}
+        )
+        target = report["targets"]["target"]
+        self.assertAlmostEqual(target["time_share"], 0.25)
+        self.assertAlmostEqual(report["targets"]["01_config"]["time_share"], 0.75)
+        self.assertEqual(report["targets"]["01_config"]["directories"], [])
+        self.assertEqual(
+            [f["path"] for f in target["big_files"]],
+            [os.path.join(self.folder, "media", "big.iso")],
+        )
+        self.assertAlmostEqual(
+            target["big_files"][0]["est_seconds"], 10.0 * 300000 / self.total
+        )
+
+    def test_save(self):
+        report = self.composition.build({"target": self.stats}, {"target": self.entries})
+        paths = self.composition.save(report, self.temp_directory.name, "composition")
+        self.assertEqual(
+            [os.path.basename(p) for p in paths], ["composition.json", "composition.html"]
+        )
+        with open(paths[0], encoding="utf-8") as fin:
+            self.assertEqual(json.load(fin)["targets"]["target"]["name"], "Target")
+        with open(paths[1], encoding="utf-8") as fin:
+            page = fin.read()
+        self.assertIn("Worst compressing extensions", page)
+        self.assertIn("big.iso", page)
+
+    def test_retried_files(self):
+        retried = [{"path": "Documents/Outlook.pst", "reason": "locked", "result": "failed"}]
+        report = self.composition.build(
+            {"target": self.stats}, {"target": self.entries}, {"target": retried}
+        )
+        self.assertEqual(report["targets"]["target"]["retried_files"], retried)
+        page = self.composition.to_html(report)
+        self.assertIn("Locked or changed files", page)
+        self.assertIn("Documents/Outlook.pst", page)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
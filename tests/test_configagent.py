@@ -232,6 +232,20 @@ class TestValidOutput(unittest.TestCase):
         }
         self.assertFalse(self.config_agent.validate_target_config(test_config))
 
+    def test_validate_target_config_invalid_timeout(self):
+        test_config = {
+            "10_documents": {
+                "name": "Documents",
+                "type": "folder",
+                "path": ".",
+                "enabled": False,
+                "timeout": 0,
+            },
+        }
+        self.assertTrue(self.config_agent.validate_target_config(test_config))
+        test_config["10_documents"]["timeout"] = -1
+        self.assertFalse(self.config_agent.validate_target_config(test_config))
+
     def test_validate_target_config_invalid_target_path(self):
         test_config = {
             "01_config": {
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+##
+## tests for configsink module
+##
+
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+import winbackup.configsink
+import winbackup.restore
+
+
+class TestMemorySink(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.sink = winbackup.configsink.MemorySink()
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_text_matches_folder_sink(self):
+        folder_sink = winbackup.configsink.as_sink(self.temp_directory.name)
+        folder_sink.write("drivers.txt", "line 1\nline 2\n")
+        self.sink.write("drivers.txt", "line 1\nline 2\n")
+        with open(os.path.join(self.temp_directory.name, "drivers.txt"), "rb") as fin:
+            self.assertEqual(self.sink.members["drivers.txt"][0], fin.read())
+
+    def test_add_tree(self):
+        source = os.path.join(self.temp_directory.name, ".ssh")
+        os.makedirs(os.path.join(source, "keys"))
+        with open(os.path.join(source, "keys", "id_test"), "wb") as fout:
+            fout.write(b"key")
+        self.sink.add_tree(".ssh", source)
+        self.assertEqual(self.sink.members[".ssh/keys/id_test"][0], b"key")
+        self.assertEqual(self.sink.total_size, 3)
+
+    def test_tar_stream_restores(self):
+        self.sink.write("path.txt", b"C:/Windows\n")
+        self.sink.write(os.path.join(".ssh", "config"), b"Host *\n")
+        stream = io.BytesIO()
+        written = self.sink.write_tar(stream, "config")
+        self.assertEqual(written, 18)
+
+        # restore unpacks the tarball as if the archive held the config folder
+        out_folder = os.path.join(self.temp_directory.name, "restore")
+        os.makedirs(out_folder)
+        with open(
+            os.path.join(out_folder, "PC_user_2022-01-01_SystemConfig.tar"), "wb"
+        ) as fout:
+            fout.write(stream.getvalue())
+        restorer = winbackup.restore.Restorer(archiver=object(), segment_archiver=object())
+        self.assertTrue(
+            restorer.unpack_tarball(out_folder, "PC_user_2022-01-01_SystemConfig.7z")
+        )
+        self.assertEqual(sorted(os.listdir(out_folder)), ["config"])
+        with open(os.path.join(out_folder, "config", ".ssh", "config"), "rb") as fin:
+            self.assertEqual(fin.read(), b"Host *\n")
+
+    def test_tar_is_valid(self):
+        self.sink.write("a.txt", b"a")
+        stream = io.BytesIO()
+        self.sink.write_tar(stream)
+        stream.seek(0)
+        with tarfile.open(fileobj=stream) as tar:
+            self.assertEqual(tar.getnames(), ["a.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
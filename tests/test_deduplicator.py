@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+##
+## tests for deduplicator module
+##
+
+import unittest
+import os
+import shutil
+import tempfile
+import winbackup.deduplicator
+import winbackup.filescanner
+import winbackup.restore
+
+
+class TestValidOutput(unittest.TestCase):
+    def setUp(self) -> None:
+        self.deduplicator = winbackup.deduplicator.Deduplicator(min_size=1024)
+        self.scanner = winbackup.filescanner.FileScanner()
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.temp_path = self.temp_directory.name
+        self.target_a = os.path.join(self.temp_path, "a")
+        self.target_b = os.path.join(self.temp_path, "b")
+        os.mkdir(self.target_a)
+        os.mkdir(self.target_b)
+        shared = os.urandom(4096)
+        with open(os.path.join(self.target_a, "shared.iso"), "wb") as fout:
+            fout.write(shared)
+        with open(os.path.join(self.target_b, "copy_of_shared.iso"), "wb") as fout:
+            fout.write(shared)
+        # same size, different content - must not be deduplicated
+        with open(os.path.join(self.target_a, "same_size.bin"), "wb") as fout:
+            fout.write(os.urandom(8192))
+        with open(os.path.join(self.target_b, "same_size.bin"), "wb") as fout:
+            fout.write(os.urandom(8192))
+        self.entries = {
+            "a.7z": self.scanner.scan(self.target_a),
+            "b.7z": self.scanner.scan(self.target_b),
+        }
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_find_duplicates_only_shared_content(self):
+        response = self.deduplicator.find_duplicates(self.entries)
+        self.assertTrue(len(response) == 1)
+
+    def test_find_duplicates_spans_targets(self):
+        matches = list(self.deduplicator.find_duplicates(self.entries).values())[0]
+        self.assertTrue({target for target, _ in matches} == {"a.7z", "b.7z"})
+
+    def test_find_duplicates_ignores_small_files(self):
+        self.deduplicator.min_size = 1024 * 1024
+        response = self.deduplicator.find_duplicates(self.entries)
+        self.assertTrue(len(response) == 0)
+
+    def test_excluded_paths(self):
+        duplicates = self.deduplicator.find_duplicates(self.entries)
+        response = self.deduplicator.excluded_paths(duplicates)
+        self.assertTrue(
+            response["b.7z"] == [os.path.join(self.target_b, "copy_of_shared.iso")]
+        )
+
+    def test_manifest_restore_references(self):
+        """
+        Restoring the references from a blob folder recreates the files in each target.
+        """
+        duplicates = self.deduplicator.find_duplicates(self.entries)
+        manifest = self.deduplicator.build_manifest(
+            duplicates,
+            "blobs.7z",
+            lambda entry: entry.relpath,
+            lambda target, entry: entry.relpath,
+        )
+        blob_dir = os.path.join(self.temp_path, "blobs")
+        os.mkdir(blob_dir)
+        for path in self.deduplicator.blob_paths(duplicates):
+            shutil.copy(path, blob_dir)
+        restore_path = os.path.join(self.temp_path, "restore")
+        restorer = winbackup.restore.Restorer()
+        response = restorer.apply_dedup_references(manifest, blob_dir, restore_path)
+        with self.subTest(msg="number of files restored"):
+            self.assertTrue(response == 2)
+        with self.subTest(msg="restored file content"):
+            with open(os.path.join(restore_path, "b", "copy_of_shared.iso"), "rb") as fin:
+                with open(os.path.join(self.target_a, "shared.iso"), "rb") as original:
+                    self.assertTrue(fin.read() == original.read())
+
+    def test_damaged_blob_not_restored(self):
+        duplicates = self.deduplicator.find_duplicates(self.entries)
+        manifest = self.deduplicator.build_manifest(
+            duplicates,
+            "blobs.7z",
+            lambda entry: entry.relpath,
+            lambda target, entry: entry.relpath,
+        )
+        blob_dir = os.path.join(self.temp_path, "blobs")
+        os.mkdir(blob_dir)
+        for path in self.deduplicator.blob_paths(duplicates):
+            shutil.copy(path, blob_dir)
+            # same size, different content
+            with open(os.path.join(blob_dir, os.path.basename(path)), "r+b") as fout:
+                fout.write(b"damaged")
+        restore_path = os.path.join(self.temp_path, "restore")
+        with self.assertRaises(ValueError):
+            winbackup.restore.Restorer().apply_dedup_references(
+                manifest, blob_dir, restore_path
+            )
+        self.assertFalse(os.path.exists(os.path.join(restore_path, "b", "copy_of_shared.iso")))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+##
+## tests for envprobe module
+##
+
+import unittest
+import os
+import time
+import tempfile
+import winbackup.envprobe
+
+
+class TestEnvProbes(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.temp_directory.name, "probes", "cache.json")
+        self.calls = {}
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def _probe(self, name: str, value, delay: float = 0):
+        def probe():
+            self.calls[name] = self.calls.get(name, 0) + 1
+            time.sleep(delay)
+            return value
+
+        return probe
+
+    def test_lazy_and_memoised(self):
+        probes = winbackup.envprobe.EnvProbes()
+        probes.register("service", self._probe("service", True))
+        probes.register("unused", self._probe("unused", False))
+        self.assertTrue(probes.get("service"))
+        self.assertTrue(probes.get("service"))
+        self.assertEqual(self.calls, {"service": 1})
+
+    def test_prefetch_runs_concurrently(self):
+        probes = winbackup.envprobe.EnvProbes()
+        for i in range(4):
+            probes.register(f"slow{i}", self._probe(f"slow{i}", i, delay=0.3))
+        start = time.perf_counter()
+        probes.prefetch([f"slow{i}" for i in range(4)])
+        self.assertEqual([probes.get(f"slow{i}") for i in range(4)], [0, 1, 2, 3])
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_probe_depending_on_probe(self):
+        probes = winbackup.envprobe.EnvProbes()
+        probes.register("admin", self._probe("admin", True, delay=0.1))
+        probes.register("paths", lambda: ["C:/VMs"] if probes.get("admin") else None)
+        probes.prefetch(["paths", "admin"])
+        self.assertEqual(probes.get("paths"), ["C:/VMs"])
+        self.assertEqual(self.calls["admin"], 1)
+
+    def test_disk_cache(self):
+        probes = winbackup.envprobe.EnvProbes(self.cache_path, ttl=60)
+        probes.register("paths", self._probe("paths", ["C:/VMs"]), cacheable=True)
+        probes.register("running", self._probe("running", True))
+        probes.get("paths")
+        probes.get("running")
+
+        new_probes = winbackup.envprobe.EnvProbes(self.cache_path, ttl=60)
+        new_probes.register("paths", self._probe("paths", ["C:/VMs"]), cacheable=True)
+        new_probes.register("running", self._probe("running", True))
+        self.assertEqual(new_probes.get("paths"), ["C:/VMs"])
+        new_probes.get("running")
+        self.assertEqual(self.calls, {"paths": 1, "running": 2})
+
+    def test_disk_cache_expired(self):
+        for _ in range(2):
+            probes = winbackup.envprobe.EnvProbes(self.cache_path, ttl=0)
+            probes.register("paths", self._probe("paths", ["C:/VMs"]), cacheable=True)
+            probes.get("paths")
+        self.assertEqual(self.calls["paths"], 2)
+
+    def test_exception_not_kept(self):
+        probes = winbackup.envprobe.EnvProbes(self.cache_path)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise PermissionError("needs admin")
+            return "ok"
+
+        probes.register("flaky", flaky, cacheable=True)
+        with self.assertRaises(PermissionError):
+            probes.get("flaky")
+        self.assertEqual(probes.get("flaky"), "ok")
+
+    def test_unknown_probe(self):
+        with self.assertRaises(KeyError):
+            winbackup.envprobe.EnvProbes().get("missing")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
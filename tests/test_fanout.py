@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+##
+## tests for fanout module
+##
+
+import unittest
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import unittest.mock
+import winbackup.fanout
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_directory.name, "source")
+        os.mkdir(self.source)
+        self.destinations = [
+            os.path.join(self.temp_directory.name, f"dest{i}", "Backup") for i in range(3)
+        ]
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def _write(self, name: str, size: int) -> str:
+        data = os.urandom(size)
+        with open(os.path.join(self.source, name), "wb") as fout:
+            fout.write(data)
+        return hashlib.sha256(data).hexdigest()
+
+    def test_copies_with_hashes(self):
+        digests = {
+            "a.7z": self._write("a.7z", 300000),
+            "b.7z.001": self._write("b.7z.001", 10),
+        }
+        self._write("notes.txt", 5)
+        fan_out = winbackup.fanout.FanOut(self.destinations, chunk_size=65536)
+        self.assertEqual(fan_out.add_new(self.source), 3)
+        # files already queued are not queued again
+        self.assertEqual(fan_out.add_new(self.source), 0)
+        results = fan_out.close()
+        self.assertEqual(
+            [(folder, copied, errors) for folder, copied, errors in results],
+            [(folder, 3, []) for folder in self.destinations],
+        )
+        for folder in self.destinations:
+            with open(os.path.join(folder, "sha256.txt")) as fin:
+                lines = fin.read().splitlines()
+            self.assertEqual(
+                lines, [f"{name} {digest}" for name, digest in sorted(digests.items())]
+            )
+            for name in digests:
+                with open(os.path.join(folder, name), "rb") as fin:
+                    self.assertEqual(hashlib.sha256(fin.read()).hexdigest(), digests[name])
+
+    def test_skip(self):
+        self._write("a.7z", 10)
+        self._write("winbackup.log", 10)
+        fan_out = winbackup.fanout.FanOut(self.destinations[:1])
+        self.assertEqual(fan_out.add_new(self.source, skip=lambda name: ".log" in name), 1)
+        fan_out.close()
+        self.assertFalse(os.path.exists(os.path.join(self.destinations[0], "winbackup.log")))
+
+    def test_slow_destination_does_not_stall(self):
+        digest = self._write("big.7z", 64 * 65536)
+        release = threading.Event()
+
+        class SlowDestination(winbackup.fanout._Destination):
+            def _run(self) -> None:
+                # the slow destination writes nothing until released
+                if self.folder.endswith(os.path.join("dest0", "Backup")):
+                    release.wait()
+                super()._run()
+
+        with unittest.mock.patch.object(winbackup.fanout, "_Destination", SlowDestination):
+            fan_out = winbackup.fanout.FanOut(
+                self.destinations[:2], buffer_size=4 * 65536, chunk_size=65536
+            )
+        slow, fast = fan_out.destinations
+        fan_out.add(os.path.join(self.source, "big.7z"))
+        deadline = time.monotonic() + 10
+        while "big.7z" not in fast.hashes and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(fast.hashes.get("big.7z"), digest)
+        self.assertLessEqual(slow.buffered, 4 * 65536)
+        release.set()
+        fan_out.close()
+        self.assertEqual(slow.hashes["big.7z"], digest)
+        self.assertEqual(slow.caught_up, 1)
+
+    def test_missing_source(self):
+        fan_out = winbackup.fanout.FanOut(self.destinations[:1])
+        with self.assertLogs(level="ERROR"):
+            fan_out.add(os.path.join(self.source, "missing.7z"))
+            results = fan_out.close()
+        self.assertEqual(results[0][2], ["missing.7z"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
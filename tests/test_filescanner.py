@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+##
+## tests for filescanner module
+##
+
+import unittest
+import os
+import tempfile
+import winbackup.filescanner
+
+
+class TestValidOutput(unittest.TestCase):
+    def setUp(self) -> None:
+        self.scanner = winbackup.filescanner.FileScanner()
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.temp_path = self.temp_directory.name
+        os.makedirs(os.path.join(self.temp_path, "sub", "deeper"))
+        for i, folder in enumerate(["", "sub", os.path.join("sub", "deeper")]):
+            with open(os.path.join(self.temp_path, folder, f"file_{i}.bin"), "wb") as fout:
+                fout.write(os.urandom(1024 * (i + 1)))
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_scan_finds_all_files(self):
+        response = self.scanner.scan(self.temp_path)
+        self.assertTrue(len(response) == 3)
+
+    def test_scan_relpath(self):
+        response = self.scanner.scan(self.temp_path)
+        relpaths = {entry.relpath for entry in response}
+        self.assertTrue(os.path.join("sub", "deeper", "file_2.bin") in relpaths)
+
+    def test_total_size(self):
+        response = self.scanner.total_size(self.scanner.scan(self.temp_path))
+        self.assertTrue(response == 1024 + 2048 + 3072)
+
+    def test_scan_list_of_paths(self):
+        response = self.scanner.scan(
+            [
+                os.path.join(self.temp_path, "sub"),
+                os.path.join(self.temp_path, "sub", "deeper"),
+            ]
+        )
+        self.assertTrue(len(response) == 3)
+
+    def test_scan_raises_typeerror(self):
+        with self.assertRaises(TypeError):
+            self.scanner.scan(99)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+##
+## tests for the cli start up cost
+## imports are measured with python -X importtime in a fresh interpreter,
+## run this file directly to print the slowest imports of each command
+##
+
+import unittest
+import os
+import sys
+import subprocess
+import winbackup
+
+# import time budget for `import winbackup.__main__`, best of IMPORT_RUNS runs,
+# wall clock time depends on the machine so it is only checked when
+# WINBACKUP_IMPORT_BUDGET is set, the deferred modules are always checked
+IMPORT_BUDGET_MS = 50
+IMPORT_RUNS = 3
+
+# modules that must only be loaded once a command needs them
+DEFERRED_MODULES = [
+    "tqdm",
+    "humanize",
+    "send2trash",
+    "yaml",
+    "winbackup.winbackup",
+    "winbackup.zip7archiver",
+    "winbackup.systemconfigsaver",
+    "winbackup.restore",
+]
+
+# backup and restore dependencies not needed to build a config file
+ARCHIVING_MODULES = [
+    "tqdm",
+    "humanize",
+    "send2trash",
+    "winbackup.zip7archiver",
+    "winbackup.systemconfigsaver",
+    "winbackup.segmentarchiver",
+    "winbackup.restore",
+]
+
+
+def import_times(args: list) -> tuple:
+    """
+    Run python -X importtime with args in a fresh interpreter.
+    Returns ({module: cumulative import time in us}, stdout).
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_root, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        times[module.strip()] = int(cumulative)
+    return times, result.stdout
+
+
+class TestImportTime(unittest.TestCase):
+    def test_main_defers_modules(self):
+        times, _ = import_times(["-c", "import winbackup.__main__"])
+        self.assertIn("winbackup.__main__", times)
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_version_flag(self):
+        times, stdout = import_times(["-m", "winbackup", "-V"])
+        self.assertEqual(stdout.strip(), winbackup.__version__)
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_winbackup_defers_archiving_modules(self):
+        times, _ = import_times(["-c", "import winbackup.winbackup"])
+        self.assertIn("winbackup.winbackup", times)
+        for module in ARCHIVING_MODULES:
+            self.assertNotIn(module, times)
+
+    @unittest.skipUnless(
+        os.environ.get("WINBACKUP_IMPORT_BUDGET"), "set WINBACKUP_IMPORT_BUDGET to check"
+    )
+    def test_import_budget(self):
+        best = min(
+            import_times(["-c", "import winbackup.__main__"])[0]["winbackup.__main__"]
+            for _ in range(IMPORT_RUNS)
+        )
+        self.assertLess(best / 1000, IMPORT_BUDGET_MS)
+
+
+if __name__ == "__main__":
+    for args in (["-m", "winbackup", "-V"], ["-c", "import winbackup.winbackup"]):
+        times, _ = import_times(args)
+        print(f"{' '.join(args)} - {len(times)} modules")
+        for module, cumulative in sorted(times.items(), key=lambda x: -x[1])[:10]:
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+    unittest.main(verbosity=2)
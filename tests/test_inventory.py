@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+##
+## tests for inventory module
+##
+
+import unittest
+import os
+import csv
+import tempfile
+import winbackup.inventory
+
+
+class TestDirectoryInventory(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_directory.name, "Videos")
+        self.state_path = os.path.join(self.temp_directory.name, "state", "inventory.json")
+        self.csv_path = os.path.join(self.temp_directory.name, "inventory.csv")
+        for relpath, size in [
+            ("a.mp4", 10),
+            (os.path.join("Films", "b.mkv"), 20),
+            (os.path.join("Films", "Old", "c.avi"), 30),
+            (os.path.join("Shows", "d.mp4"), 40),
+        ]:
+            self._write(relpath, size)
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def _write(self, relpath: str, size: int) -> None:
+        path = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fout:
+            fout.write(b"0" * size)
+
+    def _read_csv(self) -> dict:
+        with open(self.csv_path, "r", newline="", encoding="utf-8") as fin:
+            return {row["path"]: int(row["size"]) for row in csv.DictReader(fin)}
+
+    def test_full_listing(self):
+        inventory = winbackup.inventory.DirectoryInventory()
+        count = inventory.write_csv(self.root, self.csv_path)
+        self.assertEqual(count, 4)
+        self.assertEqual(
+            self._read_csv(),
+            {
+                "a.mp4": 10,
+                os.path.join("Films", "b.mkv"): 20,
+                os.path.join("Films", "Old", "c.avi"): 30,
+                os.path.join("Shows", "d.mp4"): 40,
+            },
+        )
+
+    def test_incremental_lists_changed_folders_only(self):
+        winbackup.inventory.DirectoryInventory(self.state_path).write_csv(
+            self.root, self.csv_path
+        )
+        self._write(os.path.join("Shows", "e.mp4"), 50)
+        os.remove(os.path.join(self.root, "Films", "Old", "c.avi"))
+
+        inventory = winbackup.inventory.DirectoryInventory(self.state_path)
+        inventory.write_csv(self.root, self.csv_path)
+        self.assertEqual(inventory.listed_dirs, 2)
+        self.assertEqual(inventory.reused_dirs, 2)
+        listing = self._read_csv()
+        self.assertIn(os.path.join("Shows", "e.mp4"), listing)
+        self.assertNotIn(os.path.join("Films", "Old", "c.avi"), listing)
+        self.assertEqual(len(listing), 4)
+
+    def test_unchanged_tree_not_listed(self):
+        winbackup.inventory.DirectoryInventory(self.state_path).write_csv(
+            self.root, self.csv_path
+        )
+        inventory = winbackup.inventory.DirectoryInventory(self.state_path)
+        self.assertEqual(inventory.write_csv(self.root, self.csv_path), 4)
+        self.assertEqual(inventory.listed_dirs, 0)
+
+    def test_state_for_other_root_ignored(self):
+        winbackup.inventory.DirectoryInventory(self.state_path).write_csv(
+            self.root, self.csv_path
+        )
+        other_root = os.path.join(self.root, "Films")
+        inventory = winbackup.inventory.DirectoryInventory(self.state_path)
+        self.assertEqual(inventory.write_csv(other_root, self.csv_path), 2)
+        self.assertEqual(inventory.reused_dirs, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
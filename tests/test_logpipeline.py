@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+##
+## tests for logpipeline module
+##
+
+import unittest
+import os
+import logging
+import tempfile
+import winbackup.logpipeline
+
+
+class TestRingBufferHandler(unittest.TestCase):
+    def test_keeps_last_records(self):
+        ring = winbackup.logpipeline.RingBufferHandler(capacity=3)
+        for i in range(5):
+            ring.handle(logging.makeLogRecord({"msg": f"record {i}"}))
+        self.assertEqual([r.msg for r in ring.records], ["record 2", "record 3", "record 4"])
+        self.assertEqual(ring.dropped, 2)
+
+    def test_flush_to(self):
+        ring = winbackup.logpipeline.RingBufferHandler(capacity=2)
+        for i in range(3):
+            ring.handle(logging.makeLogRecord({"msg": f"record {i}"}))
+        target = winbackup.logpipeline.RingBufferHandler(capacity=10)
+        ring.flush_to(target)
+        messages = [r.msg for r in target.records]
+        self.assertIn("1 earlier log records dropped", messages[0])
+        self.assertEqual(messages[1:], ["record 1", "record 2"])
+        self.assertEqual(len(ring.records), 0)
+        self.assertEqual(ring.dropped, 0)
+
+
+class TestLogPipeline(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.logger = logging.getLogger()
+        self.old_level = self.logger.level
+        self.old_handlers = list(self.logger.handlers)
+        for handler in self.old_handlers:
+            self.logger.removeHandler(handler)
+
+    def tearDown(self) -> None:
+        for handler in self.old_handlers:
+            self.logger.addHandler(handler)
+        self.logger.setLevel(self.old_level)
+        self.temp_directory.cleanup()
+
+    def _read(self, name: str) -> str:
+        with open(os.path.join(self.temp_directory.name, name), encoding="utf-8") as fin:
+            return fin.read()
+
+    def test_buffer_then_redirect(self):
+        pipeline = winbackup.logpipeline.LogPipeline(logging.INFO, capacity=5)
+        pipeline.start()
+        for i in range(8):
+            logging.info(f"before {i}")
+        logging.debug("not logged at info")
+        pipeline.redirect(os.path.join(self.temp_directory.name, "winbackup.log"))
+        logging.info("after")
+        pipeline.stop()
+        lines = self._read("winbackup.log").splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertIn("3 earlier log records dropped", lines[0])
+        self.assertTrue(lines[1].endswith("INFO -> before 3"))
+        self.assertTrue(lines[-1].endswith("INFO -> after"))
+        self.assertNotIn(pipeline.queue_handler, self.logger.handlers)
+
+    def test_debug_log_moved(self):
+        cwd_log = os.path.join(self.temp_directory.name, "cwd.log")
+        pipeline = winbackup.logpipeline.LogPipeline(logging.DEBUG)
+        pipeline.start(cwd_log)
+        logging.debug("in cwd")
+        pipeline.redirect(os.path.join(self.temp_directory.name, "winbackup.log"))
+        logging.debug("in output")
+        pipeline.stop()
+        self.assertFalse(os.path.exists(cwd_log))
+        log = self._read("winbackup.log")
+        self.assertIn("in cwd", log)
+        self.assertIn("in output", log)
+        self.assertIn("test_logpipeline:test_debug_log_moved", log)
+
+    def test_rotation(self):
+        pipeline = winbackup.logpipeline.LogPipeline(
+            logging.INFO, max_bytes=1000, backup_count=2
+        )
+        pipeline.start()
+        pipeline.redirect(os.path.join(self.temp_directory.name, "winbackup.log"))
+        for i in range(200):
+            logging.info(f"record {i:04d} " + "x" * 50)
+        pipeline.stop()
+        files = sorted(os.listdir(self.temp_directory.name))
+        self.assertEqual(files, ["winbackup.log", "winbackup.log.1", "winbackup.log.2"])
+        for file in files:
+            self.assertLessEqual(
+                os.path.getsize(os.path.join(self.temp_directory.name, file)), 1000
+            )
+        self.assertIn("record 0199", self._read("winbackup.log"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+##
+## tests for preflight module
+##
+
+import unittest
+import os
+import tempfile
+import winbackup.preflight
+import winbackup.runhistory
+from winbackup.filescanner import FileScanner
+
+
+class TestSpacePreflight(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.temp_directory.name, "target")
+        os.mkdir(self.folder)
+        for i in range(10):
+            with open(os.path.join(self.folder, f"text_{i}.txt"), "wb") as fout:
+                fout.write(b"winbackup " * 10000)
+            with open(os.path.join(self.folder, f"random_{i}.bin"), "wb") as fout:
+                fout.write(os.urandom(100000))
+        self.entries = FileScanner().scan(self.folder)
+        self.history = winbackup.runhistory.RunHistory(
+            os.path.join(self.temp_directory.name, "runs.json")
+        )
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_sample_ratio(self):
+        preflight = winbackup.preflight.SpacePreflight(sample_files=20)
+        ratio = preflight.sample_ratio(self.entries)
+        # random data doesn't compress, the text almost disappears
+        self.assertGreater(ratio, 0.45)
+        self.assertLess(ratio, 0.55)
+        self.assertEqual(preflight.sample_ratio([]), 1.0)
+
+    def test_estimate_from_history(self):
+        self.history.add_run(
+            {
+                "a": {
+                    "name": "A",
+                    "duration": 1,
+                    "source_bytes": 1000,
+                    "archive_bytes": 250,
+                    "status": "ok",
+                },
+                "config": {
+                    "name": "Config",
+                    "duration": 1,
+                    "source_bytes": None,
+                    "archive_bytes": 1234,
+                    "status": "ok",
+                },
+            }
+        )
+        preflight = winbackup.preflight.SpacePreflight(self.history)
+        estimate = preflight.estimate_target("a", {"name": "A"}, self.entries)
+        self.assertEqual(estimate["method"], "history")
+        self.assertEqual(estimate["archive"], 2000000 // 4)
+        config = preflight.estimate_target("config", {"name": "Config"})
+        self.assertEqual((config["archive"], config["method"]), (1234, "history"))
+        unknown = preflight.estimate_target("new", {"name": "New"})
+        self.assertEqual((unknown["archive"], unknown["method"]), (0, "unknown"))
+
+    def test_tar_scratch_and_store(self):
+        preflight = winbackup.preflight.SpacePreflight()
+        estimate = preflight.estimate_target(
+            "a", {"name": "A", "mx_level": 0, "tar_before_7z": True}, self.entries
+        )
+        self.assertEqual(estimate["archive"], 2000000)
+        self.assertEqual(estimate["scratch"], 2000000 + 20 * preflight.tar_overhead)
+
+    def test_check(self):
+        preflight = winbackup.preflight.SpacePreflight(margin=0)
+        preflight.volume = lambda path: (0 if path == "C:" else 1, 1000)
+        estimates = {
+            "a": {"name": "A", "archive": 300, "scratch": 0},
+            "b": {"name": "B", "archive": 400, "scratch": 500},
+        }
+        volumes = preflight.check(estimates, "C:", ["D:"])
+        self.assertEqual([v["needed"] for v in volumes], [1200, 700])
+        self.assertEqual([v["ok"] for v in volumes], [False, True])
+        suggestions = preflight.suggestions(estimates, volumes[0])
+        self.assertTrue(suggestions[0].startswith("free up at least 200 Bytes"))
+        self.assertIn("turn off tar_before_7z for B", suggestions[1])
+        self.assertIn("leave out the largest targets: B", suggestions[2])
+        # two roots on one volume need the archives twice
+        same_volume = preflight.check(estimates, "C:", ["C:"])
+        self.assertEqual(len(same_volume), 1)
+        self.assertEqual(same_volume[0]["needed"], 1900)
+        self.assertIn(
+            "remove C: from extra_output_dirs",
+            preflight.suggestions(estimates, same_volume[0], ["C:"]),
+        )
+
+    def test_check_concurrent_scratch(self):
+        preflight = winbackup.preflight.SpacePreflight(margin=0)
+        preflight.volume = lambda path: (0, 10000)
+        estimates = {
+            key: {"name": key, "archive": 100, "scratch": scratch}
+            for key, scratch in [("a", 500), ("b", 0), ("c", 300), ("d", 200)]
+        }
+        # the tarballs of the two largest tar targets can be in the output at once
+        self.assertEqual(preflight.check(estimates, "C:")[0]["scratch"], 500)
+        self.assertEqual(preflight.check(estimates, "C:", concurrent=2)[0]["scratch"], 800)
+        self.assertEqual(preflight.check(estimates, "C:", concurrent=8)[0]["needed"], 1400)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+##
+## tests for progress module
+##
+
+import unittest
+import threading
+import winbackup.progress
+
+
+class TestRunProgress(unittest.TestCase):
+    def test_byte_weighted(self):
+        run = winbackup.progress.RunProgress({"small": 100, "large": 900, "config": 0})
+        run.target("small").job("a")(1.0)
+        self.assertEqual(run.done_bytes(), 100)
+        run.target("large").job("a")(0.5)
+        self.assertEqual(run.done_bytes(), 550)
+        self.assertTrue(run.status().startswith("Overall 55%"))
+
+    def test_job_shares(self):
+        run = winbackup.progress.RunProgress({"t": 1000})
+        target = run.target("t")
+        target.job("tar", 0.5)(1.0)
+        target.job("7z", 0.5)(0.5)
+        self.assertEqual(run.done_bytes(), 750)
+        # a part of the target, e.g. the large files, scales its jobs
+        large = target.part(0.2)
+        large.job("segments")(0.5)
+        self.assertEqual(run.done_bytes(), 850)
+        # fractions are clipped
+        target.job("7z", 0.5)(7)
+        self.assertEqual(run.done_bytes(), 1000)
+
+    def test_finish(self):
+        run = winbackup.progress.RunProgress({"a": 10, "b": 30})
+        status = run.target("b").finish()
+        self.assertEqual(run.done_bytes(), 30)
+        self.assertTrue(status.startswith("Overall 75%"))
+        # finishing a target without a weight changes nothing
+        run.finish("unknown")
+        self.assertEqual(run.done_bytes(), 30)
+
+    def test_concurrent_jobs(self):
+        run = winbackup.progress.RunProgress({"t": 800}, refresh=0)
+        target = run.target("t")
+
+        def job(name):
+            report = target.job(name, 0.25)
+            for step in range(1, 101):
+                report(step / 100)
+
+        threads = [threading.Thread(target=job, args=(f"part{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertAlmostEqual(run.done_bytes(), 800)
+
+    def test_status_refresh(self):
+        run = winbackup.progress.RunProgress({"t": 100}, refresh=3600)
+        report = run.target("t").job("a")
+        first = report(0.1)
+        # not recomputed within the refresh interval
+        self.assertEqual(report(0.9), first)
+        self.assertNotEqual(run.target("t").finish(), first)
+
+    def test_eta(self):
+        run = winbackup.progress.RunProgress({"t": 1000}, smoothing=0.5)
+        self.assertIsNone(run.eta())
+        start = run.start_time
+        run.update("t", "a", 1, 0.1)
+        run.status(start + 10)  # 10 bytes/s
+        self.assertAlmostEqual(run.eta(), 90)
+        run.update("t", "a", 1, 0.5)
+        run.status(start + 20)  # 40 bytes/s, smoothed to 25
+        self.assertAlmostEqual(run.eta(), 20)
+
+    def test_quiet_logs_at_interval(self):
+        run = winbackup.progress.RunProgress({"t": 100}, quiet=True, refresh=0, log_interval=0)
+        with self.assertLogs(level="INFO") as logs:
+            run.target("t").job("a")(0.5)
+        self.assertIn("Overall 50%", logs.output[0])
+
+    def test_no_weights(self):
+        run = winbackup.progress.RunProgress({})
+        self.assertTrue(run.target("config").finish().startswith("Overall 0%"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
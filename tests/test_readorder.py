@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+##
+## tests for readorder module
+## run this file directly to benchmark reading a synthetic fragmented tree in each order:
+##   python tests/test_readorder.py [files] [file size KiB]
+##
+
+import unittest
+import os
+import sys
+import time
+import random
+import tempfile
+import winbackup.filescanner
+import winbackup.readorder
+
+
+def fake_entry(path: str, inode: int, dev: int = 1):
+    return winbackup.filescanner.FileEntry(path, "root", path, 1, 0.0, inode, dev)
+
+
+def make_fragmented_tree(path: str, files: int, file_size: int, chunk: int = 65536) -> None:
+    """
+    Files spread over folders in shuffled name order, written a chunk at a time round
+    robin and synced after each round so their extents are interleaved on disk.
+    """
+    names = [os.path.join(f"dir_{i % 16:02d}", f"file_{i:05d}.bin") for i in range(files)]
+    random.Random(0).shuffle(names)
+    for folder in {os.path.dirname(name) for name in names}:
+        os.makedirs(os.path.join(path, folder), exist_ok=True)
+    for _ in range(0, file_size, chunk):
+        for name in names:
+            with open(os.path.join(path, name), "ab") as fout:
+                fout.write(os.urandom(chunk))
+        # allocate the round on disk before the next one is written
+        if hasattr(os, "sync"):
+            os.sync()
+
+
+def drop_cache(path: str) -> bool:
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def read_all(entries: list, block_size: int = 1048576) -> float:
+    """
+    Read every file once from cold cache, returns bytes per second.
+    """
+    dropped = [drop_cache(entry.path) for entry in entries]
+    if not all(dropped):
+        print(" page cache not dropped on this platform - results are from cache")
+    total = 0
+    start = time.perf_counter()
+    for entry in entries:
+        with open(entry.path, "rb", buffering=0) as fin:
+            while True:
+                data = fin.read(block_size)
+                if not data:
+                    break
+                total += len(data)
+    return total / max(time.perf_counter() - start, 1e-9)
+
+
+class TestReadOrder(unittest.TestCase):
+    def test_directory_order_kept(self):
+        entries = [fake_entry("b", 2), fake_entry("a", 1)]
+        self.assertEqual(winbackup.readorder.ReadOrder().sort(entries), entries)
+
+    def test_inode_order(self):
+        entries = [fake_entry("c", 3), fake_entry("a", 9), fake_entry("b", 1, dev=0)]
+        ordered = winbackup.readorder.ReadOrder("inode").sort(entries)
+        # grouped by device, then file ID
+        self.assertEqual([entry.path for entry in ordered], ["b", "c", "a"])
+
+    def test_file_id_without_inode(self):
+        with tempfile.NamedTemporaryFile() as fout:
+            entry = fake_entry(fout.name, 0)
+            self.assertEqual(
+                winbackup.readorder.ReadOrder.file_id(entry), os.stat(fout.name).st_ino
+            )
+        self.assertEqual(winbackup.readorder.ReadOrder.file_id(fake_entry("missing", 0)), 0)
+
+    def test_extent_order(self):
+        reader = winbackup.readorder.ReadOrder("extent")
+        extents = {"a": 500, "b": None, "c": 100, "d": None}
+        reader.first_extent = extents.get
+        entries = [fake_entry(path, inode) for path, inode in zip("abcd", [1, 4, 3, 2])]
+        # files without extents first by file ID, then by disk position
+        self.assertEqual([entry.path for entry in reader.sort(entries)], list("dbca"))
+
+    def test_first_extent(self):
+        reader = winbackup.readorder.ReadOrder("extent")
+        self.assertIsNone(reader.first_extent("missing"))
+        with tempfile.TemporaryDirectory() as temp_directory:
+            make_fragmented_tree(temp_directory, 8, 131072)
+            entries = winbackup.filescanner.FileScanner().scan(temp_directory)
+            extents = [reader.first_extent(entry.path) for entry in entries]
+            if all(extent is None for extent in extents):
+                self.skipTest("filesystem does not report extents")
+            ordered = [reader.first_extent(entry.path) for entry in reader.sort(entries)]
+            self.assertEqual(ordered, sorted(ordered, key=lambda extent: extent or -1))
+
+    def test_invalid_order(self):
+        with self.assertRaises(ValueError):
+            winbackup.readorder.ReadOrder("random")
+
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    file_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 256) * 1024
+    with tempfile.TemporaryDirectory(dir=".") as temp_directory:
+        print(f"Writing {files} files of {file_size // 1024} KiB to {temp_directory} ...")
+        make_fragmented_tree(temp_directory, files, file_size)
+        entries = winbackup.filescanner.FileScanner().scan(temp_directory)
+        for order in winbackup.readorder.ReadOrder.orders:
+            start = time.perf_counter()
+            ordered = winbackup.readorder.ReadOrder(order).sort(entries)
+            sort_time = time.perf_counter() - start
+            rate = read_all(ordered)
+            print(f" {order:10s} {rate / 1048576:8.1f} MiB/s  (sorted in {sort_time:0.2f}s)")
+    sys.exit()
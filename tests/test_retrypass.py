@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+##
+## tests for retrypass module
+##
+
+import unittest
+import os
+import time
+import tempfile
+import unittest.mock
+import winbackup.restore
+import winbackup.retrypass
+import winbackup.zip7archiver
+from winbackup.filescanner import FileScanner
+
+
+class TestRetryPass(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.temp_directory.name, "Documents")
+        os.mkdir(self.folder)
+        self.paths = {}
+        for name in ["a.txt", "Outlook.pst", "places.sqlite"]:
+            self.paths[name] = os.path.join(self.folder, name)
+            with open(self.paths[name], "w") as fout:
+                fout.write(name)
+            os.utime(self.paths[name], (1000000000, 1000000000))
+        self.entries = FileScanner().scan(self.folder)
+        self.archiver = unittest.mock.Mock()
+        self.archiver.unread_files = []
+        self.archiver.member_name = winbackup.zip7archiver.Zip7Archiver.member_name
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def member_name(self, path: str) -> str:
+        return winbackup.zip7archiver.Zip7Archiver.member_name(path, self.folder)
+
+    def test_changed_files(self):
+        since = time.time()
+        self.assertEqual(winbackup.retrypass.RetryPass.changed_files(self.entries, since), [])
+        with open(self.paths["places.sqlite"], "a") as fout:
+            fout.write("more")
+        os.remove(self.paths["a.txt"])
+        self.assertEqual(
+            winbackup.retrypass.RetryPass.changed_files(self.entries, since - 1),
+            [self.paths["places.sqlite"]],
+        )
+
+    def test_wait_readable(self):
+        sleeps = []
+        retry = winbackup.retrypass.RetryPass(None, attempts=3, delay=5, sleep=sleeps.append)
+        locked = {self.paths["Outlook.pst"]}
+        opens = []
+
+        def readable(path: str) -> bool:
+            opens.append(path)
+            # the pst is released after the first attempt
+            return path not in locked or opens.count(path) > 1
+
+        with unittest.mock.patch.object(retry, "readable", readable):
+            ready, still_locked = retry.wait_readable(
+                [self.paths["Outlook.pst"], self.paths["a.txt"]]
+            )
+        self.assertEqual(ready, [self.paths["a.txt"], self.paths["Outlook.pst"]])
+        self.assertEqual(still_locked, [])
+        self.assertEqual(sleeps, [5])
+
+    def test_run(self):
+        since = time.time() - 1
+        with open(self.paths["places.sqlite"], "a") as fout:
+            fout.write("more")
+        retry = winbackup.retrypass.RetryPass(self.archiver, attempts=2, sleep=lambda s: None)
+        real_readable = retry.readable
+
+        def readable(path: str) -> bool:
+            return path != self.paths["a.txt"] and real_readable(path)
+
+        with unittest.mock.patch.object(retry, "readable", readable):
+            manifest = retry.run(
+                "PC_Docs.7z",
+                [(self.paths["Outlook.pst"], "locked"), (self.paths["a.txt"], "locked")],
+                self.entries,
+                since,
+                self.temp_directory.name,
+                self.member_name,
+                quiet=True,
+            )
+        self.archiver.backup_file_list.assert_called_once_with(
+            "PC_Docs_Retry.7z",
+            [self.paths["Outlook.pst"], self.paths["places.sqlite"]],
+            self.temp_directory.name,
+            "",
+            quiet=True,
+        )
+        self.assertEqual(manifest["archive"], "PC_Docs_Retry.7z")
+        self.assertEqual(
+            [(f["path"], f["reason"], f["result"]) for f in manifest["files"]],
+            [
+                (os.path.join("Documents", "Outlook.pst"), "locked", "retried"),
+                (os.path.join("Documents", "a.txt"), "locked", "failed"),
+                (
+                    os.path.join("Documents", "places.sqlite"),
+                    "changed while archived",
+                    "retried",
+                ),
+            ],
+        )
+
+    def test_nothing_to_retry(self):
+        retry = winbackup.retrypass.RetryPass(self.archiver)
+        manifest = retry.run(
+            "PC_Docs.7z", [], self.entries, time.time() + 1, self.folder, self.member_name
+        )
+        self.assertEqual(manifest["files"], [])
+        self.archiver.backup_file_list.assert_not_called()
+
+    def test_restore_retried(self):
+        backup_path = os.path.join(self.temp_directory.name, "backup")
+        out_folder = os.path.join(self.temp_directory.name, "restore", "PC_Docs")
+        os.makedirs(backup_path)
+        open(os.path.join(backup_path, "PC_Docs_Retry.7z"), "w").close()
+        member = winbackup.zip7archiver.Zip7Archiver.member_name(
+            self.paths["Outlook.pst"], self.folder, True
+        )
+
+        def extract_archive(archive_path, out, password, quiet=False):
+            os.makedirs(os.path.join(out, os.path.dirname(member)))
+            with open(os.path.join(out, member), "w") as fout:
+                fout.write("retried")
+
+        self.archiver.extract_archive.side_effect = extract_archive
+        manifest = {
+            "target": "PC_Docs.7z",
+            "archive": "PC_Docs_Retry.7z",
+            "files": [
+                {"path": "Documents/Outlook.pst", "member": member, "result": "retried"},
+                {"path": "Documents/a.txt", "member": "a.txt", "result": "failed"},
+            ],
+        }
+        restorer = winbackup.restore.Restorer(self.archiver, unittest.mock.Mock())
+        self.assertEqual(restorer.restore_retried(manifest, backup_path, out_folder), 1)
+        with open(os.path.join(out_folder, "Documents", "Outlook.pst")) as fin:
+            self.assertEqual(fin.read(), "retried")
+        self.assertFalse(
+            os.path.exists(os.path.join(self.temp_directory.name, "restore", ".retry_files"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+##
+## tests for runhistory module
+##
+
+import unittest
+import os
+import tempfile
+import winbackup.runhistory
+
+
+def target(name: str, duration: float, source_bytes=None, archive_bytes=0, status="ok"):
+    return {
+        "name": name,
+        "duration": duration,
+        "source_bytes": source_bytes,
+        "archive_bytes": archive_bytes,
+        "status": status,
+    }
+
+
+class TestRunHistory(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_directory.name, "history", "runs.json")
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_save_and_load(self):
+        history = winbackup.runhistory.RunHistory(self.path)
+        history.add_run({"10_documents": target("Documents", 60, 1000, 500)}, 1.0)
+        history.save()
+        loaded = winbackup.runhistory.RunHistory(self.path)
+        self.assertEqual(loaded.runs, history.runs)
+        self.assertEqual(loaded.keys(), ["10_documents"])
+
+    def test_unreadable_history_starts_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as fout:
+            fout.write("{not json")
+        self.assertEqual(winbackup.runhistory.RunHistory(self.path).runs, [])
+
+    def test_max_runs(self):
+        history = winbackup.runhistory.RunHistory(self.path, max_runs=3)
+        for i in range(5):
+            history.add_run({"a": target("A", i)})
+        self.assertEqual([run["targets"]["a"]["duration"] for run in history.runs], [2, 3, 4])
+
+    def test_estimate(self):
+        history = winbackup.runhistory.RunHistory(self.path, window=3)
+        self.assertIsNone(history.estimate("a"))
+        for duration in [1000, 10, 20, 30]:
+            history.add_run({"a": target("A", duration, duration * 100)})
+        history.add_run({"a": target("A", 5000, 1, status="failed")})
+        # median of the last 3 successful runs
+        self.assertEqual(history.estimate("a"), 20)
+        # throughput is 100 bytes/s in every run
+        self.assertAlmostEqual(history.estimate("a", 50000), 500)
+
+    def test_estimate_without_source_bytes(self):
+        history = winbackup.runhistory.RunHistory(self.path)
+        history.add_run({"a": target("A", 40)})
+        self.assertEqual(history.estimate("a", 50000), 40)
+
+    def test_order_longest_first(self):
+        history = winbackup.runhistory.RunHistory(self.path)
+        history.add_run({"a": target("A", 10), "b": target("B", 300), "c": target("C", 50)})
+        self.assertEqual(
+            history.order_longest_first(["a", "b", "c", "d"]), ["d", "b", "c", "a"]
+        )
+        self.assertEqual(history.order_longest_first([]), [])
+        # without history the key order is kept
+        empty = winbackup.runhistory.RunHistory(self.path + "x")
+        self.assertEqual(empty.order_longest_first(["b", "a"]), ["a", "b"])
+
+    def test_target_stats(self):
+        history = winbackup.runhistory.RunHistory(self.path)
+        self.assertIsNone(history.target_stats("a"))
+        history.add_run({"a": target("A", 100, 1000, 500)})
+        history.add_run({"a": target("A", 100, 1000, 400)})
+        history.add_run({"a": target("A", 150, 1500, 600)})
+        stats = history.target_stats("a")
+        self.assertEqual(stats["runs"], 3)
+        self.assertEqual(stats["last_duration"], 150)
+        self.assertEqual(stats["median_duration"], 100)
+        self.assertEqual(stats["throughput"], 10)
+        self.assertEqual(stats["ratio"], 0.4)
+        self.assertAlmostEqual(stats["trend"], 0.5)
+
+    def test_format_duration(self):
+        fmt = winbackup.runhistory.RunHistory.format_duration
+        self.assertEqual(fmt(42.4), "42s")
+        self.assertEqual(fmt(125), "2m 05s")
+        self.assertEqual(fmt(3 * 3600 + 7 * 60 + 30), "3h 07m")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
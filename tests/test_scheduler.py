@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+##
+## tests for scheduler module
+##
+
+import unittest
+import os
+import time
+import threading
+from tempfile import TemporaryDirectory
+import winbackup.scheduler
+
+DEVICES = {"docs": "C", "pictures": "C", "videos": "D", "vms": "E", "music": "D"}
+
+
+class TestDeviceScheduler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+        self.started = []
+
+    def _task(self, key: str) -> None:
+        device = DEVICES[key]
+        with self.lock:
+            self.started.append(key)
+            self.running[device] = self.running.get(device, 0) + 1
+            self.peak[device] = max(self.peak.get(device, 0), self.running[device])
+            self.peak["all"] = max(self.peak.get("all", 0), sum(self.running.values()))
+        time.sleep(0.05)
+        with self.lock:
+            self.running[device] -= 1
+
+    def _scheduler(self, max_workers: int, per_device: int = 1):
+        return winbackup.scheduler.DeviceScheduler(
+            max_workers, per_device, device_of=lambda path: DEVICES[path], poll=0.01
+        )
+
+    def test_one_target_per_device(self):
+        targets = [(key, key) for key in ["docs", "pictures", "videos", "music", "vms"]]
+        self._scheduler(4).run(targets, self._task)
+        self.assertEqual(sorted(self.started), sorted(DEVICES))
+        self.assertEqual(self.peak["C"], 1)
+        self.assertEqual(self.peak["D"], 1)
+        # docs, videos and vms are on different disks so start together
+        self.assertEqual(self.peak["all"], 3)
+        self.assertEqual(self.started[:3], ["docs", "videos", "vms"])
+
+    def test_per_device_and_max_workers(self):
+        targets = [(key, key) for key in ["docs", "pictures", "videos", "music", "vms"]]
+        self._scheduler(2, per_device=2).run(targets, self._task)
+        self.assertEqual(self.peak["all"], 2)
+        self.assertEqual(self.started[:2], ["docs", "pictures"])
+
+    def test_sequential(self):
+        order = ["vms", "docs", "pictures"]
+        self._scheduler(1).run([(key, key) for key in order], self._task)
+        self.assertEqual(self.started, order)
+        self.assertEqual(self.peak["all"], 1)
+
+    def test_target_without_path(self):
+        scheduler = self._scheduler(2)
+        self.assertEqual(scheduler.devices(None), frozenset())
+        self.assertEqual(scheduler.devices(["docs", "videos"]), frozenset({"C", "D"}))
+        self.assertEqual(
+            scheduler.group([("config", None), ("docs", "docs"), ("both", ["docs", "vms"])]),
+            {None: ["config"], "C": ["docs", "both"], "E": ["both"]},
+        )
+
+    def test_error_stops_run(self):
+        def task(key: str) -> None:
+            self._task(key)
+            if key == "docs":
+                raise RuntimeError("cancelled")
+
+        targets = [(key, key) for key in ["docs", "pictures", "videos"]]
+        with self.assertLogs(level="ERROR"):
+            with self.assertRaises(RuntimeError):
+                self._scheduler(2).run(targets, task)
+        # pictures waits for docs on the same disk and is not started after the error
+        self.assertNotIn("pictures", self.started)
+
+    def test_device(self):
+        with TemporaryDirectory() as temp_directory:
+            device = os.stat(temp_directory).st_dev
+            scheduler = winbackup.scheduler.DeviceScheduler()
+            self.assertEqual(scheduler.device(temp_directory), device)
+            # missing paths use their nearest existing folder
+            missing = os.path.join(temp_directory, "missing", "folder")
+            self.assertEqual(scheduler.device(missing), device)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            winbackup.scheduler.DeviceScheduler(max_workers=0)
+
+    def test_from_config(self):
+        scheduler = winbackup.scheduler.DeviceScheduler.from_config(
+            {"concurrent_targets": 3, "device_concurrency": 2}
+        )
+        self.assertEqual((scheduler.max_workers, scheduler.per_device), (3, 2))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+##
+## tests for segmentarchiver module
+##
+
+import unittest
+import io
+import os
+import hashlib
+import tempfile
+import winbackup.segmentarchiver
+
+
+class TestValidOutput(unittest.TestCase):
+    def setUp(self) -> None:
+        self.segment_archiver = winbackup.segmentarchiver.SegmentArchiver(
+            segment_size=65536, workers=2
+        )
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.temp_path = self.temp_directory.name
+        self.src_path = os.path.join(self.temp_path, "disk.vdi")
+        with open(self.src_path, "wb") as fout:
+            fout.write(os.urandom(65536 * 3 + 1000))
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_plan_segments_covers_file(self):
+        size = os.path.getsize(self.src_path)
+        response = self.segment_archiver.plan_segments(size, 65536)
+        with self.subTest(msg="number of segments"):
+            self.assertTrue(len(response) == 4)
+        with self.subTest(msg="segments cover the file"):
+            self.assertTrue(sum(length for _, length in response) == size)
+        with self.subTest(msg="last segment is the remainder"):
+            self.assertTrue(response[-1] == (65536 * 3, 1000))
+
+    def test_plan_segments_empty_file(self):
+        response = self.segment_archiver.plan_segments(0, 65536)
+        self.assertTrue(response == [(0, 0)])
+
+    def test_plan_segments_raises_valueerror(self):
+        with self.assertRaises(ValueError):
+            self.segment_archiver.plan_segments(100, 0)
+
+    def test_copy_segment_hash(self):
+        buffer = io.BytesIO()
+        response = self.segment_archiver.copy_segment(self.src_path, 65536, 65536, buffer)
+        self.assertTrue(response == hashlib.sha256(buffer.getvalue()).hexdigest())
+
+    def test_segments_reassemble_exactly(self):
+        size = os.path.getsize(self.src_path)
+        segments = []
+        for offset, length in self.segment_archiver.plan_segments(size, 65536):
+            buffer = io.BytesIO()
+            digest = self.segment_archiver.copy_segment(self.src_path, offset, length, buffer)
+            segments.append((offset, digest, buffer))
+        dst_path = os.path.join(self.temp_path, "restored.vdi")
+        with open(dst_path, "wb") as fout:
+            fout.truncate(size)
+        # write out of order as the parallel restore does
+        for offset, digest, buffer in reversed(segments):
+            buffer.seek(0)
+            response, _ = self.segment_archiver.write_segment(buffer, dst_path, offset)
+            self.assertTrue(response == digest)
+        with open(dst_path, "rb") as fin, open(self.src_path, "rb") as original:
+            self.assertTrue(fin.read() == original.read())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
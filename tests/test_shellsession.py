@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+##
+## tests for shellsession module
+## a posix sh stands in for powershell to test the framing
+##
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import winbackup.shellsession
+
+
+def process_running(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as fin:
+            return fin.read().split(")")[-1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@unittest.skipIf(shutil.which("sh") is None, "sh not available")
+class TestShellSession(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = winbackup.shellsession.ShellSession(["sh"], "sh")
+
+    def tearDown(self) -> None:
+        self.session.close()
+
+    def test_output_and_status(self):
+        output, returncode = self.session.run("echo hello; echo world")
+        self.assertEqual(output, b"hello\nworld\n")
+        self.assertEqual(returncode, 0)
+
+    def test_exit_status(self):
+        _, returncode = self.session.run("sh -c 'exit 3'")
+        self.assertEqual(returncode, 3)
+
+    def test_output_without_newline(self):
+        output, _ = self.session.run("printf 'no newline'")
+        self.assertEqual(output, b"no newline")
+
+    def test_empty_output(self):
+        output, returncode = self.session.run("true")
+        self.assertEqual(output, b"")
+        self.assertEqual(returncode, 0)
+
+    def test_session_reused(self):
+        first, _ = self.session.run("echo $$")
+        second, _ = self.session.run("echo $$")
+        self.assertEqual(first, second)
+
+    def test_timeout_restarts_session(self):
+        first, _ = self.session.run("echo $$")
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.session.run("sleep 10", timeout=0.2)
+        self.assertFalse(self.session.alive)
+        second, returncode = self.session.run("echo $$")
+        self.assertNotEqual(first, second)
+        self.assertEqual(returncode, 0)
+
+    def test_shell_exit_raises(self):
+        with self.assertRaises(winbackup.shellsession.ShellSessionError):
+            self.session.run("exit 0")
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "needs /proc")
+    def test_timeout_kills_started_commands(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            pid_path = os.path.join(temp_directory, "pid")
+            with self.assertRaises(subprocess.TimeoutExpired):
+                self.session.run(f"sh -c 'echo $$ > {pid_path}; exec sleep 30'", timeout=0.5)
+            with open(pid_path) as fin:
+                pid = int(fin.read())
+        # the sleep started by the shell is stopped with it, gone or a zombie
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and process_running(pid):
+            time.sleep(0.05)
+        self.assertFalse(process_running(pid))
+
+
+@unittest.skipIf(shutil.which("sh") is None, "sh not available")
+class TestShellPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = winbackup.shellsession.ShellPool(
+            ["sh"], "sh", max_sessions=2, enabled=True
+        )
+
+    def tearDown(self) -> None:
+        self.pool.close()
+
+    def test_session_command(self):
+        self.assertEqual(self.pool.run(["sh", "echo", "pooled"]), b"pooled\n")
+        self.assertEqual(len(self.pool._sessions), 1)
+
+    def test_arguments_quoted(self):
+        self.assertEqual(self.pool.run(["sh", "echo", "it's  a;test"]), b"it's  a;test\n")
+        # the one-shot fallback gets the same command line
+        self.assertEqual(
+            self.pool._one_shot(["sh", "echo", "it's  a;test"]), b"it's  a;test\n"
+        )
+
+    def test_powershell_command_line(self):
+        pool = winbackup.shellsession.ShellPool(enabled=False)
+        self.assertEqual(
+            pool.command_line(["powershell.exe", "Get-Process", "Plex Media Server"]),
+            "& 'Get-Process' 'Plex Media Server'",
+        )
+        self.assertEqual(
+            pool.command_line(
+                ["powershell.exe", "C:\\it's\\a.ps1", "-noimage", "--local-only"]
+            ),
+            "& 'C:\\it''s\\a.ps1' -noimage --local-only",
+        )
+
+    def test_other_commands_one_shot(self):
+        output = self.pool.run([sys.executable, "-c", "print('one shot')"])
+        self.assertEqual(output.strip(), b"one shot")
+        self.assertEqual(len(self.pool._sessions), 0)
+
+    def test_fallback_when_session_dies(self):
+        # the session exits, the command is rerun as a one-shot process
+        self.assertEqual(self.pool.run(["sh", "exit"]), b"")
+        self.assertTrue(self.pool.enabled)
+
+    def test_missing_shell_disables_pool(self):
+        pool = winbackup.shellsession.ShellPool(
+            [os.path.join("no", "such", "shell")], "sh", enabled=True
+        )
+        with self.assertRaises(OSError):
+            pool.run([os.path.join("no", "such", "shell"), "echo"])
+        self.assertFalse(pool.enabled)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+##
+## tests for staging module
+##
+
+import unittest
+import os
+import tempfile
+import winbackup.staging
+
+
+class TestArchiveStaging(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.out_path = os.path.join(self.temp_directory.name, "PC_user_2022-07-01")
+        os.mkdir(self.out_path)
+        state = os.path.join(self.temp_directory.name, ".winbackup_state")
+        self.staging_path = os.path.join(state, "partial", "PC_user_2022-07-01")
+        self.keep_path = os.path.join(state, "previous", "PC_user_2022-07-01")
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def _staging(self, policy: str = "delete") -> winbackup.staging.ArchiveStaging:
+        return winbackup.staging.ArchiveStaging(
+            self.out_path, self.staging_path, self.keep_path, policy
+        )
+
+    @staticmethod
+    def _write(folder: str, name: str, text: str) -> None:
+        with open(os.path.join(folder, name), "w") as fout:
+            fout.write(text)
+
+    @staticmethod
+    def _read(folder: str, name: str) -> str:
+        with open(os.path.join(folder, name)) as fin:
+            return fin.read()
+
+    def _old_run(self) -> None:
+        for name in ["Docs.7z.001", "Docs.7z.002", "Docs_Segments.manifest.json", "Music.7z"]:
+            self._write(self.out_path, name, "old")
+
+    def test_commit_replaces_old_archives(self):
+        self._old_run()
+        staging = self._staging()
+        folder = staging.begin("Docs.7z")
+        self._write(folder, "Docs.7z.001", "new")
+        self.assertEqual(
+            staging.commit("Docs.7z", ["Docs.7z", "Docs_Segments"]), ["Docs.7z.001"]
+        )
+        # the old second volume and manifest are gone, other targets untouched
+        self.assertEqual(sorted(os.listdir(self.out_path)), ["Docs.7z.001", "Music.7z"])
+        self.assertEqual(self._read(self.out_path, "Docs.7z.001"), "new")
+        self.assertFalse(os.path.exists(folder))
+
+    def test_discard_keeps_old_archives(self):
+        self._old_run()
+        staging = self._staging()
+        folder = staging.begin("Docs.7z")
+        self._write(folder, "Docs.7z.001", "partial")
+        staging.discard("Docs.7z")
+        self.assertEqual(self._read(self.out_path, "Docs.7z.001"), "old")
+        self.assertEqual(len(os.listdir(self.out_path)), 4)
+        self.assertFalse(os.path.exists(folder))
+        staging.cleanup()
+        self.assertFalse(os.path.exists(self.staging_path))
+
+    def test_begin_clears_interrupted_run(self):
+        staging = self._staging()
+        folder = staging.begin("Docs.7z")
+        self._write(folder, "Docs.7z.tar", "scratch")
+        self.assertEqual(os.listdir(staging.begin("Docs.7z")), [])
+
+    def test_keep_policy(self):
+        self._old_run()
+        staging = self._staging("keep")
+        for version in ["v1", "v2"]:
+            folder = staging.begin("Docs.7z")
+            self._write(folder, "Docs.7z", version)
+            staging.commit("Docs.7z", ["Docs.7z", "Docs_Segments"])
+        # only the version before the last is kept
+        self.assertEqual(os.listdir(self.keep_path), ["Docs.7z"])
+        self.assertEqual(self._read(self.keep_path, "Docs.7z"), "v1")
+        self.assertEqual(self._read(self.out_path, "Docs.7z"), "v2")
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            self._staging("shred")
+        with self.assertRaises(ValueError):
+            winbackup.staging.ArchiveStaging(self.out_path, self.staging_path, policy="keep")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
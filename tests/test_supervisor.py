@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+##
+## tests for supervisor module
+##
+
+import unittest
+import sys
+import subprocess
+import winbackup.supervisor
+import winbackup.zip7archiver
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+class TestProcessSupervisor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        # the watchdog thread never polls, sweep() is called by the tests
+        self.supervisor = winbackup.supervisor.ProcessSupervisor(
+            stall_timeout=10, poll=3600, clock=lambda: self.now
+        )
+        self.processes = []
+
+    def tearDown(self) -> None:
+        for process in self.processes:
+            process.kill()
+            process.wait()
+
+    def _start(self) -> subprocess.Popen:
+        process = subprocess.Popen(SLEEP)
+        self.processes.append(process)
+        self.supervisor.register(process)
+        return process
+
+    def test_stall(self):
+        watched = self._start()
+        unwatched = self._start()
+        self.supervisor.watch(watched)
+        self.now = 9
+        self.assertEqual(self.supervisor.sweep(), [])
+        self.supervisor.progress(watched)
+        self.now = 18
+        self.assertEqual(self.supervisor.sweep(), [])
+        self.now = 19
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(self.supervisor.sweep(), [watched])
+        self.assertIsNotNone(watched.poll())
+        self.assertIsNone(unwatched.poll())
+        with self.assertRaises(winbackup.supervisor.Stalled):
+            self.supervisor.check(watched)
+        # the reason is only raised once
+        self.supervisor.check(watched)
+
+    def test_deadline(self):
+        with self.supervisor.deadline(60):
+            process = self._start()
+            self.now = 59
+            self.assertEqual(self.supervisor.sweep(), [])
+            self.now = 60
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(self.supervisor.sweep(), [process])
+        self.assertIsNone(self.supervisor.deadline_at)
+        with self.assertRaises(winbackup.supervisor.TargetTimeout):
+            self.supervisor.check(process)
+
+    def test_no_deadline(self):
+        for seconds in (0, -5, None):
+            with self.supervisor.deadline(seconds):
+                self.assertIsNone(self.supervisor.deadline_at)
+
+    def test_cancel(self):
+        running = self._start()
+        with self.assertLogs(level="WARNING"):
+            self.supervisor.cancel()
+            late = self._start()
+        for process in (running, late):
+            self.assertIsNotNone(process.poll())
+            with self.assertRaises(winbackup.supervisor.Cancelled):
+                self.supervisor.check(process)
+
+    def test_child(self):
+        child = self.supervisor.child()
+        parent_process = self._start()
+        child_process = subprocess.Popen(SLEEP)
+        self.processes.append(child_process)
+        child.register(child_process)
+        with child.deadline(60):
+            self.now = 60
+            # the deadline of a child only applies to its own processes
+            self.assertEqual(self.supervisor.sweep(), [])
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(child.sweep(), [child_process])
+        self.assertIsNone(parent_process.poll())
+        with self.assertRaises(winbackup.supervisor.TargetTimeout):
+            child.check(child_process)
+        # cancelling the parent stops the children of its child supervisors
+        late = subprocess.Popen(SLEEP)
+        self.processes.append(late)
+        child.register(late)
+        with self.assertLogs(level="WARNING"):
+            self.supervisor.cancel()
+        self.assertIsNotNone(late.poll())
+        with self.assertRaises(winbackup.supervisor.Cancelled):
+            child.check(late)
+        self.assertTrue(self.supervisor.child().cancelled)
+
+    def test_finished_process_not_reported(self):
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        self.supervisor.register(process)
+        process.wait()
+        self.assertEqual(self.supervisor.sweep(), [])
+        self.assertEqual(self.supervisor.processes, {})
+        self.supervisor.check(process)
+
+
+class TestArchiverWatchdog(unittest.TestCase):
+    def test_stalled_archiver(self):
+        supervisor = winbackup.supervisor.ProcessSupervisor(stall_timeout=0.5, poll=0.1)
+        archiver = winbackup.zip7archiver.Zip7Archiver(process_supervisor=supervisor)
+        # a stand-in for 7z that prints progress, then hangs
+        script = "import time; print('  5%', flush=True); time.sleep(30)"
+        with self.assertLogs(level="WARNING"):
+            with self.assertRaises(winbackup.supervisor.Stalled):
+                archiver._archiver("test.7z", [sys.executable, "-c", script], quiet=True)
+
+    def test_watchdog_ends_with_children(self):
+        supervisor = winbackup.supervisor.ProcessSupervisor(poll=0.01)
+        for _ in range(2):
+            process = subprocess.Popen([sys.executable, "-c", "pass"])
+            supervisor.register(process)
+            thread = supervisor.thread
+            self.assertTrue(thread.is_alive())
+            process.wait()
+            supervisor.check(process)
+            # no thread is left behind per child supervisor or finished child
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            self.assertIsNone(supervisor.thread)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
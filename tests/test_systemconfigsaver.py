@@ -7,6 +7,7 @@
 import unittest
 import os
 import sys
+import time
 from tempfile import TemporaryDirectory
 import winbackup.systemconfigsaver
 
@@ -103,12 +104,14 @@ class TestValidOutput(unittest.TestCase):
             self.assertTrue(os.path.isdir(os.path.join(temp_directory, ".ssh")))
 
     def test_videos_directory_filenames(self):
-        with TemporaryDirectory() as temp_directory:
-            videos_path = temp_directory
+        with TemporaryDirectory() as temp_directory, TemporaryDirectory() as videos_path:
+            with open(os.path.join(videos_path, "video.mp4"), "wb") as fout:
+                fout.write(b"0" * 100)
             self.config_saver.save_videos_directory_filenames(temp_directory, videos_path)
-            with open(os.path.join(temp_directory, "videos_tree.txt"), "r") as fin:
-                line = fin.readlines()[0]
-                self.assertTrue("Folder" in line)
+            with open(os.path.join(temp_directory, "videos_inventory.csv"), "r") as fin:
+                lines = fin.read().splitlines()
+                self.assertEqual(lines[0], "path,size,mtime")
+                self.assertTrue(lines[1].startswith("video.mp4,100,"))
 
     def test_save_file_associations(self):
         with TemporaryDirectory() as temp_directory:
@@ -136,6 +139,63 @@ class TestValidOutput(unittest.TestCase):
         pass
 
 
+class TestCollectors(unittest.TestCase):
+    """
+    Collector framework tests, these use python as the command so run on any platform.
+    """
+
+    def setUp(self) -> None:
+        self.config_saver = winbackup.systemconfigsaver.SystemConfigSaver()
+
+    def _sleep_collector(self, seconds: float, timeout: float = None):
+        def collector(out_path):
+            self.config_saver._command_runner(
+                [sys.executable, "-c", f"import time; time.sleep({seconds})"], timeout=timeout
+            )
+
+        return collector
+
+    @staticmethod
+    def _failing_collector(out_path):
+        raise OSError("command not found")
+
+    def test_collector_status(self):
+        with TemporaryDirectory() as temp_directory:
+            report = self.config_saver.run_collectors(
+                [
+                    ("ok", "Ok", lambda out_path: None),
+                    ("skipped", "Skipped", lambda out_path: False),
+                    ("failed", "Failed", self._failing_collector),
+                    ("timeout", "Timeout", self._sleep_collector(10, timeout=0.2)),
+                ],
+                temp_directory,
+                quiet=True,
+            )
+        self.assertEqual(
+            [(result.name, result.status) for result in report],
+            [
+                ("ok", "ok"),
+                ("skipped", "skipped"),
+                ("failed", "failed"),
+                ("timeout", "timeout"),
+            ],
+        )
+        self.assertLess(report[3].duration, 5)
+
+    def test_collectors_run_concurrently(self):
+        collectors = [(f"sleep{i}", "Sleep", self._sleep_collector(0.5)) for i in range(4)]
+        with TemporaryDirectory() as temp_directory:
+            start = time.perf_counter()
+            report = self.config_saver.run_collectors(collectors, temp_directory, quiet=True)
+            duration = time.perf_counter() - start
+        self.assertTrue(all(result.status == "ok" for result in report))
+        self.assertLess(duration, 1.9)
+
+    def test_collectors_names_unique(self):
+        names = [name for name, _, _ in self.config_saver.collectors()]
+        self.assertEqual(len(names), len(set(names)))
+
+
 class TestReturnType(unittest.TestCase):
     def setUp(self) -> None:
         self.config_saver = winbackup.systemconfigsaver.SystemConfigSaver()
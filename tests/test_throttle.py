@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+##
+## tests for throttle module
+##
+
+import unittest
+import os
+import sys
+import subprocess
+import winbackup.throttle
+import winbackup.zip7archiver
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.slept = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+    def test_rate(self):
+        clock = FakeClock()
+        limiter = winbackup.throttle.BandwidthLimiter(
+            1000, clock=clock.time, sleep=clock.sleep
+        )
+        # the first second of data is the burst
+        self.assertEqual(limiter.consume(1000), 0)
+        self.assertAlmostEqual(limiter.consume(500), 0.5)
+        self.assertAlmostEqual(limiter.consume(2000), 2.0)
+        self.assertAlmostEqual(clock.now, 2.5)
+
+    def test_refill(self):
+        clock = FakeClock()
+        limiter = winbackup.throttle.BandwidthLimiter(
+            1000, clock=clock.time, sleep=clock.sleep
+        )
+        limiter.consume(1000)
+        clock.now += 10
+        # idle time refills up to the burst only
+        self.assertEqual(limiter.consume(1000), 0)
+        self.assertAlmostEqual(limiter.consume(100), 0.1)
+
+    def test_no_cap(self):
+        clock = FakeClock()
+        limiter = winbackup.throttle.BandwidthLimiter(0, clock=clock.time, sleep=clock.sleep)
+        self.assertEqual(limiter.consume(10**12), 0)
+        self.assertEqual(clock.slept, [])
+
+
+class TestRunProfile(unittest.TestCase):
+    def test_from_config(self):
+        profile = winbackup.throttle.RunProfile.from_config(
+            {"run_profile": "background", "background_bandwidth": 5000}
+        )
+        self.assertTrue(profile.background)
+        self.assertEqual(profile.limiter.rate, 5000)
+        self.assertEqual(profile.max_load, 0.75)
+        normal = winbackup.throttle.RunProfile.from_config({"background_bandwidth": 5000})
+        self.assertFalse(normal.background)
+        # the cap is only used in the background profile
+        self.assertEqual(normal.limiter.rate, 0)
+        with self.assertRaises(ValueError):
+            winbackup.throttle.RunProfile("turbo")
+
+    def test_normal_profile_unchanged(self):
+        profile = winbackup.throttle.RunProfile()
+        self.assertEqual(profile.popen_kwargs(), {})
+        self.assertEqual(profile.threads(16), 16)
+
+    def test_threads_follow_load(self):
+        profile = winbackup.throttle.RunProfile("background", max_load=0.5)
+        for load, threads in [(None, 8), (0.2, 8), (0.5, 8), (0.75, 4), (1.0, 1), (3.0, 1)]:
+            profile.system_load = lambda: load
+            self.assertEqual(profile.threads(8), threads, load)
+        profile.max_load = 1
+        self.assertEqual(profile.threads(8), 8)
+
+    @unittest.skipIf(sys.platform == "win32", "checks the nice value of a POSIX child")
+    def test_child_priority(self):
+        profile = winbackup.throttle.RunProfile("background", nice=5)
+        archiver = winbackup.zip7archiver.Zip7Archiver(profile=profile)
+        with archiver._popen(
+            [sys.executable, "-c", "import os; print(os.nice(0))"], stdout=subprocess.PIPE
+        ) as p:
+            child_nice = int(p.stdout.read())
+        self.assertEqual(child_nice, os.nice(0) + 5)
+
+    def test_archiver_thread_flag(self):
+        profile = winbackup.throttle.RunProfile("background")
+        profile.system_load = lambda: 1.0
+        archiver = winbackup.zip7archiver.Zip7Archiver(profile=profile)
+        calls = []
+
+        def fake_archiver(filename, args, quiet, **kwargs):
+            calls.append(args)
+            return 0, 0
+
+        archiver._archiver = fake_archiver
+        folder = os.path.dirname(os.path.abspath(__file__))
+        archiver.backup_folder("test.7z", folder, folder, split=False, quiet=True)
+        self.assertIn("-mmt=1", calls[0])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+##
+## tests for vmimage module
+##
+
+import unittest
+import io
+import os
+import tempfile
+import winbackup.vmimage
+import winbackup.segmentarchiver
+
+
+class TestValidOutput(unittest.TestCase):
+    def setUp(self) -> None:
+        self.block_size = 65536
+        self.reader = winbackup.vmimage.VMImageReader(block_size=self.block_size)
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.temp_path = self.temp_directory.name
+        self.image_path = os.path.join(self.temp_path, "disk.vhdx")
+        # data block, zero block, data block, sparse hole, trailing data block
+        self.data = [os.urandom(self.block_size) for _ in range(3)]
+        with open(self.image_path, "wb") as fout:
+            fout.write(self.data[0])
+            fout.write(bytes(self.block_size))
+            fout.write(self.data[1])
+            fout.seek(self.block_size * 8)
+            fout.write(self.data[2])
+        self.size = os.path.getsize(self.image_path)
+
+    def tearDown(self) -> None:
+        self.temp_directory.cleanup()
+
+    def test_is_vm_image(self):
+        with self.subTest(msg="vhdx is an image"):
+            self.assertTrue(self.reader.is_vm_image("C:/VMs/disk.VHDX"))
+        with self.subTest(msg="txt is not an image"):
+            self.assertFalse(self.reader.is_vm_image("C:/VMs/notes.txt"))
+
+    def test_iter_data_blocks_skips_zero_and_holes(self):
+        with open(self.image_path, "rb") as fin:
+            response = list(self.reader.iter_data_blocks(fin, 0, self.size))
+        with self.subTest(msg="offsets of data blocks"):
+            self.assertTrue(
+                [offset for offset, _ in response]
+                == [0, self.block_size * 2, self.block_size * 8]
+            )
+        with self.subTest(msg="block content"):
+            self.assertTrue([data for _, data in response] == self.data)
+
+    def test_data_ranges_within_bounds(self):
+        with open(self.image_path, "rb") as fin:
+            response = self.reader.data_ranges(fin.fileno(), 0, self.size)
+        self.assertTrue(all(0 <= start < end <= self.size for start, end in response))
+
+    def test_merge_extents(self):
+        extents = []
+        self.reader.merge_extents(extents, 0, 10)
+        self.reader.merge_extents(extents, 10, 10)
+        self.reader.merge_extents(extents, 40, 5)
+        self.assertTrue(extents == [[0, 20], [40, 5]])
+
+    def test_create_sparse_file(self):
+        path = os.path.join(self.temp_path, "sparse.vhdx")
+        self.reader.create_sparse_file(path, self.size)
+        self.assertTrue(os.path.getsize(path) == self.size)
+
+    def test_sparse_segments_restore_exactly(self):
+        segment_archiver = winbackup.segmentarchiver.SegmentArchiver(
+            segment_size=self.block_size * 4, reader=self.reader
+        )
+        segments = []
+        for offset, length in segment_archiver.plan_segments(self.size, self.block_size * 4):
+            buffer = io.BytesIO()
+            digest, extents = segment_archiver.copy_segment_extents(
+                self.image_path, offset, length, buffer
+            )
+            segments.append((digest, extents, buffer))
+        with self.subTest(msg="only data is packed"):
+            packed = sum(len(buffer.getvalue()) for _, _, buffer in segments)
+            self.assertTrue(packed == self.block_size * 3)
+        dst_path = os.path.join(self.temp_path, "restored.vhdx")
+        self.reader.create_sparse_file(dst_path, self.size)
+        for digest, extents, buffer in segments:
+            buffer.seek(0)
+            response, _ = segment_archiver.write_segment_extents(buffer, dst_path, extents)
+            self.assertTrue(response == digest)
+        with self.subTest(msg="restored image matches"):
+            with open(dst_path, "rb") as fin, open(self.image_path, "rb") as original:
+                self.assertTrue(fin.read() == original.read())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
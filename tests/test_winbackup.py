@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+##
+## tests for winbackup module
+##
+
+import unittest
+import os
+import tempfile
+import unittest.mock
+import winbackup.configagent
+import winbackup.filescanner
+import winbackup.winbackup
+
+
+class TestFileHashes(unittest.TestCase):
+    def test_logs_not_hashed(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            for name in [
+                "Documents.7z",
+                "winbackup.log",
+                "winbackup.log.1",
+                "winbackup.log.12",
+            ]:
+                with open(os.path.join(temp_directory, name), "wb") as fout:
+                    fout.write(os.urandom(64))
+            winbackup.winbackup.WinBackup._save_file_hashes(temp_directory)
+            with open(os.path.join(temp_directory, "sha256.txt")) as fin:
+                hashed = [line.split()[0] for line in fin]
+        # the current log and the rotated ones are still written after hashing
+        self.assertEqual(hashed, ["Documents.7z"])
+
+    def test_fan_out_skip(self):
+        skip = winbackup.winbackup.WinBackup._fan_out_skip
+        self.assertTrue(skip("sha256.txt"))
+        self.assertTrue(skip("winbackup.log.3"))
+        self.assertFalse(skip("Catalog.7z"))
+
+
+class TestTargetScans(unittest.TestCase):
+    def test_preflight_scan_reused(self):
+        scans = []
+        scanner = winbackup.filescanner.FileScanner()
+        backup = object.__new__(winbackup.winbackup.WinBackup)
+        backup.config_agent = winbackup.configagent.ConfigAgent()
+        backup.config_agent.global_config["composition_report"] = False
+        backup.scanner = unittest.mock.Mock(
+            scan=lambda paths: scans.append(paths) or scanner.scan(paths)
+        )
+        backup.target_scans = {}
+        # the archive step is left out, only the scans of the run are checked
+        backup._backup_target = lambda key, target, out_path, *args: "Documents.7z"
+        with tempfile.TemporaryDirectory() as temp_directory:
+            source = os.path.join(temp_directory, "Documents")
+            os.mkdir(source)
+            with open(os.path.join(source, "file.txt"), "wb") as fout:
+                fout.write(os.urandom(1024))
+            out_path = os.path.join(temp_directory, "out", "run")
+            os.makedirs(out_path)
+            target = dict(
+                backup.config_agent._base_config_item,
+                name="Documents",
+                path=source,
+                enabled=True,
+            )
+            config = {"05_documents": target}
+            self.assertTrue(backup.space_preflight(config, out_path, quiet=True))
+            backup.backup_run(config, out_path, "", quiet=True)
+        self.assertEqual(scans, [source])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
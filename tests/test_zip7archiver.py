@@ -6,8 +6,10 @@
 
 import unittest
 import os
+import sys
 import tempfile
 import winbackup.zip7archiver
+from winbackup.filescanner import FileEntry
 
 
 class TestValidArchive(unittest.TestCase):
@@ -81,6 +83,168 @@ class TestReturnType(unittest.TestCase):
         )
         self.assertTrue(type(response) == tuple)
 
+    def test_backup_folder_nothing_left_in_read_order(self):
+        # every file excluded (e.g. deduplicated), no main archive and no error
+        paths = [os.path.join(self.testdir_path, f) for f in os.listdir(self.testdir_path)]
+        response = self.archiver.backup_folder(
+            "test_backup_empty.7z",
+            self.testdir_path,
+            self.temp_path,
+            password="",
+            quiet=True,
+            exclude_paths=paths,
+            read_order="inode",
+        )
+        self.assertEqual(response, (0, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_path, "test_backup_empty.7z")))
+
+
+class TestPlanPartitions(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = os.path.abspath(os.path.join(os.sep, "data", "Documents"))
+
+    def _entry(self, relpath: str, size: int) -> FileEntry:
+        path = os.path.join(self.root, *relpath.split("/"))
+        return FileEntry(path, self.root, os.path.relpath(path, self.root), size, 0.0, 0, 0)
+
+    def test_partitions_balanced(self):
+        entries = [self._entry(f"dir{i}/file.bin", 100) for i in range(8)]
+        plan = winbackup.zip7archiver.Zip7Archiver.plan_partitions(entries, 4)
+        self.assertEqual(len(plan), 4)
+        self.assertEqual([partition["size"] for partition in plan], [200] * 4)
+
+    def test_partitions_cover_all_entries_once(self):
+        entries = [
+            self._entry("big/a/1.bin", 500),
+            self._entry("big/b/2.bin", 400),
+            self._entry("small/3.bin", 50),
+            self._entry("top.bin", 50),
+        ]
+        plan = winbackup.zip7archiver.Zip7Archiver.plan_partitions(entries, 2)
+        paths = [path for partition in plan for path in partition["paths"]]
+        for entry in entries:
+            covering = [
+                path for path in paths if os.path.commonpath([path, entry.path]) == path
+            ]
+            self.assertEqual(len(covering), 1)
+        self.assertEqual(sum(partition["size"] for partition in plan), 1000)
+        # the big folder is split so the parts are 500 / 500
+        self.assertEqual(sorted(partition["size"] for partition in plan), [500, 500])
+
+    def test_single_partition_is_root(self):
+        entries = [self._entry("a/1.bin", 10), self._entry("b/2.bin", 20)]
+        plan = winbackup.zip7archiver.Zip7Archiver.plan_partitions(entries, 1)
+        self.assertEqual(plan, [{"paths": [self.root], "size": 30}])
+
+    def test_more_partitions_than_files(self):
+        entries = [self._entry("a/1.bin", 10), self._entry("b/2.bin", 20)]
+        plan = winbackup.zip7archiver.Zip7Archiver.plan_partitions(entries, 5)
+        self.assertEqual(len(plan), 2)
+
+    def test_no_entries_no_partitions(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            response = winbackup.zip7archiver.Zip7Archiver().backup_partitions(
+                "test.7z", [], [], temp_directory, 4, quiet=True
+            )
+            self.assertEqual(response, (0, 0))
+            self.assertEqual(os.listdir(temp_directory), [])
+
+    def test_invalid_partitions(self):
+        with self.assertRaises(ValueError):
+            winbackup.zip7archiver.Zip7Archiver.plan_partitions([], 0)
+
+
+class TestProgress(unittest.TestCase):
+    def test_percent(self):
+        percent = winbackup.zip7archiver.Zip7Archiver._percent
+        self.assertEqual(percent("  0%"), 0)
+        self.assertEqual(percent(" 45% 12 + Documents\\file.txt"), 45)
+        self.assertEqual(percent("100%"), 100)
+        self.assertIsNone(percent("Compressed to 45% of input"))
+        self.assertIsNone(percent("%"))
+
+    def test_archiver_reports_progress(self):
+        # a stand-in for 7z printing -bsp1 progress lines
+        script = (
+            "print('  5%'); print(' 50% 3 + file'); print('Done at 90% speed'); print('100%')"
+        )
+        fractions = []
+        winbackup.zip7archiver.Zip7Archiver()._archiver(
+            "test.7z",
+            [sys.executable, "-c", script],
+            quiet=True,
+            progress=lambda fraction: fractions.append(fraction),
+        )
+        self.assertEqual(fractions, [0.05, 0.5, 1.0])
+
+    def test_progress_lines_sampled_in_log(self):
+        script = "print('Scanning'); [print(f'{i:3d}% + file') for i in range(101)]"
+        with self.assertLogs(level="DEBUG") as logs:
+            winbackup.zip7archiver.Zip7Archiver()._archiver(
+                "test.7z", [sys.executable, "-c", script], quiet=True
+            )
+        progress_lines = [line for line in logs.output if "test.7z progress:" in line]
+        self.assertEqual(len(progress_lines), 11)
+        self.assertIn("(9 progress lines not logged)", progress_lines[1])
+        self.assertTrue(any("archive line output: Scanning" in line for line in logs.output))
+
+
+class TestUnreadFiles(unittest.TestCase):
+    def _run(self, lines: list, returncode: int) -> winbackup.zip7archiver.Zip7Archiver:
+        # a stand-in for 7z printing its warning summary
+        script = f"import sys; print({chr(10).join(lines)!r}); sys.exit({returncode})"
+        archiver = winbackup.zip7archiver.Zip7Archiver()
+        with self.assertLogs(level="WARNING"):
+            archiver._archiver("test.7z", [sys.executable, "-c", script], quiet=True)
+        return archiver
+
+    def test_locked_files_collected(self):
+        archiver = self._run(
+            [
+                "Scan WARNINGS for files and folders:",
+                "",
+                "C:\\Users\\a\\Outlook.pst : The process cannot access the file",
+                "----------------",
+                "Archive size: 1000 bytes (1 KiB)",
+                "WARNINGS for files:",
+                "",
+                "C:\\Users\\a\\places.sqlite : Read error",
+                "----------------",
+            ],
+            1,
+        )
+        self.assertEqual(
+            archiver.unread_files,
+            [
+                ("C:\\Users\\a\\Outlook.pst", "The process cannot access the file"),
+                ("C:\\Users\\a\\places.sqlite", "Read error"),
+            ],
+        )
+
+    def test_read_errors_keep_finished_archive(self):
+        lines = ["ERRORS:", "C:\\vm\\disk.vhdx : locked a portion of the file", "---"]
+        archiver = self._run(lines + ["Archive size: 1000 bytes (1 KiB)"], 2)
+        self.assertEqual(len(archiver.unread_files), 1)
+        # without a finished archive the error is still fatal
+        with self.assertRaises(RuntimeError):
+            self._run(lines, 2)
+
+    def test_fatal_error_with_read_error(self):
+        lines = [
+            "ERROR: The process cannot access the file because it is locked",
+            "C:\\vm\\disk.vhdx",
+            "ERRORS:",
+            "C:\\vm\\disk.vhdx : locked a portion of the file",
+            "---",
+            "Archive size: 1000 bytes (1 KiB)",
+        ]
+        # the read error of a listed file alone keeps the archive
+        archiver = self._run(lines, 2)
+        self.assertEqual(len(archiver.unread_files), 1)
+        # any other error is still fatal
+        with self.assertRaises(RuntimeError):
+            self._run(lines + ["System ERROR:", "There is not enough space on the disk."], 2)
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -19,7 +19,6 @@ import logging
 import platform
 from argparse import ArgumentParser, RawTextHelpFormatter
 from . import __version__, __license__, __copyright__
-from . import winbackup
 
 DEFAULT_LOG_LEVEL = logging.INFO
 
@@ -48,6 +47,10 @@ def get_cli_args() -> dict:
     parser.add_argument("-c", "--configfile", help="supply a configuration file.", action="store_true")
     parser.add_argument("-C", "--create-configfile", help="Generate default configuration file. If no path given will save to CWD.", action="store_true")
     parser.add_argument("-i", "--interactive-config", help="Generate a configuration file interactively", action="store_true")
+    parser.add_argument("-r", "--restore", metavar="RESTORE_PATH", help="Restore the backup folder given as path to RESTORE_PATH.", type=str)
+    parser.add_argument("--restore-file", nargs=2, metavar=("FILE", "RESTORE_PATH"), help="Restore the files matching FILE (wildcards allowed) from the backup folder given as path to RESTORE_PATH.\nNeeds targets saved with solid_block_size.", type=str)
+    parser.add_argument("--skip-space-check", help="Start the backup even if the estimated size does not fit the free space.", action="store_true")
+    parser.add_argument("-s", "--stats", help="Show per-target durations, throughput and trends of past runs in the backup root given as path.", action="store_true")
     parser.add_argument("-q", "--quiet", help="Minimal terminal output.", action="store_true")
     parser.add_argument("-v", "--verbose", help="Enable verbose logging. Log will initially output to the CWD.", action="store_true")
     parser.add_argument("-V", "--version", action="version", version=__version__)
@@ -70,13 +73,28 @@ def cli():
     else:
         log_level = DEFAULT_LOG_LEVEL
 
+    # imported after parsing so -V and -h don't load the backup modules and dependencies
+    from . import winbackup
+
     win_backup = winbackup.WinBackup(log_level)
     if cli_args["configfile"]:
         win_backup.run_from_config_file(
             path,
             quiet=cli_args["quiet"],
             auto_confirm=cli_args["autoconfirm"],
+            skip_space_check=cli_args["skip_space_check"],
+        )
+    elif cli_args["restore"]:
+        win_backup.run_restore(path, cli_args["restore"], quiet=cli_args["quiet"])
+    elif cli_args["restore_file"]:
+        win_backup.run_restore(
+            path,
+            cli_args["restore_file"][1],
+            quiet=cli_args["quiet"],
+            file_pattern=cli_args["restore_file"][0],
         )
+    elif cli_args["stats"]:
+        win_backup.show_stats(path)
     elif cli_args["create_configfile"]:
         win_backup.generate_blank_configfile(path)
     elif cli_args["interactive_config"]:
@@ -87,6 +105,7 @@ def cli():
             all_selected=cli_args["all"],
             quiet=cli_args["quiet"],
             auto_confirm=cli_args["autoconfirm"],
+            skip_space_check=cli_args["skip_space_check"],
         )
 
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import fnmatch
+import logging
+
+
+class ArchiveIndex:
+    # the 7z signature header in front of the packed streams
+    signature_header_size = 32
+
+    def __init__(self, archiver=None) -> None:
+        """
+        Offset index of archives written with bounded solid blocks (target config
+        solid_block_size). Maps each file to its archive, solid block and the volumes
+        holding that block, so a single file is restored by decompressing one block
+        instead of every block in front of it.
+        The blocks are taken from the 7z technical listing: the packed streams follow
+        the signature header in block order and the packed size of a block is listed
+        on its first file.
+        """
+        self.archiver = archiver
+
+    @staticmethod
+    def parse_listing(lines: list) -> list:
+        """
+        File records of a 7z technical listing (7z l -slt) as dicts of its key = value
+        lines, the archive properties in front of the file records are skipped.
+        """
+        records = []
+        record = None
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if record is None:
+                if line.startswith("----------"):
+                    record = {}
+                continue
+            if len(line.strip()) == 0:
+                if len(record) != 0:
+                    records.append(record)
+                record = {}
+            elif " = " in line or line.endswith(" ="):
+                key, _, value = line.partition(" =")
+                record[key] = value.strip()
+        if record:
+            records.append(record)
+        return records
+
+    @staticmethod
+    def volume_files(archive_path: str) -> list:
+        """
+        Paths of the volumes of an archive, the archive itself if it is not split.
+        archive_path is the .7z or the first .7z.001 volume.
+        """
+        if not archive_path.endswith(".001"):
+            return [archive_path]
+        stem = archive_path[:-4]
+        volumes = []
+        while os.path.exists(f"{stem}.{len(volumes) + 1:03d}"):
+            volumes.append(f"{stem}.{len(volumes) + 1:03d}")
+        return volumes
+
+    @classmethod
+    def index_listing(cls, archive: str, records: list, volume_size: int = 0) -> dict:
+        """
+        Index of one archive from its listing records.
+        volume_size is the size of every volume but the last, 0 if not split.
+        """
+        blocks = {}
+        files = {}
+        for record in records:
+            if record.get("Folder") == "+" or record.get("Block", "") == "":
+                continue
+            block = int(record["Block"])
+            packed = int(record.get("Packed Size") or 0)
+            size = int(record.get("Size") or 0)
+            unpacked = blocks.setdefault(block, {"packed_size": 0, "size": 0})
+            unpacked["packed_size"] = max(unpacked["packed_size"], packed)
+            files[record["Path"]] = {"size": size, "block": block, "offset": unpacked["size"]}
+            unpacked["size"] += size
+        offset = cls.signature_header_size
+        index_blocks = []
+        for number in range(max(blocks, default=-1) + 1):
+            block = blocks.get(number, {"packed_size": 0, "size": 0})
+            end = offset + max(block["packed_size"], 1) - 1
+            index_blocks.append(
+                {
+                    "offset": offset,
+                    "packed_size": block["packed_size"],
+                    "size": block["size"],
+                    "first_volume": offset // volume_size + 1 if volume_size else 1,
+                    "last_volume": end // volume_size + 1 if volume_size else 1,
+                }
+            )
+            offset += block["packed_size"]
+        return {
+            "archive": archive,
+            "volume_size": volume_size,
+            "blocks": index_blocks,
+            "files": files,
+        }
+
+    def index_archive(self, archive_path: str, password: str = "") -> dict:
+        """
+        Index of an archive written by 7z, listed with the archiver.
+        """
+        volumes = self.volume_files(archive_path)
+        volume_size = os.path.getsize(volumes[0]) if len(volumes) > 1 else 0
+        records = self.parse_listing(self.archiver.list_archive(archive_path, password))
+        index = self.index_listing(os.path.basename(archive_path), records, volume_size)
+        index["volumes"] = len(volumes)
+        logging.debug(
+            f"Indexed {len(index['files'])} files in {len(index['blocks'])} blocks "
+            + f"of {index['archive']}"
+        )
+        return index
+
+    def build(self, target: str, archive_paths: list, password: str = "") -> dict:
+        """
+        Index of the archives of a target, saved as its Index manifest.
+        """
+        return {
+            "version": 1,
+            "target": target,
+            "archives": [self.index_archive(path, password) for path in archive_paths],
+        }
+
+    @staticmethod
+    def _normalise(path: str) -> str:
+        return path.replace("\\", "/").strip("/").lower()
+
+    @classmethod
+    def lookup(cls, index: dict, pattern: str) -> list:
+        """
+        Files of the index matching pattern, an archive path or wildcard compared case
+        insensitively with either path separator. Returns [(archive index, path, entry)].
+        """
+        pattern = cls._normalise(pattern)
+        matches = []
+        for archive in index["archives"]:
+            for path, entry in archive["files"].items():
+                if fnmatch.fnmatchcase(cls._normalise(path), pattern):
+                    matches.append((archive, path, entry))
+        return matches
+
+    @staticmethod
+    def volumes_needed(archive: dict, block: int) -> list:
+        """
+        Volume numbers read to restore a file of block, the block's volumes and the last
+        volume holding the archive headers.
+        """
+        block = archive["blocks"][block]
+        needed = set(range(block["first_volume"], block["last_volume"] + 1))
+        needed.add(archive.get("volumes", block["last_volume"]))
+        return sorted(needed)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    from . import zip7archiver
+
+    index = ArchiveIndex(zip7archiver.Zip7Archiver()).build("demo.7z", [sys.argv[1]])
+    for archive, path, entry in ArchiveIndex.lookup(index, sys.argv[2]):
+        print(path, entry, ArchiveIndex.volumes_needed(archive, entry["block"]))
+    sys.exit()
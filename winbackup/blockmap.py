@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import vmimage
+from . import throttle
+
+
+class BlockMap:
+    def __init__(
+        self,
+        block_size: int = 4194304,
+        workers: int = None,
+        max_chain: int = 7,
+        profile: throttle.RunProfile = None,
+    ):
+        """
+        Block level change tracking for VM disk images.
+        An image is hashed in fixed size blocks (in parallel), the map is compared with the
+        map kept from the previous run and only the changed blocks need archiving.
+        All zero blocks and sparse holes are stored as None in the map.
+        After max_chain incremental runs a full backup is taken to bound the restore chain.
+        Hashing reads are throttled and the workers reduced as set by the run profile.
+        """
+        self.block_size = block_size
+        self.reader = vmimage.VMImageReader(block_size)
+        if workers is None:
+            workers = os.cpu_count() or 2
+        self.workers = workers
+        self.max_chain = max_chain
+        self.profile = throttle.RunProfile() if profile is None else profile
+        # version 2 hashes every data run of a block, maps of version 1 are not used
+        self.map_version = 2
+
+    @staticmethod
+    def image_id(path: str) -> str:
+        """
+        Stable id for an image path, used to name the saved map without leaking the path.
+        """
+        return hashlib.sha1(
+            os.path.normcase(os.path.abspath(path)).encode("utf-8")
+        ).hexdigest()
+
+    def _hash_range(self, path: str, start: int, end: int) -> dict:
+        # a block with holes is read as several data runs, all of them go into the
+        # block's hash with their offset in the block
+        hashers = {}
+        with open(path, "rb", buffering=0) as fin:
+            for offset, data in self.reader.iter_data_blocks(fin, start, end):
+                self.profile.limit(len(data))
+                hasher = hashers.setdefault(
+                    offset // self.block_size, hashlib.blake2b(digest_size=16)
+                )
+                hasher.update((offset % self.block_size).to_bytes(8, "little"))
+                hasher.update(len(data).to_bytes(8, "little"))
+                hasher.update(data)
+        return {index: hasher.hexdigest() for index, hasher in hashers.items()}
+
+    def hash_image(self, path: str) -> dict:
+        """
+        Hash the image in blocks using all workers, each worker reads its own range.
+        Returns the block map dict (size, block_size, hashes).
+        """
+        size = os.path.getsize(path)
+        num_blocks = -(-size // self.block_size)
+        hashes = [None] * num_blocks
+        workers = self.profile.threads(self.workers)
+        # several ranges per worker keeps the workers busy if some ranges are sparse
+        num_ranges = max(1, min(num_blocks, workers * 4))
+        blocks_per_range = -(-num_blocks // num_ranges) if num_blocks else 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    self._hash_range,
+                    path,
+                    first * self.block_size,
+                    min((first + blocks_per_range) * self.block_size, size),
+                )
+                for first in range(0, num_blocks, max(blocks_per_range, 1))
+            ]
+            for future in futures:
+                for index, digest in future.result().items():
+                    hashes[index] = digest
+        logging.debug(
+            f"Block map of {path}: {num_blocks} blocks, "
+            + f"{sum(1 for h in hashes if h is not None)} with data"
+        )
+        return {
+            "version": self.map_version,
+            "size": size,
+            "block_size": self.block_size,
+            "hashes": hashes,
+        }
+
+    @staticmethod
+    def changed_blocks(new_map: dict, old_map: dict = None) -> list:
+        """
+        Returns the indices of blocks with data that differ from old_map.
+        Every data block is returned if there is no usable old map.
+        """
+        if old_map is None or old_map["block_size"] != new_map["block_size"]:
+            return [i for i, digest in enumerate(new_map["hashes"]) if digest is not None]
+        old_hashes = old_map["hashes"]
+        return [
+            i
+            for i, digest in enumerate(new_map["hashes"])
+            if digest is not None and (i >= len(old_hashes) or old_hashes[i] != digest)
+        ]
+
+    def block_extents(self, block_map: dict, indices: list) -> list:
+        """
+        Convert block indices to merged [offset, length] extents within the image size.
+        """
+        extents = []
+        for index in indices:
+            offset = index * block_map["block_size"]
+            length = min(block_map["block_size"], block_map["size"] - offset)
+            self.reader.merge_extents(extents, offset, length)
+        return extents
+
+    def load_previous(self, state_dir: str, image_id: str) -> dict:
+        """
+        Load the map saved by the last successful run, None if there is none.
+        """
+        path = os.path.join(state_dir, f"{image_id}.json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as fin:
+                old_map = json.load(fin)
+        except Exception as e:
+            logging.error(
+                f"Could not load block map {path} - full backup taken. Exception {e}"
+            )
+            return None
+        if old_map.get("version") != self.map_version:
+            return None
+        return old_map
+
+    @staticmethod
+    def save(state_dir: str, image_id: str, block_map: dict) -> str:
+        os.makedirs(state_dir, exist_ok=True)
+        path = os.path.join(state_dir, f"{image_id}.json")
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as fout:
+            json.dump(block_map, fout)
+        os.replace(temp_path, path)
+        return path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    block_map = BlockMap().hash_image(sys.argv[1])
+    print(f"{len(block_map['hashes'])} blocks")
+    sys.exit()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+from typing import Callable, Union
+
+from . import configsink
+
+
+class CollectorCache:
+    CACHED = "cached"
+
+    def __init__(self, cache_dir: str) -> None:
+        """
+        Keeps the output of slow config collectors between runs.
+        A collector is only run again when its TTL has passed or its trigger value
+        (e.g. a registry key timestamp) changed. Outputs are stored with sha256 hashes,
+        if a rerun gives the same content the stored copy is kept rather than rewritten.
+        Cached files are hard linked (copied if linking fails) into the config folder
+        or added to the in-memory sink.
+        """
+        self.cache_dir = cache_dir
+        self.cache_version = 1
+
+    @staticmethod
+    def hash_tree(path: str) -> dict:
+        """
+        Returns {relative path: sha256} of every file under path.
+        """
+        hashes = {}
+        for dirpath, _, files in os.walk(path):
+            for file in files:
+                file_path = os.path.join(dirpath, file)
+                sha256 = hashlib.sha256()
+                with open(file_path, "rb") as fin:
+                    for block in iter(lambda: fin.read(1048576), b""):
+                        sha256.update(block)
+                hashes[os.path.relpath(file_path, path)] = sha256.hexdigest()
+        return hashes
+
+    def _load_meta(self, name: str) -> dict:
+        meta_path = os.path.join(self.cache_dir, f"{name}.json")
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as fin:
+                meta = json.load(fin)
+        except Exception as e:
+            logging.debug(f"Collector cache {meta_path} unreadable - {e}")
+            return None
+        if meta.get("version") != self.cache_version:
+            return None
+        return meta
+
+    def _save_meta(self, name: str, meta: dict) -> None:
+        meta_path = os.path.join(self.cache_dir, f"{name}.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as fout:
+            json.dump(meta, fout, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def is_fresh(self, meta: dict, ttl: float, trigger_value=None) -> bool:
+        """
+        A cached output is fresh if it is younger than ttl and the trigger value
+        has not changed. A trigger value of None (unknown) is not compared.
+        """
+        if meta is None:
+            return False
+        if time.time() - meta["time"] >= ttl:
+            return False
+        if trigger_value is not None and meta.get("trigger") != trigger_value:
+            return False
+        return True
+
+    @staticmethod
+    def _publish(entry_dir: str, files: dict, out_path) -> None:
+        sink = configsink.as_sink(out_path)
+        for relpath in files:
+            sink.add_file(relpath, os.path.join(entry_dir, relpath))
+
+    def run(
+        self,
+        name: str,
+        function: Callable,
+        out_path: str,
+        ttl: float,
+        trigger: Callable = None,
+    ) -> Union[bool, str, None]:
+        """
+        Run the collector function unless its cached output is still fresh.
+        The collector writes into a staging folder that replaces the stored output
+        only if the content hashes differ.
+        Returns CollectorCache.CACHED if the stored output was used, else the collector result.
+        """
+        trigger_value = None
+        if trigger is not None:
+            try:
+                trigger_value = trigger()
+            except Exception as e:
+                logging.debug(f"Collector cache trigger for {name} failed - {e}")
+        entry_dir = os.path.join(self.cache_dir, name)
+        meta = self._load_meta(name)
+        if os.path.isdir(entry_dir) and self.is_fresh(meta, ttl, trigger_value):
+            logging.debug(f"Collector cache hit - {name}")
+            self._publish(entry_dir, meta["files"], out_path)
+            return self.CACHED
+
+        staging_dir = entry_dir + ".new"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        try:
+            result = function(staging_dir)
+            files = self.hash_tree(staging_dir)
+            if meta is not None and os.path.isdir(entry_dir) and meta["files"] == files:
+                logging.debug(f"Collector cache - {name} output unchanged")
+            else:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(staging_dir, entry_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self._save_meta(
+            name,
+            {
+                "version": self.cache_version,
+                "time": time.time(),
+                "trigger": trigger_value,
+                "files": files,
+            },
+        )
+        self._publish(entry_dir, files, out_path)
+        return result
+
+    def invalidate(self, name: str = None) -> None:
+        """
+        Drop the cached output of one collector, or of all collectors if name is None.
+        """
+        if name is None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            return
+        shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+        meta_path = os.path.join(self.cache_dir, f"{name}.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    for file in sorted(os.listdir(sys.argv[1])):
+        if file.endswith(".json"):
+            with open(os.path.join(sys.argv[1], file), "r", encoding="utf-8") as fin:
+                meta = json.load(fin)
+            age = (time.time() - meta["time"]) / 3600
+            print(f"{file[:-5]:<20} {age:6.1f} hours old, {len(meta['files'])} files")
+    sys.exit()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import html
+import json
+import logging
+from datetime import datetime
+import humanize
+
+from . import preflight
+
+
+class CompositionReport:
+    def __init__(
+        self,
+        top: int = 20,
+        big_file_threshold: int = 268435456,
+        max_depth: int = 3,
+        sampler: preflight.SpacePreflight = None,
+    ) -> None:
+        """
+        Where the bytes and the time of each target go, from the file scan and the
+        archive sizes and durations of the run:
+        - the top largest directories, up to max_depth levels under the target root
+        - the extensions that compress worst, by a sample compressed per extension and
+          scaled so they add up to the real archive size
+        - files of at least big_file_threshold bytes
+        - estimated time share of targets, directories and extensions, time within a
+          target is shared by bytes
+        Saved as JSON and HTML next to sha256.txt.
+        """
+        self.top = top
+        self.big_file_threshold = big_file_threshold
+        self.max_depth = max_depth
+        self.sampler = (
+            preflight.SpacePreflight(sample_bytes=1048576, sample_files=8)
+            if sampler is None
+            else sampler
+        )
+
+    @staticmethod
+    def extension(path: str) -> str:
+        extension = os.path.splitext(path)[1].lower()
+        return extension if extension else "(none)"
+
+    def directories(self, entries: list) -> list:
+        """
+        Largest directories by the bytes of all files under them.
+        """
+        sizes = {}
+        for entry in entries:
+            parts = entry.relpath.replace("\\", "/").split("/")[:-1]
+            for depth in range(1, min(len(parts), self.max_depth) + 1):
+                directory = os.path.join(entry.root, *parts[:depth])
+                size, files = sizes.get(directory, (0, 0))
+                sizes[directory] = (size + entry.size, files + 1)
+        largest = sorted(sizes.items(), key=lambda item: item[1][0], reverse=True)
+        return [
+            {"path": path, "bytes": size, "files": files}
+            for path, (size, files) in largest[: self.top]
+        ]
+
+    def extensions(self, entries: list, archive_bytes: int = None) -> list:
+        """
+        Extensions of the most bytes, worst compressing first. The sampled ratios are
+        scaled so the estimate of the whole target matches archive_bytes if it is known.
+        """
+        groups = {}
+        for entry in entries:
+            groups.setdefault(self.extension(entry.path), []).append(entry)
+        by_bytes = sorted(
+            groups.items(), key=lambda item: sum(e.size for e in item[1]), reverse=True
+        )
+        sampled = {
+            extension: self.sampler.sample_ratio(group)
+            for extension, group in by_bytes[: self.top * 3]
+        }
+        total = sum(entry.size for entry in entries)
+        estimate = sum(
+            sum(e.size for e in group) * sampled.get(extension, 1.0)
+            for extension, group in groups.items()
+        )
+        scale = archive_bytes / estimate if archive_bytes and estimate > 0 else 1.0
+        rows = []
+        for extension, ratio in sampled.items():
+            size = sum(e.size for e in groups[extension])
+            ratio = min(1.0, ratio * scale)
+            rows.append(
+                {
+                    "extension": extension,
+                    "files": len(groups[extension]),
+                    "bytes": size,
+                    "ratio": ratio,
+                    "est_archive_bytes": int(size * ratio),
+                    "share": size / total if total > 0 else 0,
+                }
+            )
+        rows.sort(key=lambda row: (row["ratio"], row["bytes"]), reverse=True)
+        return rows[: self.top]
+
+    def big_files(self, entries: list) -> list:
+        big = sorted(
+            (entry for entry in entries if entry.size >= self.big_file_threshold),
+            key=lambda entry: entry.size,
+            reverse=True,
+        )
+        return [{"path": entry.path, "bytes": entry.size} for entry in big]
+
+    def target_report(
+        self, name: str, stats: dict, entries: list = None, retried: list = None
+    ) -> dict:
+        """
+        Report of one target. stats is its run history entry (duration, source_bytes,
+        archive_bytes, status), entries its FileScanner scan or None if not scanned,
+        retried the files locked or changing while archived from its Retry manifest.
+        """
+        report = {
+            "name": name,
+            "status": stats["status"],
+            "duration": stats["duration"],
+            "source_bytes": stats["source_bytes"],
+            "archive_bytes": stats["archive_bytes"],
+            "directories": [],
+            "extensions": [],
+            "big_files": [],
+            "retried_files": retried or [],
+        }
+        if entries is None or len(entries) == 0:
+            return report
+        total = sum(entry.size for entry in entries)
+        seconds_per_byte = stats["duration"] / total if total > 0 else 0
+        report["directories"] = self.directories(entries)
+        report["extensions"] = self.extensions(entries, stats["archive_bytes"])
+        report["big_files"] = self.big_files(entries)
+        for row in report["directories"] + report["extensions"] + report["big_files"]:
+            row["est_seconds"] = row["bytes"] * seconds_per_byte
+        return report
+
+    def build(self, run_stats: dict, scans: dict, retried: dict = None) -> dict:
+        """
+        Report of a run. run_stats is {key: run history entry}, scans {key: entries},
+        retried {key: Retry manifest files}.
+        """
+        retried = retried or {}
+        targets = {
+            key: self.target_report(stats["name"], stats, scans.get(key), retried.get(key))
+            for key, stats in sorted(run_stats.items())
+        }
+        total_time = sum(target["duration"] for target in targets.values())
+        for target in targets.values():
+            target["time_share"] = target["duration"] / total_time if total_time > 0 else 0
+        return {
+            "version": 1,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "big_file_threshold": self.big_file_threshold,
+            "targets": targets,
+        }
+
+    @staticmethod
+    def _table(headers: list, rows: list) -> str:
+        lines = ["<table>", "<tr>" + "".join(f"<th>{h}</th>" for h in headers) + "</tr>"]
+        for row in rows:
+            lines.append(
+                "<tr>"
+                + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row)
+                + "</tr>"
+            )
+        lines.append("</table>")
+        return "\n".join(lines)
+
+    @classmethod
+    def to_html(cls, report: dict) -> str:
+        def size(value) -> str:
+            return "-" if value is None else humanize.naturalsize(value, True)
+
+        def seconds(value) -> str:
+            return f"{value:0.0f}s"
+
+        parts = [
+            "<!DOCTYPE html>",
+            "<html><head><meta charset='utf-8'><title>WinBackup composition report</title>",
+            "<style>body{font-family:sans-serif} table{border-collapse:collapse;"
+            + "margin-bottom:1em} td,th{border:1px solid #ccc;padding:2px 8px;"
+            + "text-align:left}</style></head><body>",
+            f"<h1>WinBackup composition report - {report['created']}</h1>",
+            cls._table(
+                ["Target", "Status", "Source", "Archive", "Duration", "Time share"],
+                [
+                    [
+                        t["name"],
+                        t["status"],
+                        size(t["source_bytes"]),
+                        size(t["archive_bytes"]),
+                        seconds(t["duration"]),
+                        f"{t['time_share'] * 100:0.1f}%",
+                    ]
+                    for t in report["targets"].values()
+                ],
+            ),
+        ]
+        for target in report["targets"].values():
+            if len(target["directories"]) == 0 and len(target["retried_files"]) == 0:
+                continue
+            parts.append(f"<h2>{html.escape(target['name'])}</h2>")
+            if len(target["retried_files"]) != 0:
+                parts.append("<h3>Locked or changed files</h3>")
+                parts.append(
+                    cls._table(
+                        ["File", "Reason", "Result"],
+                        [
+                            [f["path"], f["reason"], f["result"]]
+                            for f in target["retried_files"]
+                        ],
+                    )
+                )
+            if len(target["directories"]) == 0:
+                continue
+            parts.append("<h3>Largest directories</h3>")
+            parts.append(
+                cls._table(
+                    ["Directory", "Size", "Files", "Est. time"],
+                    [
+                        [d["path"], size(d["bytes"]), d["files"], seconds(d["est_seconds"])]
+                        for d in target["directories"]
+                    ],
+                )
+            )
+            parts.append("<h3>Worst compressing extensions</h3>")
+            parts.append(
+                cls._table(
+                    ["Extension", "Files", "Size", "Est. archive", "Ratio", "Est. time"],
+                    [
+                        [
+                            e["extension"],
+                            e["files"],
+                            size(e["bytes"]),
+                            size(e["est_archive_bytes"]),
+                            f"{e['ratio'] * 100:0.0f}%",
+                            seconds(e["est_seconds"]),
+                        ]
+                        for e in target["extensions"]
+                    ],
+                )
+            )
+            if len(target["big_files"]) != 0:
+                parts.append(f"<h3>Files over {size(report['big_file_threshold'])}</h3>")
+                parts.append(
+                    cls._table(
+                        ["File", "Size", "Est. time"],
+                        [
+                            [f["path"], size(f["bytes"]), seconds(f["est_seconds"])]
+                            for f in target["big_files"]
+                        ],
+                    )
+                )
+        parts.append("</body></html>")
+        return "\n".join(parts)
+
+    @classmethod
+    def save(cls, report: dict, out_folder: str, stem: str) -> list:
+        """
+        Save the report as stem.json and stem.html in out_folder, returns the paths.
+        """
+        json_path = os.path.join(out_folder, stem + ".json")
+        with open(json_path, "w", encoding="utf-8") as fout:
+            json.dump(report, fout, indent=2)
+        html_path = os.path.join(out_folder, stem + ".html")
+        with open(html_path, "w", encoding="utf-8") as fout:
+            fout.write(cls.to_html(report))
+        return [json_path, html_path]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    from . import filescanner
+
+    entries = filescanner.FileScanner().scan(sys.argv[1])
+    stats = {
+        "name": "Demo",
+        "duration": 1,
+        "source_bytes": sum(e.size for e in entries),
+        "archive_bytes": None,
+        "status": "ok",
+    }
+    report = CompositionReport().build({"demo": stats}, {"demo": entries})
+    print(CompositionReport.save(report, sys.argv[2], "composition"))
+    sys.exit()
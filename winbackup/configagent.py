@@ -17,7 +17,6 @@
 import os
 import re
 import sys
-import yaml
 import logging
 import traceback
 from platform import uname
@@ -26,6 +25,27 @@ from datetime import datetime
 
 
 class ConfigAgent:
+    # global config keys and the check their values must pass
+    global_config_checks = {
+        "encryption_password": lambda value: type(value) == str,
+        "output_root_dir": lambda value: type(value) == str,
+        "encryption_enabled": lambda value: type(value) == bool,
+        "deduplicate": lambda value: type(value) == bool,
+        "run_profile": lambda value: value in {"normal", "background"},
+        "background_bandwidth": lambda value: type(value) == int and value >= 0,
+        "background_max_load": lambda value: type(value) in {int, float} and 0 < value <= 1,
+        "extra_output_dirs": lambda value: type(value) == list
+        and all(type(path) == str for path in value),
+        "fanout_buffer_size": lambda value: type(value) == int and value > 0,
+        "old_archive_policy": lambda value: value in {"delete", "recycle", "keep"},
+        "composition_report": lambda value: type(value) == bool,
+        "locked_file_retries": lambda value: type(value) == int and value >= 0,
+        "stall_timeout": lambda value: type(value) == int and value >= 0,
+        "stall_retries": lambda value: type(value) == int and value >= 0,
+        "concurrent_targets": lambda value: type(value) == int and value >= 1,
+        "device_concurrency": lambda value: type(value) == int and value >= 1,
+    }
+
     def __init__(self, paths=None) -> None:
         """
         For generating, modifying and parsing configuration for WinBackup
@@ -42,6 +62,16 @@ class ConfigAgent:
         # enabled - if the target will be backed up, default false for all
         # dict_size and mx_level - 7z dictionary size and compression level (ref 7z cli docs)
         # full path - store the full path to the compressed files. Defaults to relative paths.
+        # large_file_threshold - files at least this many bytes are compressed as parallel segments. 0 disables.
+        # vm_image_mode - VM disk images are compressed as segments skipping sparse holes and zero blocks.
+        # incremental - with vm_image_mode only the blocks of an image changed since the last run are archived.
+        # partitions - compress a large folder as this many archives in parallel. 1 disables.
+        # timeout - seconds a target may run before its 7z processes are stopped and it fails. 0 disables, negative is invalid.
+        # solid_block_size - bound the 7z solid blocks (e.g. 64m) and save an index for single file restore. "" disables.
+        # read_order - order files are read in: directory, inode (file ID) or extent (disk position) for HDD sources.
+        #   Other than directory the files are passed to 7z as a list and empty folders are not stored.
+        # in_memory - System Config only, collect the config in memory and stream it to 7z.
+        #   The archive then holds a config tarball instead of loose files, off by default.
         self._base_config_item = {
             "name": None,
             "type": "folder",
@@ -53,6 +83,14 @@ class ConfigAgent:
             "tar_before_7z": False,
             "extra_tar_flags": [],
             "extra_7z_flags": [],
+            "large_file_threshold": 0,
+            "vm_image_mode": False,
+            "incremental": False,
+            "partitions": 1,
+            "solid_block_size": "",
+            "timeout": 0,
+            "read_order": "directory",
+            "in_memory": False,
         }
 
         self._base_target_config = {
@@ -130,10 +168,37 @@ class ConfigAgent:
             },
         }
 
+        ### global config keys for the run profile (see throttle.RunProfile)
+        # run_profile - normal, or background for low priority runs while the PC is in use.
+        # background_bandwidth - background only, cap on the bytes/s read and written by winbackup itself. 0 disables.
+        # background_max_load - background only, threads are reduced when the system CPU load (0-1) is above this.
+        # extra_output_dirs - archives are also written to these root directories as they are produced.
+        # fanout_buffer_size - bytes buffered per extra directory before a slow one reads the archive again.
+        # old_archive_policy - archives of an earlier run with the same name, replaced once the new ones are saved:
+        #   delete (permanently), recycle (recycle bin) or keep (last version in .winbackup_state/previous).
+        # locked_file_retries - files locked or changing while archived are retried this many times into a supplemental archive.
+        # stall_timeout - seconds without 7z progress before it is stopped and the target retried. 0 disables.
+        # stall_retries - times a stalled target is retried before it fails.
+        # concurrent_targets - targets compressed at once, 1 runs them one after the other.
+        # device_concurrency - targets at once reading from the same source disk.
+        # composition_report - save a report of where the bytes and time of each target go next to sha256.txt.
         self._base_global_config = {
             "encryption_enabled": False,
             "encryption_password": "",
             "output_root_dir": ".",
+            "deduplicate": False,
+            "run_profile": "normal",
+            "background_bandwidth": 0,
+            "background_max_load": 0.75,
+            "extra_output_dirs": [],
+            "fanout_buffer_size": 268435456,
+            "old_archive_policy": "delete",
+            "composition_report": True,
+            "locked_file_retries": 3,
+            "stall_timeout": 900,
+            "stall_retries": 1,
+            "concurrent_targets": 1,
+            "device_concurrency": 1,
         }
 
         self._global_config = {}
@@ -207,6 +272,14 @@ class ConfigAgent:
                 "tar_before_7z",
                 "extra_7z_flags",
                 "extra_tar_flags",
+                "large_file_threshold",
+                "vm_image_mode",
+                "incremental",
+                "partitions",
+                "solid_block_size",
+                "timeout",
+                "read_order",
+                "in_memory",
             }:
                 raise ValueError(f"Key {key} in config_item not permitted.")
 
@@ -371,6 +444,14 @@ class ConfigAgent:
                 "tar_before_7z",
                 "extra_7z_flags",
                 "extra_tar_flags",
+                "large_file_threshold",
+                "vm_image_mode",
+                "incremental",
+                "partitions",
+                "solid_block_size",
+                "timeout",
+                "read_order",
+                "in_memory",
             }
             required_keys = {
                 "name",
@@ -388,18 +469,30 @@ class ConfigAgent:
                     valid_keys.remove(key)
                 # check valid key types
                 valid_type = True
-                if key in {"name", "type", "dict_size"}:
+                if key in {"name", "type", "dict_size", "solid_block_size"}:
                     if type(value) != str:
                         valid_type = False
-                if key in {"enabled", "full_path"}:
+                if key in {
+                    "enabled",
+                    "full_path",
+                    "vm_image_mode",
+                    "incremental",
+                    "in_memory",
+                }:
                     if type(value) != bool:
                         valid_type = False
-                if key in {"mx_level"}:
+                if key in {"mx_level", "large_file_threshold", "partitions", "timeout"}:
                     if type(value) != int:
                         valid_type = False
                 if key in {"path"} and config_item["type"] == "folder":
                     if type(value) not in {str, list}:
                         valid_type = False
+                if key == "read_order":
+                    if value not in {"directory", "inode", "extent"}:
+                        valid_type = False
+                # timeout 0 is no timeout, a negative one would stop the target at once
+                if key == "timeout" and type(value) == int and value < 0:
+                    valid_type = False
                 if not valid_type:
                     logging.error(f"Invalid type ({type(value)} for {key} in config_item for {id}.")  # fmt: skip
                     print(f"Invalid type ({type(value)} for {key} in config_item for {id}.")
@@ -490,32 +583,19 @@ class ConfigAgent:
                 logging.error("Global config not set.")
                 return False
 
-        for key in global_config:
-            valid_keys = {"encryption_password", "output_root_dir", "encryption_enabled"}
-            required_keys = {"output_root_dir"}
-            if key not in valid_keys:
-                logging.warning(f"Unknown Key {key} in global config. This will be ignored.")
-                print(f"Unknown Key {key} in global config. This will be ignored.")
-            if key in required_keys:
-                required_keys.remove(key)
-
-        if len(required_keys) != 0:
-            for key in valid_keys:
-                logging.error(f"Required key {key} not in global config.")
-                print(f"Required key {key} not in global config.")
-                valid_config_flag = False
+        required_keys = {"output_root_dir"}
+        for key in required_keys - set(global_config):
+            logging.error(f"Required key {key} not in global config.")
+            print(f"Required key {key} not in global config.")
+            valid_config_flag = False
 
         for key, value in global_config.items():
-            valid_type = True
-            if key in {"encryption_password", "output_root_dir"}:
-                if type(value) != str:
-                    valid_type = False
-
-            if not valid_type:
-                logging.error(
-                    f"Invalid type ({type(value)} for {key} in config_item for {id}."
-                )
-                print(f"Invalid type ({type(value)} for {key} in config_item for {id}.")
+            if key not in self.global_config_checks:
+                logging.warning(f"Unknown Key {key} in global config. This will be ignored.")
+                print(f"Unknown Key {key} in global config. This will be ignored.")
+            elif not self.global_config_checks[key](value):
+                logging.error(f"Invalid type ({type(value)} for {key} in global config.")
+                print(f"Invalid type ({type(value)} for {key} in global config.")
                 valid_config_flag = False
 
         if "output_root_dir" in global_config:
@@ -571,6 +651,8 @@ class ConfigAgent:
         ## combine dictionaries
         combined_config = {"global": global_config, "backup_targets": target_config}
 
+        import yaml  # only needed when a config file is saved or loaded
+
         with open(os.path.join(path), "w", newline="\n") as fout:
 
             ## write comments to file with winbackup version and windows version
@@ -591,6 +673,8 @@ class ConfigAgent:
         config file is also saved within class instance as self.config
         Validates config after loading - raises ValueError if config invalid.
         """
+        import yaml
+
         # load config
         with open(path, "r") as fin:
             config = yaml.safe_load(fin)
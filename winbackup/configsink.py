@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import io
+import os
+import sys
+import time
+import shutil
+import locale
+import logging
+import tarfile
+import threading
+from typing import Union
+
+
+class FolderSink:
+    def __init__(self, path: str) -> None:
+        """
+        Collector output written as files in a folder.
+        """
+        self.path = path
+
+    def write(self, relpath: str, data: Union[str, bytes]) -> None:
+        """
+        Write a member, str is written as text (platform newlines and encoding), bytes as is.
+        """
+        path = os.path.join(self.path, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if type(data) == str:
+            with open(path, "w") as fout:
+                fout.write(data)
+        else:
+            with open(path, "wb") as fout:
+                fout.write(data)
+
+    def add_file(self, relpath: str, source_path: str) -> None:
+        """
+        Add an existing file, hard linked if possible.
+        """
+        path = os.path.join(self.path, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source_path, path)
+        except OSError:
+            shutil.copy2(source_path, path)
+
+    def add_tree(self, relpath: str, source_dir: str) -> None:
+        shutil.copytree(source_dir, os.path.join(self.path, relpath))
+
+
+class MemorySink:
+    def __init__(self) -> None:
+        """
+        Collector output kept in memory as archive members, nothing is written to disk.
+        The members are streamed into the archive as a tarball with write_tar.
+        Collectors run concurrently so members are added under a lock.
+        """
+        self.members = {}
+        self._lock = threading.Lock()
+
+    def _add(self, relpath: str, data: bytes, mtime: float = None) -> None:
+        relpath = relpath.replace("\\", "/")
+        with self._lock:
+            self.members[relpath] = (data, time.time() if mtime is None else mtime)
+
+    def write(self, relpath: str, data: Union[str, bytes]) -> None:
+        """
+        Add a member, str is encoded as FolderSink would write it to keep the files the same.
+        """
+        if type(data) == str:
+            data = data.replace("\n", os.linesep).encode(
+                locale.getpreferredencoding(False), errors="replace"
+            )
+        self._add(relpath, data)
+
+    def add_file(self, relpath: str, source_path: str) -> None:
+        with open(source_path, "rb") as fin:
+            self._add(relpath, fin.read(), os.path.getmtime(source_path))
+
+    def add_tree(self, relpath: str, source_dir: str) -> None:
+        for dirpath, _, files in os.walk(source_dir):
+            for file in files:
+                file_path = os.path.join(dirpath, file)
+                self.add_file(
+                    os.path.join(relpath, os.path.relpath(file_path, source_dir)), file_path
+                )
+
+    @property
+    def total_size(self) -> int:
+        return sum(len(data) for data, _ in self.members.values())
+
+    def write_tar(self, stream, prefix: str = "") -> int:
+        """
+        Write the members as an uncompressed tar stream with paths under prefix.
+        Returns the number of bytes of member data written.
+        """
+        written = 0
+        with tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for relpath, (data, mtime) in sorted(self.members.items()):
+                info = tarfile.TarInfo(f"{prefix}/{relpath}" if prefix else relpath)
+                info.size = len(data)
+                info.mtime = mtime
+                tar.addfile(info, io.BytesIO(data))
+                written += len(data)
+        logging.debug(f"{len(self.members)} members, {written} bytes streamed to tar")
+        return written
+
+
+def as_sink(out: Union[str, FolderSink, MemorySink]) -> Union[FolderSink, MemorySink]:
+    """
+    Collectors accept a folder path or a sink, a path is wrapped in a FolderSink.
+    """
+    if type(out) == str:
+        return FolderSink(out)
+    return out
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    sink = MemorySink()
+    sink.add_tree(os.path.basename(sys.argv[1]), sys.argv[1])
+    with open(sys.argv[2], "wb") as fout:
+        sink.write_tar(fout)
+    sys.exit()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import sys
+import hashlib
+import logging
+
+
+class Deduplicator:
+    def __init__(self, min_size: int = 1048576) -> None:
+        """
+        Finds files with identical content across backup targets.
+        Candidates are grouped by size first, only size matches are content hashed.
+        Files smaller than min_size are left to the normal target archives.
+        """
+        self.min_size = min_size
+        self.manifest_version = 1
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        h = hashlib.sha256()
+        b = bytearray(1024 * 1024)
+        mv = memoryview(b)
+        with open(path, "rb", buffering=0) as f:
+            for n in iter(lambda: f.readinto(mv), 0):
+                h.update(mv[:n])
+        return h.hexdigest()
+
+    def find_duplicates(self, target_entries: dict) -> dict:
+        """
+        Find content shared between two or more targets.
+        Parameters:
+        - target_entries : dict of target archive filename -> list of FileEntry from the scan
+        Returns:
+        - duplicates     : dict of sha256 -> list of (target filename, FileEntry)
+                           only content present in more than one target is returned.
+        """
+        by_size = {}
+        for target, entries in target_entries.items():
+            for entry in entries:
+                if entry.size >= self.min_size:
+                    by_size.setdefault(entry.size, []).append((target, entry))
+
+        duplicates = {}
+        for size, candidates in by_size.items():
+            if len({target for target, _ in candidates}) < 2:
+                continue
+            by_hash = {}
+            for target, entry in candidates:
+                try:
+                    digest = self.hash_file(entry.path)
+                except OSError as e:
+                    logging.error(f"Dedup hash exception - Path: {entry.path} Exception: {e}")
+                    continue
+                by_hash.setdefault(digest, []).append((target, entry))
+            for digest, matches in by_hash.items():
+                if len({target for target, _ in matches}) > 1:
+                    duplicates[digest] = matches
+                    logging.debug(
+                        f"Duplicate content {digest} ({size} bytes) in {len(matches)} files"
+                    )
+        logging.info(
+            f"Dedup found {len(duplicates)} shared files, saving "
+            + f"{sum(m[0][1].size * (len(m) - 1) for m in duplicates.values())} bytes"
+        )
+        return duplicates
+
+    def build_manifest(
+        self, duplicates: dict, blob_archive: str, blob_member, member_name
+    ) -> dict:
+        """
+        Build the dedup manifest for the restore path.
+        Parameters:
+        - duplicates   : output of find_duplicates
+        - blob_archive : filename of the archive holding one copy of each content
+        - blob_member  : callable(FileEntry) returning the path of a file inside the blob archive
+        - member_name  : callable(target, FileEntry) returning the path of a file inside a target archive
+        """
+        manifest = {
+            "version": self.manifest_version,
+            "blob_archive": blob_archive,
+            "blobs": {},
+            "targets": {},
+        }
+        for digest, matches in duplicates.items():
+            first_entry = matches[0][1]
+            manifest["blobs"][digest] = {
+                "size": first_entry.size,
+                "member": blob_member(first_entry),
+            }
+            for target, entry in matches:
+                manifest["targets"].setdefault(target, []).append(
+                    {"path": member_name(target, entry), "hash": digest}
+                )
+        return manifest
+
+    @staticmethod
+    def blob_paths(duplicates: dict) -> list:
+        """
+        Returns the source path of the single stored copy of each duplicated content.
+        """
+        return [matches[0][1].path for matches in duplicates.values()]
+
+    @staticmethod
+    def excluded_paths(duplicates: dict) -> dict:
+        """
+        Returns dict of target filename -> list of file paths to leave out of that target.
+        """
+        excluded = {}
+        for matches in duplicates.values():
+            for target, entry in matches:
+                excluded.setdefault(target, []).append(entry.path)
+        return excluded
+
+
+if __name__ == "__main__":
+    from filescanner import FileScanner
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    scanner = FileScanner()
+    entries = {path: scanner.scan(path) for path in sys.argv[1:]}
+    for digest, matches in Deduplicator().find_duplicates(entries).items():
+        print(digest, [entry.path for _, entry in matches])
+    sys.exit()
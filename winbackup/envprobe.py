@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+class EnvProbes:
+    def __init__(self, cache_path: str = None, ttl: float = 600) -> None:
+        """
+        Lazily evaluated environment probes (e.g. is the HyperV service installed).
+        A probe only runs the first time its result is needed and the result is kept
+        for the rest of the process. prefetch() starts probes in the background so
+        they run concurrently while the user is still answering prompts.
+        Probes registered as cacheable are also saved to cache_path for ttl seconds.
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._probes = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._executor = None
+
+    def register(self, name: str, function: Callable, cacheable: bool = False) -> None:
+        """
+        Register a probe. cacheable results must be JSON serialisable.
+        """
+        self._probes[name] = (function, cacheable)
+
+    def _load_cache(self) -> dict:
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as fin:
+                return json.load(fin)
+        except Exception as e:
+            logging.debug(f"Probe cache {self.cache_path} unreadable - {e}")
+            return {}
+
+    def _save_cached(self, name: str, value) -> None:
+        if self.cache_path is None:
+            return
+        with self._cache_lock:
+            cache = self._load_cache()
+            cache[name] = {"time": time.time(), "value": value}
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+                with open(self.cache_path + ".tmp", "w", encoding="utf-8") as fout:
+                    json.dump(cache, fout)
+                os.replace(self.cache_path + ".tmp", self.cache_path)
+            except OSError as e:
+                logging.debug(f"Could not save probe cache - {e}")
+
+    def _run(self, name: str):
+        function, cacheable = self._probes[name]
+        start = time.perf_counter()
+        value = function()
+        logging.debug(f"Probe {name} = {value} ({time.perf_counter() - start:0.2f}s)")
+        if cacheable:
+            self._save_cached(name, value)
+        return value
+
+    def _future(self, name: str) -> Future:
+        if name not in self._probes:
+            raise KeyError(f"Unknown probe {name}")
+        with self._lock:
+            if name in self._futures:
+                return self._futures[name]
+            future = None
+            if self._probes[name][1]:
+                cached = self._load_cache().get(name)
+                if cached is not None and time.time() - cached["time"] < self.ttl:
+                    logging.debug(f"Probe {name} = {cached['value']} (cached)")
+                    future = Future()
+                    future.set_result(cached["value"])
+            if future is None:
+                if self._executor is None:
+                    # one worker per probe so probes waiting on other probes can't deadlock
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(1, len(self._probes)), thread_name_prefix="probe"
+                    )
+                future = self._executor.submit(self._run, name)
+            self._futures[name] = future
+            return future
+
+    def prefetch(self, names: list) -> None:
+        """
+        Start the probes in the background, get() then waits for the result.
+        """
+        for name in names:
+            self._future(name)
+
+    def get(self, name: str):
+        """
+        Result of the probe, running it now if it hasn't been started.
+        Exceptions raised by the probe are raised here and the probe is not cached.
+        """
+        future = self._future(name)
+        if future.exception() is not None:
+            with self._lock:
+                self._futures.pop(name, None)
+        return future.result()
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._futures.pop(name, None)
+        if self.cache_path is not None:
+            with self._cache_lock:
+                cache = self._load_cache()
+                if cache.pop(name, None) is not None:
+                    with open(self.cache_path, "w", encoding="utf-8") as fout:
+                        json.dump(cache, fout)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    probes = EnvProbes()
+    probes.register("cpu_count", os.cpu_count)
+    probes.register("cwd", os.getcwd)
+    probes.prefetch(["cpu_count", "cwd"])
+    print(probes.get("cpu_count"), probes.get("cwd"))
+    sys.exit()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import queue
+import hashlib
+import logging
+import threading
+from typing import Callable
+
+
+class _Destination:
+    def __init__(
+        self, folder: str, chunk_size: int, space: threading.Condition, limit=None
+    ) -> None:
+        """
+        One copy of the output folder. A writer thread writes the chunks it is sent,
+        or reads the rest of a file from the source itself once it has fallen behind.
+        space is notified each time a buffered chunk has been written.
+        """
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.space = space
+        self.limit = limit
+        self.queue = queue.SimpleQueue()
+        self.buffered = 0
+        self.hashes = {}
+        self.errors = []
+        self.caught_up = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _copy_tail(self, src_path: str, offset: int, fout, h) -> None:
+        with open(src_path, "rb", buffering=0) as fin:
+            fin.seek(offset)
+            for data in iter(lambda: fin.read(self.chunk_size), b""):
+                if self.limit is not None:
+                    self.limit(len(data))
+                h.update(data)
+                fout.write(data)
+
+    def _run(self) -> None:
+        fout = None
+        h = None
+        for message in iter(self.queue.get, None):
+            kind, name = message[0], message[1]
+            try:
+                if kind == "open":
+                    h = hashlib.sha256()
+                    fout = open(os.path.join(self.folder, name), "wb")
+                elif fout is None:
+                    # the file failed, skip the rest of its messages
+                    pass
+                elif kind == "data":
+                    h.update(message[2])
+                    fout.write(message[2])
+                elif kind == "tail":
+                    self.caught_up += 1
+                    self._copy_tail(message[2], message[3], fout, h)
+                elif kind == "close":
+                    fout.close()
+                    fout = None
+                    digest = h.hexdigest()
+                    if message[2] is None:
+                        raise ValueError(f"{name} could not be read from the source")
+                    if digest != message[2]:
+                        raise ValueError(f"{name} does not match the source hash")
+                    self.hashes[name] = digest
+            except Exception as e:
+                logging.error(f"Could not copy {name} to {self.folder} - exception {e}")
+                self.errors.append(name)
+                if fout is not None:
+                    fout.close()
+                    fout = None
+            finally:
+                if kind == "data":
+                    with self.space:
+                        self.buffered -= len(message[2])
+                        self.space.notify_all()
+        if fout is not None:
+            fout.close()
+
+
+class FanOut:
+    def __init__(
+        self,
+        folders: list,
+        buffer_size: int = 268435456,
+        chunk_size: int = 1048576,
+        limit=None,
+    ) -> None:
+        """
+        Copy the files of the output folder to several destination folders while the
+        next targets are compressed. Each file is read once and its chunks are sent to
+        every destination. The reader keeps pace with the fastest destination, a
+        destination falling more than buffer_size bytes behind reads the rest of that
+        file from the source itself instead of holding the others up.
+        Each destination hashes what it wrote, checked against the source hash, and
+        gets its own sha256.txt.
+        limit(nbytes) is called for each read, e.g. the run profile bandwidth cap.
+        """
+        self.buffer_size = max(buffer_size, chunk_size)
+        self.chunk_size = chunk_size
+        self.limit = limit
+        self.sent = set()
+        self.files = queue.SimpleQueue()
+        self.space = threading.Condition()
+        self.destinations = []
+        for folder in folders:
+            try:
+                os.makedirs(folder, exist_ok=True)
+            except OSError as e:
+                logging.error(f"Destination {folder} not used - exception {e}")
+                continue
+            destination = _Destination(folder, chunk_size, self.space, limit)
+            destination.thread.start()
+            self.destinations.append(destination)
+        self.reader = threading.Thread(target=self._read_files, daemon=True)
+        self.reader.start()
+
+    def add(self, src_path: str) -> None:
+        """
+        Queue a finished file of the output folder for copying.
+        """
+        self.sent.add(os.path.basename(src_path))
+        self.files.put(src_path)
+
+    def add_new(self, folder: str, skip: Callable[[str], bool] = None) -> int:
+        """
+        Queue the files of folder not queued yet, except names for which skip is True.
+        Returns the number of files queued.
+        """
+        names = sorted(
+            name
+            for name in os.listdir(folder)
+            if name not in self.sent
+            and (skip is None or not skip(name))
+            and os.path.isfile(os.path.join(folder, name))
+        )
+        for name in names:
+            self.add(os.path.join(folder, name))
+        return len(names)
+
+    def _wait_for_space(self, attached: list, size: int) -> list:
+        """
+        Destinations the next chunk is sent to. Waits while every destination is full,
+        destinations still full when another has space fall back to reading the source.
+        """
+        with self.space:
+            while True:
+                ready = [d for d in attached if d.buffered + size <= self.buffer_size]
+                if len(ready) != 0:
+                    for destination in ready:
+                        destination.buffered += size
+                    return ready
+                self.space.wait(0.1)
+
+    def _read_file(self, src_path: str) -> None:
+        name = os.path.basename(src_path)
+        for destination in self.destinations:
+            destination.queue.put(("open", name))
+        attached = list(self.destinations)
+        h = hashlib.sha256()
+        offset = 0
+        with open(src_path, "rb", buffering=0) as fin:
+            for data in iter(lambda: fin.read(self.chunk_size), b""):
+                if self.limit is not None and len(attached) != 0:
+                    self.limit(len(data))
+                h.update(data)
+                if len(attached) != 0:
+                    ready = self._wait_for_space(attached, len(data))
+                    for destination in attached:
+                        if destination in ready:
+                            destination.queue.put(("data", name, data))
+                        else:
+                            logging.debug(f"{destination.folder} behind - reading {name}")
+                            destination.queue.put(("tail", name, src_path, offset))
+                    attached = ready
+                offset += len(data)
+        for destination in self.destinations:
+            destination.queue.put(("close", name, h.hexdigest()))
+
+    def _read_files(self) -> None:
+        for src_path in iter(self.files.get, None):
+            try:
+                self._read_file(src_path)
+            except Exception as e:
+                logging.error(f"Could not read {src_path} for copying - exception {e}")
+                for destination in self.destinations:
+                    destination.queue.put(("close", os.path.basename(src_path), None))
+
+    def close(self) -> list:
+        """
+        Wait for every queued file to be written, then write the sha256.txt of each
+        destination. Returns [(folder, files copied, failed file names)].
+        """
+        self.files.put(None)
+        self.reader.join()
+        results = []
+        for destination in self.destinations:
+            destination.queue.put(None)
+            destination.thread.join()
+            try:
+                with open(os.path.join(destination.folder, "sha256.txt"), "w") as hash_file:
+                    for name, digest in sorted(destination.hashes.items()):
+                        if not name.endswith(".log") and not name.endswith(".txt"):
+                            hash_file.write(f"{name} {digest}\n")
+            except OSError as e:
+                logging.error(f"Could not save sha256.txt to {destination.folder} - {e}")
+                destination.errors.append("sha256.txt")
+            logging.info(
+                f"Copied {len(destination.hashes)} files to {destination.folder}, "
+                + f"{destination.caught_up} read from the source after falling behind"
+            )
+            results.append((destination.folder, len(destination.hashes), destination.errors))
+        return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    fan_out = FanOut(sys.argv[2:])
+    fan_out.add_new(sys.argv[1])
+    for folder, copied, errors in fan_out.close():
+        print(f"{folder}: {copied} files copied, {len(errors)} failed")
+    sys.exit()
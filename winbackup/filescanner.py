@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import logging
+from typing import Iterator, NamedTuple, Union
+
+
+class FileEntry(NamedTuple):
+    path: str  # absolute path of the file
+    root: str  # backup target root the file was found under
+    relpath: str  # path relative to the root
+    size: int
+    mtime: float
+    inode: int
+    dev: int
+
+
+class FileScanner:
+    def __init__(self) -> None:
+        """
+        Walks backup target folders with os.scandir and yields file entries.
+        The entries carry the stat info needed by the archiver and dedup functions
+        so that the tree is only walked once per target.
+        """
+        self.errors = []
+
+    def iter_files(self, root: str) -> Iterator[FileEntry]:
+        """
+        Stream the files under root as FileEntry tuples. Symlinks are not followed.
+        Unreadable directories and files are logged and recorded in self.errors.
+        """
+        root = os.path.abspath(root)
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                yield FileEntry(
+                                    entry.path,
+                                    root,
+                                    os.path.relpath(entry.path, root),
+                                    st.st_size,
+                                    st.st_mtime,
+                                    st.st_ino,
+                                    st.st_dev,
+                                )
+                        except OSError as e:
+                            logging.error(
+                                f"Scan exception - Path: {entry.path} Exception: {e}"
+                            )
+                            self.errors.append((entry.path, str(e)))
+            except OSError as e:
+                logging.error(f"Scan exception - Path: {current} Exception: {e}")
+                self.errors.append((current, str(e)))
+
+    def scan(self, paths: Union[str, list]) -> list:
+        """
+        Scan one or more target paths.
+        Returns a list of FileEntry for every file found.
+        """
+        if type(paths) == str:
+            paths = [paths]
+        elif type(paths) != list:
+            raise TypeError("paths must be str or list of str")
+        entries = []
+        for path in paths:
+            entries.extend(self.iter_files(path))
+        logging.debug(
+            f"Scanned {len(entries)} files, {sum(e.size for e in entries)} bytes in {paths}"
+        )
+        return entries
+
+    @staticmethod
+    def total_size(entries: list) -> int:
+        return sum(entry.size for entry in entries)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    scanner = FileScanner()
+    found = scanner.scan(sys.argv[1] if len(sys.argv) > 1 else ".")
+    print(f"{len(found)} files - {scanner.total_size(found)} bytes")
+    sys.exit()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import csv
+import json
+import logging
+from typing import Iterator
+
+
+class DirectoryInventory:
+    def __init__(self, state_path: str = None) -> None:
+        """
+        Lists every file under a folder (relative path, size, mtime) to a CSV as it walks.
+        With a state file the listing of each folder is kept between runs and a folder is
+        only listed again if its mtime changed (files added, removed or renamed in it).
+        Files rewritten in place don't change the folder mtime so keep their old size and
+        mtime until the folder itself changes.
+        """
+        self.state_path = state_path
+        self.state_version = 1
+        self.listed_dirs = 0
+        self.reused_dirs = 0
+        self.errors = []
+
+    def _load_state(self, root: str) -> dict:
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as fin:
+                state = json.load(fin)
+        except Exception as e:
+            logging.debug(f"Inventory state {self.state_path} unreadable - full listing. {e}")
+            return {}
+        if state.get("version") != self.state_version or state.get("root") != root:
+            return {}
+        return state["dirs"]
+
+    def _save_state(self, root: str, dirs: dict) -> None:
+        if self.state_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as fout:
+            json.dump({"version": self.state_version, "root": root, "dirs": dirs}, fout)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _list_dir(self, path: str) -> dict:
+        files = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        files.append([entry.name, st.st_size, int(st.st_mtime)])
+                except OSError as e:
+                    logging.error(f"Inventory exception - Path: {entry.path} Exception: {e}")
+                    self.errors.append((entry.path, str(e)))
+        return {"files": sorted(files), "subdirs": sorted(subdirs)}
+
+    def iter_files(self, root: str) -> Iterator[tuple]:
+        """
+        Yield (relpath, size, mtime) for every file under root, folder by folder.
+        Folders whose mtime matches the saved state are not listed again.
+        The state is saved once the walk completes.
+        """
+        root = os.path.abspath(root)
+        old_dirs = self._load_state(root)
+        new_dirs = {}
+        self.listed_dirs = 0
+        self.reused_dirs = 0
+        stack = ["."]
+        while stack:
+            relpath = stack.pop()
+            path = os.path.normpath(os.path.join(root, relpath))
+            try:
+                mtime = os.stat(path).st_mtime
+                old = old_dirs.get(relpath)
+                if old is not None and old["mtime"] == mtime:
+                    listing = old
+                    self.reused_dirs += 1
+                else:
+                    listing = self._list_dir(path)
+                    listing["mtime"] = mtime
+                    self.listed_dirs += 1
+            except OSError as e:
+                logging.error(f"Inventory exception - Path: {path} Exception: {e}")
+                self.errors.append((path, str(e)))
+                continue
+            new_dirs[relpath] = listing
+            for name, size, file_mtime in listing["files"]:
+                yield os.path.normpath(os.path.join(relpath, name)), size, file_mtime
+            # reversed so the stack pops folders in name order
+            for name in reversed(listing["subdirs"]):
+                stack.append(os.path.normpath(os.path.join(relpath, name)))
+        self._save_state(root, new_dirs)
+
+    def write_rows(self, root: str, stream) -> int:
+        """
+        Write the inventory of root as CSV (path,size,mtime with mtime in unix seconds)
+        to a text stream opened with newline="".
+        Returns the number of files listed.
+        """
+        count = 0
+        writer = csv.writer(stream)
+        writer.writerow(["path", "size", "mtime"])
+        for row in self.iter_files(root):
+            writer.writerow(row)
+            count += 1
+        logging.debug(
+            f"Inventory of {root}: {count} files, {self.listed_dirs} folders listed, "
+            + f"{self.reused_dirs} unchanged"
+        )
+        return count
+
+    def write_csv(self, root: str, csv_path: str) -> int:
+        """
+        Write the inventory of root to the csv file at csv_path.
+        Returns the number of files listed.
+        """
+        with open(csv_path, "w", newline="", encoding="utf-8") as fout:
+            return self.write_rows(root, fout)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    inventory = DirectoryInventory(sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"{inventory.write_csv(sys.argv[1], sys.argv[2])} files listed")
+    sys.exit()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import sys
+import queue
+import shutil
+import atexit
+import logging
+import collections
+import logging.handlers
+
+
+class RingBufferHandler(logging.Handler):
+    def __init__(self, capacity: int = 10000) -> None:
+        """
+        Keeps the last capacity log records in memory until there is somewhere to write them.
+        Older records are dropped, flush_to() notes how many were dropped.
+        """
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+        self.dropped = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+    def flush_to(self, handler: logging.Handler) -> None:
+        if self.dropped != 0:
+            handler.handle(
+                logging.makeLogRecord(
+                    {
+                        "name": "root",
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": f"{self.dropped} earlier log records dropped from the log buffer",
+                    }
+                )
+            )
+        while len(self.records) != 0:
+            handler.handle(self.records.popleft())
+        self.dropped = 0
+
+
+class LogPipeline:
+    debug_format = (
+        "%(asctime)s - %(levelname)s [%(module)s:%(funcName)s:%(lineno)d] -> %(message)s"
+    )
+    info_format = "%(asctime)s - %(levelname)s -> %(message)s"
+
+    def __init__(
+        self,
+        log_level: int,
+        capacity: int = 10000,
+        max_bytes: int = 10485760,
+        backup_count: int = 5,
+    ) -> None:
+        """
+        Root logger output goes through a queue to a listener thread so log writes don't
+        slow down the caller (e.g. the 7z progress loop).
+        Until the output folder exists records are kept in a ring buffer of capacity records,
+        in debug mode they are written to winbackup.log in the CWD as before.
+        In the output folder winbackup.log is rotated at max_bytes keeping backup_count files.
+        """
+        self.log_level = log_level
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.listener = None
+        self.handler = None
+        self.log_path = None
+
+    @property
+    def log_format(self) -> str:
+        return self.debug_format if self.log_level == logging.DEBUG else self.info_format
+
+    def _listen(self, handler: logging.Handler) -> None:
+        handler.setFormatter(logging.Formatter(self.log_format))
+        self.handler = handler
+        self.listener = logging.handlers.QueueListener(self.queue, handler)
+        self.listener.start()
+
+    def start(self, cwd_log: str = None) -> None:
+        """
+        Attach to the root logger. cwd_log is the file used in debug mode before redirect.
+        """
+        logger = logging.getLogger()
+        logger.setLevel(self.log_level)
+        if self.log_level == logging.DEBUG and cwd_log is not None:
+            self.log_path = cwd_log
+            self._listen(logging.FileHandler(cwd_log, mode="w", encoding="utf-8"))
+        else:
+            self._listen(RingBufferHandler(self.capacity))
+        logger.addHandler(self.queue_handler)
+        atexit.register(self.stop)
+
+    def redirect(self, log_path: str) -> None:
+        """
+        Write the log to log_path from now on, with what was logged so far at its start.
+        """
+        self.listener.stop()
+        self.listener = None
+        old_handler = self.handler
+        old_handler.close()
+        if type(old_handler) != RingBufferHandler and self.log_path is not None:
+            # the CWD log may be on another drive than the output folder
+            shutil.move(self.log_path, log_path)
+        handler = logging.handlers.RotatingFileHandler(
+            log_path,
+            mode="a",
+            maxBytes=self.max_bytes,
+            backupCount=self.backup_count,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter(self.log_format))
+        if type(old_handler) == RingBufferHandler:
+            old_handler.flush_to(handler)
+        self.log_path = log_path
+        self._listen(handler)
+
+    def stop(self) -> None:
+        """
+        Detach from the root logger, write out the queued records and close the log file.
+        """
+        logging.getLogger().removeHandler(self.queue_handler)
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self.handler is not None:
+            self.handler.close()
+
+
+if __name__ == "__main__":
+    pipeline = LogPipeline(logging.INFO, capacity=5)
+    pipeline.start()
+    for i in range(10):
+        logging.info(f"record {i}")
+    pipeline.redirect(sys.argv[1])
+    logging.info("after redirect")
+    pipeline.stop()
+    sys.exit()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import lzma
+import shutil
+import logging
+import humanize
+
+
+class SpacePreflight:
+    # tar headers and padding per file
+    tar_overhead = 1024
+
+    def __init__(
+        self,
+        history=None,
+        sample_bytes: int = 16777216,
+        sample_files: int = 64,
+        margin: float = 0.05,
+    ) -> None:
+        """
+        Estimates the space a run needs before it starts and checks it against the free
+        space of each destination volume.
+        A target's archive size is its scanned size times its compression ratio, taken
+        from the run history (runhistory.RunHistory) if the target was run before, else
+        from compressing a sample of up to sample_files files (sample_bytes in total) with
+        a fast LZMA preset, which overestimates the size 7z will reach.
+        tar_before_7z targets also need their tarball as scratch space while compressing.
+        margin is added to the estimate to allow for the error.
+        """
+        self.history = history
+        self.sample_bytes = sample_bytes
+        self.sample_files = sample_files
+        self.margin = margin
+
+    def sample_ratio(self, entries: list) -> float:
+        """
+        Compressed / original size of a sample of the entries, weighted by file size.
+        Files are picked evenly over the entries sorted by size so small and large files
+        are both sampled. Returns 1 if nothing could be read.
+        """
+        files = sorted((entry for entry in entries if entry.size > 0), key=lambda e: e.size)
+        if len(files) == 0:
+            return 1.0
+        step = max(1, len(files) // self.sample_files)
+        chunk_size = max(4096, self.sample_bytes // self.sample_files)
+        weighted = 0.0
+        weights = 0
+        for entry in files[::step][: self.sample_files]:
+            try:
+                with open(entry.path, "rb") as fin:
+                    data = fin.read(chunk_size)
+            except OSError as e:
+                logging.debug(f"Could not sample {entry.path} - {e}")
+                continue
+            if len(data) == 0:
+                continue
+            ratio = min(1.0, len(lzma.compress(data, preset=1)) / len(data))
+            weighted += ratio * entry.size
+            weights += entry.size
+        return weighted / weights if weights > 0 else 1.0
+
+    def estimate_target(self, key: str, target: dict, entries: list = None) -> dict:
+        """
+        Estimated archive and scratch bytes of a target.
+        entries is the FileScanner scan of a folder target, None for special targets
+        which are estimated from their last archive size only.
+        """
+        estimate = {"name": target["name"], "source": 0, "archive": 0, "scratch": 0}
+        stats = None if self.history is None else self.history.target_stats(key)
+        if entries is None:
+            runs = [] if self.history is None else self.history.target_runs(key)
+            if len(runs) == 0:
+                estimate["method"] = "unknown"
+            else:
+                estimate["archive"] = runs[-1].get("archive_bytes") or 0
+                estimate["method"] = "history"
+            return estimate
+        estimate["source"] = sum(entry.size for entry in entries)
+        if target.get("mx_level", 9) == 0:
+            ratio, estimate["method"] = 1.0, "store"
+        elif stats is not None and stats["ratio"] is not None:
+            ratio, estimate["method"] = stats["ratio"], "history"
+        else:
+            ratio, estimate["method"] = self.sample_ratio(entries), "sample"
+        estimate["ratio"] = ratio
+        estimate["archive"] = int(estimate["source"] * ratio)
+        if target.get("tar_before_7z", False):
+            estimate["scratch"] = estimate["source"] + self.tar_overhead * len(entries)
+        return estimate
+
+    @staticmethod
+    def volume(path: str) -> tuple:
+        """
+        (device id, free bytes) of the volume holding path.
+        """
+        return os.stat(path).st_dev, shutil.disk_usage(path).free
+
+    def check(
+        self, estimates: dict, out_root: str, extra_roots: list = None, concurrent: int = 1
+    ) -> list:
+        """
+        Compare the estimates ({key: estimate_target()}) with the free space of the
+        output root and each extra output root, roots on the same volume are added up.
+        The output root also holds the scratch space of the tar_before_7z targets running
+        at the same time, the concurrent (concurrent_targets) largest ones.
+        Returns a list of volumes [{"roots", "needed", "free", "scratch", "ok"}].
+        """
+        archives = sum(estimate["archive"] for estimate in estimates.values())
+        scratches = sorted(
+            (estimate["scratch"] for estimate in estimates.values()), reverse=True
+        )
+        scratch = sum(scratches[:concurrent])
+        volumes = {}
+        for root, needed, root_scratch in [(out_root, archives + scratch, scratch)] + [
+            (root, archives, 0) for root in extra_roots or []
+        ]:
+            device, free = self.volume(root)
+            volume = volumes.setdefault(
+                device, {"roots": [], "needed": 0, "free": free, "scratch": 0}
+            )
+            volume["roots"].append(root)
+            volume["needed"] += int(needed * (1 + self.margin))
+            volume["scratch"] += root_scratch
+        for volume in volumes.values():
+            volume["ok"] = volume["needed"] <= volume["free"]
+        return list(volumes.values())
+
+    @staticmethod
+    def suggestions(estimates: dict, volume: dict, extra_roots: list = None) -> list:
+        """
+        Ways to fit a run on a volume that is too small, as lines to show the user.
+        """
+        shortfall = volume["needed"] - volume["free"]
+        lines = [
+            f"free up at least {humanize.naturalsize(shortfall, True)} on the volume of "
+            + volume["roots"][0]
+        ]
+        if volume["scratch"] > 0:
+            tar_targets = [e["name"] for e in estimates.values() if e["scratch"] > 0]
+            lines.append(
+                f"turn off tar_before_7z for {', '.join(tar_targets)} to save up to "
+                + f"{humanize.naturalsize(volume['scratch'], True)} of scratch space"
+            )
+        skipped = []
+        saved = 0
+        for estimate in sorted(estimates.values(), key=lambda e: e["archive"], reverse=True):
+            if saved >= shortfall:
+                break
+            skipped.append(estimate["name"])
+            saved += estimate["archive"] * len(volume["roots"])
+        if saved >= shortfall and len(skipped) != 0:
+            lines.append(f"leave out the largest targets: {', '.join(skipped)}")
+        for root in volume["roots"]:
+            if root in (extra_roots or []):
+                lines.append(f"remove {root} from extra_output_dirs")
+        lines.append("choose an output directory on a larger disk")
+        return lines
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    from . import filescanner
+
+    preflight = SpacePreflight()
+    entries = filescanner.FileScanner().scan(sys.argv[1])
+    estimates = {"demo": preflight.estimate_target("demo", {"name": "Demo"}, entries)}
+    print(estimates)
+    for volume in preflight.check(estimates, sys.argv[2]):
+        print(volume)
+        if not volume["ok"]:
+            print(preflight.suggestions(estimates, volume))
+    sys.exit()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import sys
+import time
+import logging
+import threading
+from datetime import timedelta
+from typing import Callable
+import humanize
+
+
+class TargetProgress:
+    def __init__(self, run: "RunProgress", key: str, scale: float = 1.0) -> None:
+        """
+        Handle passed to the archiver for one target. A target is archived by one or more
+        jobs (7z processes, segments) that each cover a share of the target's bytes.
+        """
+        self.run = run
+        self.key = key
+        self.scale = scale
+
+    def part(self, share: float) -> "TargetProgress":
+        """
+        Handle for a part of the target (e.g. the large files), job shares are of the part.
+        """
+        return TargetProgress(self.run, self.key, self.scale * share)
+
+    def job(self, name: str, share: float = 1.0) -> Callable[[float], str]:
+        """
+        Callback for a job covering share of the target. Called with the fraction of the
+        job done (0-1), returns the current run status line.
+        """
+        share = self.scale * share
+        return lambda fraction: self.run.update(self.key, name, share, fraction)
+
+    def finish(self) -> str:
+        return self.run.finish(self.key)
+
+
+class RunProgress:
+    def __init__(
+        self,
+        weights: dict,
+        quiet: bool = False,
+        refresh: float = 0.5,
+        log_interval: float = 60,
+        smoothing: float = 0.1,
+    ) -> None:
+        """
+        Progress of a whole backup run. Each target is weighted by its scanned size in bytes
+        so a 2GB folder counts for 1000 times less than a 2TB one. Jobs of any target,
+        including concurrent ones on other threads, report the fraction they have done.
+        The status line (overall percent, throughput, elapsed and ETA) is only recomputed
+        every refresh seconds so updating per 7z output line is cheap. The ETA uses an
+        exponentially smoothed rate. In quiet mode the status is logged every log_interval.
+        """
+        self.weights = dict(weights)
+        self.total_bytes = sum(self.weights.values())
+        self.quiet = quiet
+        self.refresh = refresh
+        self.log_interval = log_interval
+        self.smoothing = smoothing
+        self.start_time = time.monotonic()
+        self._jobs = {}
+        self._finished = set()
+        self._lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._rate = None
+        self._sample = (self.start_time, 0.0)
+        self._status = ""
+        self._status_time = self.start_time
+        self._log_time = self.start_time
+
+    def target(self, key: str) -> TargetProgress:
+        return TargetProgress(self, key)
+
+    def done_bytes(self) -> float:
+        with self._lock:
+            targets = {}
+            for (key, _), (share, fraction) in self._jobs.items():
+                targets[key] = targets.get(key, 0) + share * fraction
+            return sum(
+                weight * (1 if key in self._finished else min(1, targets.get(key, 0)))
+                for key, weight in self.weights.items()
+            )
+
+    def update(self, key: str, job: str, share: float, fraction: float) -> str:
+        with self._lock:
+            self._jobs[(key, job)] = (share, max(0.0, min(1.0, fraction)))
+        return self._refresh()
+
+    def finish(self, key: str) -> str:
+        with self._lock:
+            self._finished.add(key)
+        return self._refresh(force=True)
+
+    def _refresh(self, force: bool = False) -> str:
+        now = time.monotonic()
+        if not force and now - self._status_time < self.refresh:
+            return self._status
+        with self._status_lock:
+            self._status = self.status(now)
+            self._status_time = now
+            if self.quiet and now - self._log_time >= self.log_interval:
+                self._log_time = now
+                logging.info(self._status)
+        return self._status
+
+    def eta(self) -> float:
+        """
+        Seconds left at the smoothed rate, None until there is a rate.
+        """
+        if self._rate is None or self._rate <= 0:
+            return None
+        return max(0.0, self.total_bytes - self._sample[1]) / self._rate
+
+    def status(self, now: float = None) -> str:
+        now = time.monotonic() if now is None else now
+        done = self.done_bytes()
+        last_time, last_done = self._sample
+        if now > last_time:
+            rate = (done - last_done) / (now - last_time)
+            self._rate = (
+                rate
+                if self._rate is None
+                else self._rate + self.smoothing * (rate - self._rate)
+            )
+            self._sample = (now, done)
+        elapsed = now - self.start_time
+        percent = 100 * done / self.total_bytes if self.total_bytes > 0 else 0
+        throughput = done / elapsed if elapsed > 0 else 0
+        eta = self.eta()
+        return (
+            f"Overall {percent:0.0f}% - {humanize.naturalsize(done, True)}"
+            + f" of {humanize.naturalsize(self.total_bytes, True)}"
+            + f", {humanize.naturalsize(throughput, True)}/s"
+            + f", elapsed {timedelta(seconds=int(elapsed))}"
+            + f", ETA {'-' if eta is None else timedelta(seconds=int(eta))}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    run = RunProgress({"a": 3 * 1048576, "b": 1048576}, quiet=True, log_interval=1)
+    for key in ("a", "b"):
+        report = run.target(key).job("demo")
+        for step in range(1, 11):
+            time.sleep(0.2)
+            report(step / 10)
+        run.finish(key)
+    print(run.status())
+    sys.exit()
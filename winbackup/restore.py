@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import shutil
+import logging
+import tarfile
+from colorama import Fore, Style
+
+from . import zip7archiver
+from . import archiveindex
+from . import deduplicator
+from . import segmentarchiver
+
+
+class Restorer:
+    def __init__(self, archiver=None, segment_archiver=None) -> None:
+        """
+        Restores a backup folder produced by WinBackup.
+        Each archive is extracted into a folder named after the archive,
+        then the manifests saved next to the archives are applied.
+        """
+        if archiver is None:
+            archiver = zip7archiver.Zip7Archiver()
+        if segment_archiver is None:
+            segment_archiver = segmentarchiver.SegmentArchiver(archiver)
+        self.archiver = archiver
+        self.segment_archiver = segment_archiver
+
+    @staticmethod
+    def archive_stem(filename: str) -> str:
+        """
+        Returns the archive name without volume number and extension.
+        """
+        if filename.endswith(".001"):
+            filename = filename[:-4]
+        if filename.endswith(".7z"):
+            filename = filename[:-3]
+        return filename
+
+    @staticmethod
+    def find_archives(backup_path: str) -> list:
+        """
+        Returns the first volume of every archive in the backup folder, manifests excluded.
+        """
+        archives = []
+        for file in sorted(os.listdir(backup_path)):
+            if file.endswith(".manifest.7z"):
+                continue
+            if file.endswith(".7z") or file.endswith(".7z.001"):
+                archives.append(file)
+        return archives
+
+    @staticmethod
+    def first_volume(backup_path: str, archive: str) -> str:
+        """
+        Returns the path of the archive or its first volume if it was split.
+        """
+        for file in (archive, archive + ".001"):
+            if os.path.exists(os.path.join(backup_path, file)):
+                return os.path.join(backup_path, file)
+        raise FileNotFoundError(f"Archive {archive} missing from {backup_path}")
+
+    @staticmethod
+    def find_manifests(backup_path: str, kind: str) -> list:
+        """
+        Returns the paths of the manifests of the given kind (e.g. Dedup) in the backup folder.
+        """
+        return [
+            os.path.join(backup_path, file)
+            for file in sorted(os.listdir(backup_path))
+            if file.endswith(f"_{kind}.manifest.json") or file.endswith(f"_{kind}.manifest.7z")
+        ]
+
+    def restore_backup(
+        self,
+        backup_path: str,
+        restore_path: str,
+        password: str = "",
+        quiet: bool = False,
+    ) -> list:
+        """
+        Restore all archives in backup_path to restore_path.
+        Returns the list of folders restored to.
+        """
+        if not os.path.isdir(backup_path):
+            raise FileNotFoundError(backup_path)
+        if not os.path.isdir(restore_path):
+            os.makedirs(restore_path)
+
+        dedup_manifests = [
+            self.archiver.load_manifest(path, password)
+            for path in self.find_manifests(backup_path, "Dedup")
+        ]
+        skip_archives = {manifest["blob_archive"] for manifest in dedup_manifests}
+        segment_manifests = {}
+        for path in self.find_manifests(backup_path, "Segments"):
+            manifest = self.archiver.load_manifest(path, password)
+            segment_manifests[manifest["target"]] = manifest
+            for entry in manifest["files"]:
+                skip_archives.update(segment["archive"] for segment in entry["segments"])
+
+        # partitioned targets are restored from all their partition archives
+        partition_manifests = {}
+        for path in self.find_manifests(backup_path, "Partitions"):
+            manifest = self.archiver.load_manifest(path, password)
+            partition_manifests[manifest["target"]] = manifest
+            skip_archives.update(partition["archive"] for partition in manifest["partitions"])
+
+        # files locked or changing while archived are replaced by their retried copies
+        retry_manifests = {}
+        for path in self.find_manifests(backup_path, "Retry"):
+            manifest = self.archiver.load_manifest(path, password)
+            retry_manifests[manifest["target"]] = manifest
+            skip_archives.add(manifest["archive"])
+
+        targets = {}
+        for archive in self.find_archives(backup_path):
+            if self.archive_stem(archive) + ".7z" not in skip_archives:
+                targets[self.archive_stem(archive) + ".7z"] = [
+                    os.path.join(backup_path, archive)
+                ]
+        for target, manifest in partition_manifests.items():
+            targets[target] = [
+                self.first_volume(backup_path, partition["archive"])
+                for partition in manifest["partitions"]
+            ]
+
+        restored = []
+        for target, archive_paths in sorted(targets.items()):
+            out_folder = os.path.join(restore_path, self.archive_stem(target))
+            for archive_path in archive_paths:
+                if not quiet:
+                    print(
+                        Fore.GREEN
+                        + f" >>> Restoring {os.path.basename(archive_path)} ... "
+                        + Style.RESET_ALL
+                    )
+                self.archiver.extract_archive(archive_path, out_folder, password, quiet=quiet)
+            self.unpack_tarball(out_folder, target)
+            if target in segment_manifests:
+                for entry in segment_manifests[target]["files"]:
+                    if not quiet:
+                        print(f" >> Reassembling {entry['path']} from segments")
+                    self.segment_archiver.restore_large_file(
+                        entry,
+                        backup_path,
+                        out_folder,
+                        password,
+                        chain=self.incremental_chain(entry, backup_path, password),
+                    )
+            if target in retry_manifests:
+                self.restore_retried(
+                    retry_manifests[target], backup_path, out_folder, password, quiet
+                )
+            restored.append(out_folder)
+
+        for manifest in dedup_manifests:
+            if not quiet:
+                print(Fore.GREEN + " >>> Restoring deduplicated files ... " + Style.RESET_ALL)
+            self.restore_dedup(manifest, backup_path, restore_path, password, quiet)
+        return restored
+
+    def restore_file(
+        self,
+        backup_path: str,
+        pattern: str,
+        restore_path: str,
+        password: str = "",
+        quiet: bool = False,
+    ) -> list:
+        """
+        Restore the files matching pattern (archive path or wildcard, case insensitive)
+        from the targets saved with an Index manifest. Only the solid block holding each
+        file is decompressed, read from the volumes the index gives for it.
+        Returns the paths of the restored files.
+        """
+        if not os.path.isdir(backup_path):
+            raise FileNotFoundError(backup_path)
+        manifests = self.find_manifests(backup_path, "Index")
+        if len(manifests) == 0:
+            raise FileNotFoundError(
+                f"No archive index in {backup_path}, targets need solid_block_size"
+            )
+        members = {}
+        for path in manifests:
+            index = self.archiver.load_manifest(path, password)
+            for archive, member, entry in archiveindex.ArchiveIndex.lookup(index, pattern):
+                volumes = archiveindex.ArchiveIndex.volumes_needed(archive, entry["block"])
+                logging.debug(
+                    f"{member} - block {entry['block']} of {archive['archive']}, "
+                    + f"volumes {volumes}"
+                )
+                key = (index["target"], archive["archive"])
+                members.setdefault(key, []).append(member)
+        if len(members) == 0:
+            raise FileNotFoundError(f"No file matching {pattern} in the archive indexes")
+
+        restored = []
+        for (target, archive), archive_members in sorted(members.items()):
+            out_folder = os.path.join(restore_path, self.archive_stem(target))
+            if not quiet:
+                print(
+                    Fore.GREEN
+                    + f" >>> Restoring {len(archive_members)} files from {archive} ... "
+                    + Style.RESET_ALL
+                )
+            self.archiver.extract_archive(
+                os.path.join(backup_path, archive),
+                out_folder,
+                password,
+                members=archive_members,
+                quiet=quiet,
+            )
+            restored += [os.path.join(out_folder, member) for member in archive_members]
+        return restored
+
+    def unpack_tarball(self, out_folder: str, target: str) -> bool:
+        """
+        Archives made with tar_before_7z or streamed from memory hold a <name>.tar,
+        unpack it into the restore folder and remove it.
+        Returns True if there was a tarball to unpack.
+        """
+        tar_path = os.path.join(out_folder, self.archive_stem(target) + ".tar")
+        if not os.path.isfile(tar_path):
+            return False
+        logging.debug(f"Unpacking {tar_path}")
+        with tarfile.open(tar_path, "r") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(out_folder, filter="data")
+            else:
+                tar.extractall(out_folder)
+        os.remove(tar_path)
+        return True
+
+    def restore_retried(
+        self,
+        manifest: dict,
+        backup_path: str,
+        out_folder: str,
+        password: str = "",
+        quiet: bool = False,
+    ) -> int:
+        """
+        Extract the Retry archive of a target and copy its files over the copies in the
+        target archive, which were unreadable or changing when archived.
+        Returns the number of files replaced.
+        """
+        files = [entry for entry in manifest["files"] if entry["result"] != "failed"]
+        if len(files) == 0:
+            return 0
+        if not quiet:
+            print(f" >> Replacing {len(files)} files retried after being locked or changed")
+        retry_dir = os.path.join(os.path.dirname(out_folder), ".retry_files")
+        try:
+            self.archiver.extract_archive(
+                self.first_volume(backup_path, manifest["archive"]),
+                retry_dir,
+                password,
+                quiet=quiet,
+            )
+            for entry in files:
+                destination = os.path.join(out_folder, entry["path"])
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copy2(os.path.join(retry_dir, entry["member"]), destination)
+        finally:
+            shutil.rmtree(retry_dir, ignore_errors=True)
+        logging.info(f"{len(files)} retried files restored to {out_folder}")
+        return len(files)
+
+    def find_image_entry(self, backup_path: str, image_id: str, password: str = "") -> dict:
+        """
+        The Segments manifest entry of the block incremental image image_id saved in the
+        backup folder, None if the folder or the entry is missing.
+        """
+        image_entry = None
+        if os.path.isdir(backup_path):
+            for path in self.find_manifests(backup_path, "Segments"):
+                for file_entry in self.archiver.load_manifest(path, password)["files"]:
+                    if file_entry.get("incremental", {}).get("image_id") == image_id:
+                        image_entry = file_entry
+        return image_entry
+
+    def incremental_chain(self, entry: dict, backup_path: str, password: str = "") -> list:
+        """
+        Follow the parent runs of a block incremental image back to its full backup.
+        The parent runs are sibling folders of backup_path in the output root.
+        Returns list of (backup_path, entry) of the older runs, full backup first.
+        """
+        chain = []
+        block_map = entry.get("incremental")
+        while block_map is not None and block_map["parent"] is not None:
+            parent_path = os.path.join(os.path.dirname(backup_path), block_map["parent"])
+            parent_entry = self.find_image_entry(parent_path, block_map["image_id"], password)
+            if parent_entry is None:
+                raise FileNotFoundError(
+                    f"Backup {block_map['parent']} needed to restore {entry['path']} is missing"
+                )
+            chain.insert(0, (parent_path, parent_entry))
+            backup_path = parent_path
+            block_map = parent_entry["incremental"]
+        return chain
+
+    def restore_dedup(
+        self,
+        manifest: dict,
+        backup_path: str,
+        restore_path: str,
+        password: str = "",
+        quiet: bool = False,
+    ) -> None:
+        """
+        Extract the shared blob archive and copy each blob to the targets referencing it.
+        """
+        blob_archive = self.first_volume(backup_path, manifest["blob_archive"])
+        blob_dir = os.path.join(restore_path, ".dedup_blobs")
+        try:
+            self.archiver.extract_archive(blob_archive, blob_dir, password, quiet=quiet)
+            self.apply_dedup_references(manifest, blob_dir, restore_path)
+        finally:
+            shutil.rmtree(blob_dir, ignore_errors=True)
+
+    def apply_dedup_references(self, manifest: dict, blob_dir: str, restore_path: str) -> int:
+        """
+        Copy the extracted blobs in blob_dir to every path referencing them.
+        Each blob is checked against its hash once, before it is copied.
+        Returns the number of files restored.
+        """
+        restored = 0
+        verified = set()
+        for target, references in manifest["targets"].items():
+            target_folder = os.path.join(restore_path, self.archive_stem(target))
+            for reference in references:
+                blob = manifest["blobs"][reference["hash"]]
+                source = os.path.join(blob_dir, blob["member"])
+                if reference["hash"] not in verified:
+                    if deduplicator.Deduplicator.hash_file(source) != reference["hash"]:
+                        raise ValueError(
+                            f"Dedup blob {blob['member']} does not match its hash"
+                        )
+                    verified.add(reference["hash"])
+                destination = os.path.join(target_folder, reference["path"])
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copy2(source, destination)
+                restored += 1
+        logging.info(f"{restored} deduplicated files restored")
+        return restored
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    Restorer().restore_backup(sys.argv[1], sys.argv[2])
+    sys.exit()
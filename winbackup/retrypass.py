@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import logging
+from typing import Callable
+
+
+class RetryPass:
+    def __init__(
+        self,
+        archiver,
+        attempts: int = 3,
+        delay: float = 10.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        Follow up pass for the files of a target 7z could not read (e.g. an open Outlook
+        PST or a running VM disk) and the files changed while the target was archived.
+        The target archive keeps everything read successfully, these files are tried
+        again up to attempts times, delay seconds apart, and written to a small
+        supplemental archive with a Retry manifest mapping them back into the target.
+        Files still locked are listed as failed.
+        """
+        self.archiver = archiver
+        self.attempts = attempts
+        self.delay = delay
+        self.sleep = sleep
+
+    @staticmethod
+    def changed_files(entries: list, since: float) -> list:
+        """
+        Scanned files modified at or after since (the time the target started), their
+        archived copy may be inconsistent. Files deleted since the scan are left out.
+        """
+        changed = []
+        for entry in entries:
+            try:
+                stat = os.stat(entry.path)
+            except OSError:
+                continue
+            if stat.st_mtime >= since:
+                changed.append(entry.path)
+        return changed
+
+    @staticmethod
+    def readable(path: str) -> bool:
+        try:
+            with open(path, "rb") as fin:
+                fin.read(1)
+            return True
+        except OSError:
+            return False
+
+    def wait_readable(self, paths: list) -> tuple:
+        """
+        Try opening each file up to attempts times.
+        Returns (readable paths, paths still locked).
+        """
+        pending = list(paths)
+        ready = []
+        for attempt in range(self.attempts):
+            if attempt != 0:
+                logging.debug(f"{len(pending)} files still locked, retrying in {self.delay}s")
+                self.sleep(self.delay)
+            locked = []
+            for path in pending:
+                (ready if self.readable(path) else locked).append(path)
+            pending = locked
+            if len(pending) == 0:
+                break
+        return ready, pending
+
+    def run(
+        self,
+        target: str,
+        unread: list,
+        entries: list,
+        since: float,
+        out_folder: str,
+        member_name: Callable[[str], str],
+        password: str = "",
+        quiet: bool = False,
+    ) -> dict:
+        """
+        Retry the files of target (archive filename) 7z reported as unread, [(path,
+        message)], and the entries changed since the target started.
+        member_name maps a path to its name in the target archive.
+        Writes <target>_Retry.7z to out_folder if any file could be read, returns the
+        Retry manifest {"target", "archive", "files": [{"path", "member", "reason",
+        "result"}]} with result retried, changed (still changing while retried) or failed.
+        """
+        reasons = {}
+        for path, message in unread:
+            reasons[os.path.abspath(path)] = message
+        for path in self.changed_files(entries, since):
+            reasons.setdefault(os.path.abspath(path), "changed while archived")
+        archive = f"{target[:-3]}_Retry.7z"
+        manifest = {"target": target, "archive": archive, "files": []}
+        if len(reasons) == 0:
+            return manifest
+        logging.warning(f"{len(reasons)} files of {target} unread or changed, retrying")
+        ready, locked = self.wait_readable(sorted(reasons))
+        results = {path: "failed" for path in locked}
+        if len(ready) != 0:
+            retry_started = time.time()
+            self.archiver.unread_files.clear()
+            try:
+                self.archiver.backup_file_list(
+                    archive, ready, out_folder, password, quiet=quiet
+                )
+                failed = {os.path.abspath(path) for path, _ in self.archiver.unread_files}
+            except Exception as e:
+                logging.error(f"Retry archive {archive} failed. Exception: {e}")
+                failed = set(ready)
+            for path in ready:
+                if path in failed:
+                    results[path] = "failed"
+                elif not os.path.exists(path) or os.path.getmtime(path) >= retry_started:
+                    results[path] = "changed"
+                else:
+                    results[path] = "retried"
+        for path in sorted(reasons):
+            manifest["files"].append(
+                {
+                    "path": member_name(path),
+                    "member": self.archiver.member_name(path, path, True),
+                    "reason": reasons[path],
+                    "result": results[path],
+                }
+            )
+            log = logging.error if results[path] == "failed" else logging.warning
+            log(f"{path} - {reasons[path]} - {results[path]}")
+        return manifest
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    ready, locked = RetryPass(None, attempts=2, delay=1).wait_readable(sys.argv[1:])
+    print(f"readable: {ready}")
+    print(f"locked: {locked}")
+    sys.exit()
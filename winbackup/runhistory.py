@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import logging
+import statistics
+
+
+class RunHistory:
+    def __init__(self, path: str, max_runs: int = 100, window: int = 5) -> None:
+        """
+        Per-target stats of past runs (duration, source and archive bytes) kept in a JSON
+        file in the output root. Estimates use the median of the last `window` successful
+        runs of a target, throughput based if the current source size is known.
+        Only the last max_runs runs are kept.
+        """
+        self.path = path
+        self.max_runs = max_runs
+        self.window = window
+        self.history_version = 1
+        self.runs = self._load()
+
+    def _load(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as fin:
+                history = json.load(fin)
+        except Exception as e:
+            logging.debug(f"Run history {self.path} unreadable - starting a new history. {e}")
+            return []
+        if history.get("version") != self.history_version:
+            return []
+        return history["runs"]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as fout:
+            json.dump({"version": self.history_version, "runs": self.runs}, fout, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def add_run(self, targets: dict, started: float = None) -> None:
+        """
+        Record a run. targets is {key: {"name", "duration", "source_bytes", "archive_bytes",
+        "status"}}, source_bytes may be None if the target was not scanned.
+        """
+        self.runs.append(
+            {"time": time.time() if started is None else started, "targets": targets}
+        )
+        self.runs = self.runs[-self.max_runs :]
+
+    def target_runs(self, key: str) -> list:
+        """
+        Successful runs of a target, oldest first.
+        """
+        return [
+            run["targets"][key]
+            for run in self.runs
+            if key in run["targets"] and run["targets"][key]["status"] == "ok"
+        ]
+
+    @staticmethod
+    def _throughput(entry: dict) -> float:
+        if not entry.get("source_bytes") or entry["duration"] <= 0:
+            return None
+        return entry["source_bytes"] / entry["duration"]
+
+    def estimate(self, key: str, source_bytes: int = None) -> float:
+        """
+        Estimated duration of a target in seconds, None if it has no history.
+        """
+        recent = self.target_runs(key)[-self.window :]
+        if len(recent) == 0:
+            return None
+        if source_bytes is not None:
+            rates = [rate for rate in map(self._throughput, recent) if rate is not None]
+            if len(rates) != 0:
+                return source_bytes / statistics.median(rates)
+        return statistics.median(entry["duration"] for entry in recent)
+
+    def order_longest_first(self, keys: list, sizes: dict = None) -> list:
+        """
+        Order target keys by estimated duration, longest first, so the longest job isn't
+        started last. Targets with no history are treated as long and go first, in key order.
+        """
+        sizes = {} if sizes is None else sizes
+        estimates = {key: self.estimate(key, sizes.get(key)) for key in keys}
+        return sorted(
+            keys,
+            key=lambda key: (estimates[key] is not None, -(estimates[key] or 0), key),
+        )
+
+    def target_stats(self, key: str) -> dict:
+        """
+        Summary of a target's history: runs, last and median duration, median throughput,
+        compression ratio (archive / source) and the change of the last duration against
+        the median of the earlier runs.
+        """
+        entries = self.target_runs(key)
+        if len(entries) == 0:
+            return None
+        durations = [entry["duration"] for entry in entries]
+        rates = [rate for rate in map(self._throughput, entries) if rate is not None]
+        ratios = [
+            entry["archive_bytes"] / entry["source_bytes"]
+            for entry in entries
+            if entry.get("source_bytes") and entry.get("archive_bytes") is not None
+        ]
+        trend = None
+        if len(durations) > 1 and statistics.median(durations[:-1]) > 0:
+            trend = durations[-1] / statistics.median(durations[:-1]) - 1
+        return {
+            "name": entries[-1]["name"],
+            "runs": len(entries),
+            "last_duration": durations[-1],
+            "median_duration": statistics.median(durations),
+            "throughput": statistics.median(rates) if len(rates) != 0 else None,
+            "ratio": ratios[-1] if len(ratios) != 0 else None,
+            "trend": trend,
+        }
+
+    def keys(self) -> list:
+        return sorted({key for run in self.runs for key in run["targets"]})
+
+    @staticmethod
+    def format_duration(seconds: float) -> str:
+        seconds = int(round(seconds))
+        if seconds >= 3600:
+            return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+        if seconds >= 60:
+            return f"{seconds // 60}m {seconds % 60:02d}s"
+        return f"{seconds}s"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    history = RunHistory(sys.argv[1])
+    for key in history.keys():
+        print(key, history.target_stats(key))
+    sys.exit()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import logging
+import threading
+from typing import Callable, Union
+
+
+class DeviceScheduler:
+    def __init__(
+        self,
+        max_workers: int = 1,
+        per_device: int = 1,
+        device_of: Callable[[str], object] = None,
+        poll: float = 0.5,
+    ) -> None:
+        """
+        Runs targets concurrently, at most max_workers at once and at most per_device
+        reading from the same source device, so every disk is kept busy while no
+        spinning disk has two archive jobs seeking against each other.
+        Targets are started in the order given (e.g. longest first), skipping over
+        targets whose device is busy. With max_workers 1 the targets run one after the
+        other in the calling thread.
+        device_of(path) returns the device of a source path, default device().
+        """
+        if max_workers < 1 or per_device < 1:
+            raise ValueError("max_workers and per_device must be at least 1")
+        self.max_workers = max_workers
+        self.per_device = per_device
+        self.device_of = self.device if device_of is None else device_of
+        self.poll = poll
+        self.active = {}
+        self.errors = []
+        self.stopped = False
+        self.lock = threading.Condition()
+
+    @classmethod
+    def from_config(cls, global_config: dict) -> "DeviceScheduler":
+        return cls(
+            max_workers=global_config.get("concurrent_targets", 1),
+            per_device=global_config.get("device_concurrency", 1),
+        )
+
+    @staticmethod
+    def device(path: str) -> object:
+        """
+        Device of path, st_dev (the volume serial number on windows) of the nearest
+        existing folder, or the volume root if it can't be read.
+        Partitions of one physical disk are separate devices.
+        """
+        path = os.path.abspath(path)
+        while True:
+            try:
+                return os.stat(path).st_dev
+            except OSError:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+        drive, _ = os.path.splitdrive(path)
+        return (drive or os.sep).upper()
+
+    def devices(self, paths: Union[str, list, None]) -> frozenset:
+        """
+        Devices a target reads from, empty for targets without a source path
+        (e.g. the System Config collectors).
+        """
+        if not paths:
+            return frozenset()
+        if isinstance(paths, str):
+            paths = [paths]
+        return frozenset(self.device_of(path) for path in paths)
+
+    def group(self, targets: list) -> dict:
+        """
+        targets is a list of (key, paths). Returns device -> target keys, in order.
+        Targets reading from several devices are listed under each of them.
+        """
+        groups = {}
+        for key, paths in targets:
+            for device in self.devices(paths) or [None]:
+                groups.setdefault(device, []).append(key)
+        return groups
+
+    def _fits(self, devices: frozenset) -> bool:
+        return all(self.active.get(device, 0) < self.per_device for device in devices)
+
+    def _next(self, pending: list) -> tuple:
+        """
+        Wait for the first pending target whose devices have a free slot and claim them.
+        Returns (key, devices) or None once nothing is left or the run is stopped.
+        """
+        with self.lock:
+            while not self.stopped and len(pending) != 0:
+                for index, (key, devices) in enumerate(pending):
+                    if self._fits(devices):
+                        del pending[index]
+                        for device in devices:
+                            self.active[device] = self.active.get(device, 0) + 1
+                        return key, devices
+                self.lock.wait()
+            return None
+
+    def _worker(self, pending: list, task: Callable[[str], None]) -> None:
+        while True:
+            claimed = self._next(pending)
+            if claimed is None:
+                return
+            key, devices = claimed
+            try:
+                task(key)
+            except BaseException as e:
+                logging.error(f"Target {key} stopped the run - {e!r}")
+                with self.lock:
+                    self.errors.append(e)
+                    self.stopped = True
+            finally:
+                with self.lock:
+                    for device in devices:
+                        self.active[device] -= 1
+                    self.lock.notify_all()
+
+    def run(self, targets: list, task: Callable[[str], None]) -> None:
+        """
+        Call task(key) for each of targets, a list of (key, paths) in start order.
+        task handles the failures of its target, an exception it raises (e.g. the run
+        was cancelled) stops further targets starting and is raised once the running
+        ones have returned.
+        """
+        if self.max_workers == 1 or len(targets) < 2:
+            for key, _ in targets:
+                task(key)
+            return
+        pending = [(key, self.devices(paths)) for key, paths in targets]
+        for device, keys in self.group(targets).items():
+            logging.debug(f"Device {device} - targets {keys}")
+        self.active = {}
+        self.errors = []
+        self.stopped = False
+        threads = [
+            threading.Thread(target=self._worker, args=(pending, task), daemon=True)
+            for _ in range(min(self.max_workers, len(targets)))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            # joined with a timeout so Ctrl-C reaches the main thread
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(self.poll)
+        except BaseException:
+            with self.lock:
+                self.stopped = True
+                self.lock.notify_all()
+            for thread in threads:
+                thread.join()
+            raise
+        if len(self.errors) != 0:
+            raise self.errors[0]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(threadName)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    scheduler = DeviceScheduler(max_workers=4)
+    targets = [(path, path) for path in sys.argv[1:]]
+    print(scheduler.group(targets))
+    scheduler.run(targets, lambda key: (logging.info(f"start {key}"), time.sleep(1)))
+    sys.exit()
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import hashlib
+import logging
+import subprocess
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from . import zip7archiver
+from . import vmimage
+
+
+class SegmentArchiver:
+    def __init__(
+        self,
+        archiver=None,
+        segment_size: int = 1073741824,
+        workers: int = None,
+        reader=None,
+    ):
+        """
+        Compresses single huge files (VM disk images) as fixed size segments.
+        Each segment is streamed to its own 7z process on stdin so all cores are used,
+        instead of one LZMA2 stream that scales poorly at mx9.
+        The segment list with a sha256 per segment is returned for the restore manifest.
+        In sparse mode holes and zero blocks are skipped (see VMImageReader) and each
+        segment records the extents of the data it holds.
+        """
+        if archiver is None:
+            archiver = zip7archiver.Zip7Archiver()
+        if reader is None:
+            reader = vmimage.VMImageReader()
+        self.archiver = archiver
+        self.reader = reader
+        self.segment_size = segment_size
+        if workers is None:
+            # LZMA2 scales well to two threads per stream, so half the cores as workers
+            workers = max(1, (os.cpu_count() or 2) // 2)
+        self.workers = workers
+        self.chunk_size = 1048576
+
+    @property
+    def profile(self):
+        """
+        The archiver's run profile, its bandwidth cap is shared with the copy loops.
+        """
+        return self.archiver.profile
+
+    @staticmethod
+    def plan_segments(size: int, segment_size: int) -> list:
+        """
+        Returns a list of (offset, length) covering size bytes in segment_size pieces.
+        """
+        if segment_size <= 0:
+            raise ValueError("segment_size must be larger than 0")
+        return [
+            (offset, min(segment_size, size - offset))
+            for offset in range(0, size, segment_size)
+        ] or [(0, 0)]
+
+    def copy_segment(
+        self, src_path: str, offset: int, length: int, dst_stream, callback=None
+    ) -> str:
+        """
+        Copy length bytes from offset of src_path to dst_stream.
+        Returns the sha256 of the copied bytes.
+        """
+        h = hashlib.sha256()
+        remaining = length
+        with open(src_path, "rb", buffering=0) as fin:
+            fin.seek(offset)
+            while remaining > 0:
+                data = fin.read(min(self.chunk_size, remaining))
+                if not data:
+                    raise EOFError(f"{src_path} shorter than expected at {offset + length}")
+                self.profile.limit(len(data))
+                h.update(data)
+                dst_stream.write(data)
+                remaining -= len(data)
+                if callback is not None:
+                    callback(len(data))
+        return h.hexdigest()
+
+    def copy_segment_extents(
+        self, src_path: str, offset: int, length: int, dst_stream, callback=None
+    ) -> tuple:
+        """
+        Copy only the data blocks between offset and offset + length to dst_stream.
+        Returns (sha256 of the copied bytes, list of [offset, length] extents copied).
+        """
+        h = hashlib.sha256()
+        extents = []
+        copied = 0
+        with open(src_path, "rb", buffering=0) as fin:
+            for block_offset, data in self.reader.iter_data_blocks(
+                fin, offset, offset + length
+            ):
+                self.profile.limit(len(data))
+                h.update(data)
+                dst_stream.write(data)
+                self.reader.merge_extents(extents, block_offset, len(data))
+                copied += len(data)
+                if callback is not None:
+                    callback(len(data))
+        if callback is not None:
+            # skipped regions still count towards the progress of the file
+            callback(length - copied)
+        return h.hexdigest(), extents
+
+    def copy_extents(self, src_path: str, extents: list, dst_stream, callback=None) -> str:
+        """
+        Copy the given [offset, length] extents of src_path to dst_stream in order.
+        Returns the sha256 of the copied bytes.
+        """
+        h = hashlib.sha256()
+        with open(src_path, "rb", buffering=0) as fin:
+            for offset, length in extents:
+                fin.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    data = fin.read(min(self.chunk_size, remaining))
+                    if not data:
+                        raise EOFError(
+                            f"{src_path} shorter than expected at {offset + length}"
+                        )
+                    self.profile.limit(len(data))
+                    h.update(data)
+                    dst_stream.write(data)
+                    remaining -= len(data)
+                    if callback is not None:
+                        callback(len(data))
+        return h.hexdigest()
+
+    @staticmethod
+    def plan_extent_groups(extents: list, segment_size: int) -> list:
+        """
+        Split extents into groups holding at most segment_size bytes each,
+        splitting extents that cross a group boundary.
+        """
+        groups = []
+        current = []
+        current_size = 0
+        for offset, length in extents:
+            while length > 0:
+                take = min(length, segment_size - current_size)
+                current.append([offset, take])
+                current_size += take
+                offset += take
+                length -= take
+                if current_size == segment_size:
+                    groups.append(current)
+                    current = []
+                    current_size = 0
+        if len(current) != 0:
+            groups.append(current)
+        return groups
+
+    def write_segment_extents(self, src_stream, dst_path: str, extents: list) -> tuple:
+        """
+        Scatter the packed bytes read from src_stream to the extents of dst_path.
+        Returns (sha256, bytes written).
+        """
+        h = hashlib.sha256()
+        written = 0
+        with open(dst_path, "r+b") as fout:
+            for offset, length in extents:
+                fout.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    data = src_stream.read(min(self.chunk_size, remaining))
+                    if not data:
+                        raise EOFError(f"Segment data for {dst_path} ended early")
+                    self.profile.limit(len(data))
+                    h.update(data)
+                    fout.write(data)
+                    remaining -= len(data)
+                    written += len(data)
+        return h.hexdigest(), written
+
+    def write_segment(self, src_stream, dst_path: str, offset: int) -> tuple:
+        """
+        Write the bytes read from src_stream into dst_path at offset.
+        dst_path must already exist. Returns (sha256, bytes written).
+        """
+        h = hashlib.sha256()
+        written = 0
+        with open(dst_path, "r+b") as fout:
+            fout.seek(offset)
+            for data in iter(lambda: src_stream.read(self.chunk_size), b""):
+                self.profile.limit(len(data))
+                h.update(data)
+                fout.write(data)
+                written += len(data)
+        return h.hexdigest(), written
+
+    def _7z_args(
+        self, member: str, archive_path: str, password: str, dict_size: str, mx_level: int
+    ) -> list:
+        args = [self.archiver.zip7_path, "a", "-t7z"]
+        if mx_level == 0:
+            args += ["-mx=0"]
+        else:
+            args += ["-m0=lzma2", f"-md={dict_size}", f"-mx={str(mx_level)}", "-mmt=2"]
+        args += ["-bso0", "-bsp0", f"-si{member}"]
+        if len(password) != 0:
+            args += ["-mhe=on", f"-p{password}"]
+        args.append(archive_path)
+        return args
+
+    def _compress_stream(
+        self,
+        feed,
+        member: str,
+        archive_path: str,
+        password: str,
+        dict_size: str,
+        mx_level: int,
+    ):
+        """
+        Run one 7z process reading member from stdin, feed(stdin) writes the data.
+        Returns what feed returns.
+        """
+        cmd_args = self._7z_args(member, archive_path, password, dict_size, mx_level)
+        with self.archiver._popen(
+            cmd_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            shell=False,
+        ) as p:
+            try:
+                result = feed(p.stdin)
+            except OSError:
+                # the pipe breaks when the supervisor stopped 7z
+                self.archiver.supervisor.check(p)
+                raise
+            finally:
+                p.stdin.close()
+        self.archiver.supervisor.check(p)
+        if p.returncode != 0:
+            raise RuntimeError(f"7z returned {p.returncode} for segment {archive_path}")
+        return result
+
+    def _feed_segment(
+        self, src_path: str, offset: int, length: int, sparse: bool, callback, dst_stream
+    ) -> tuple:
+        if sparse:
+            return self.copy_segment_extents(src_path, offset, length, dst_stream, callback)
+        return self.copy_segment(src_path, offset, length, dst_stream, callback), None
+
+    def backup_large_file(
+        self,
+        src_path: str,
+        member: str,
+        archive_stub: str,
+        out_folder: str,
+        password: str = "",
+        dict_size: str = "128m",
+        mx_level: int = 9,
+        quiet: bool = False,
+        sparse: bool = False,
+    ) -> dict:
+        """
+        Compress src_path as independent segment archives in parallel.
+        Parameters:
+        - src_path     : the file to compress
+        - member       : path to restore the file to, relative to the target restore folder
+        - archive_stub : segment archives are named archive_stub_0000.7z, archive_stub_0001.7z ...
+        - out_folder   : where the segment archives are output
+        - sparse       : skip holes and zero blocks, recording the extents of the data kept
+        Returns:
+        - manifest entry dict with size, segment offsets, archives and sha256 hashes
+        """
+        size = os.path.getsize(src_path)
+        segments = self.plan_segments(size, self.segment_size)
+        workers = self.profile.threads(self.workers)
+        logging.info(
+            f"Compressing {src_path} as {len(segments)} segments with {workers} workers"
+        )
+        with tqdm(
+            total=size,
+            colour="Cyan",
+            leave=False,
+            desc=" Segments ",
+            unit="B",
+            unit_scale=True,
+            disable=quiet,
+        ) as pbar:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = []
+                for index, (offset, length) in enumerate(segments):
+                    archive = f"{archive_stub}_{index:04d}.7z"
+                    futures.append(
+                        (
+                            archive,
+                            offset,
+                            length,
+                            executor.submit(
+                                self._compress_stream,
+                                partial(
+                                    self._feed_segment,
+                                    src_path,
+                                    offset,
+                                    length,
+                                    sparse,
+                                    pbar.update,
+                                ),
+                                f"{os.path.basename(member)}.{index:04d}",
+                                os.path.join(out_folder, archive),
+                                password,
+                                dict_size,
+                                mx_level,
+                            ),
+                        )
+                    )
+                manifest_segments = []
+                for archive, offset, length, future in futures:
+                    digest, extents = future.result()
+                    segment = {
+                        "archive": archive,
+                        "offset": offset,
+                        "length": length,
+                        "sha256": digest,
+                    }
+                    if sparse:
+                        segment["extents"] = extents
+                    manifest_segments.append(segment)
+        after_bytes = sum(
+            os.path.getsize(os.path.join(out_folder, segment["archive"]))
+            for segment in manifest_segments
+        )
+        if sparse:
+            data_bytes = sum(
+                length for segment in manifest_segments for _, length in segment["extents"]
+            )
+            logging.info(f"{src_path} - {data_bytes} of {size} bytes hold data")
+        logging.info(f"Segments of {src_path} complete. Size: {size} >> {after_bytes} bytes")
+        return {"path": member, "size": size, "sparse": sparse, "segments": manifest_segments}
+
+    def backup_extents(
+        self,
+        src_path: str,
+        member: str,
+        extents: list,
+        archive_stub: str,
+        out_folder: str,
+        password: str = "",
+        dict_size: str = "128m",
+        mx_level: int = 9,
+        quiet: bool = False,
+    ) -> dict:
+        """
+        Compress only the given extents of src_path, e.g. the changed blocks of an image.
+        Extents are grouped into segments of at most segment_size bytes compressed in parallel.
+        Returns:
+        - manifest entry dict in the same format as backup_large_file (sparse)
+        """
+        size = os.path.getsize(src_path)
+        groups = self.plan_extent_groups(extents, self.segment_size)
+        data_bytes = sum(length for _, length in extents)
+        logging.info(
+            f"Compressing {data_bytes} of {size} bytes of {src_path} as {len(groups)} segments"
+        )
+        with tqdm(
+            total=data_bytes,
+            colour="Cyan",
+            leave=False,
+            desc=" Segments ",
+            unit="B",
+            unit_scale=True,
+            disable=quiet,
+        ) as pbar:
+            with ThreadPoolExecutor(
+                max_workers=self.profile.threads(self.workers)
+            ) as executor:
+                futures = []
+                for index, group in enumerate(groups):
+                    archive = f"{archive_stub}_{index:04d}.7z"
+                    futures.append(
+                        (
+                            archive,
+                            group,
+                            executor.submit(
+                                self._compress_stream,
+                                partial(
+                                    self.copy_extents, src_path, group, callback=pbar.update
+                                ),
+                                f"{os.path.basename(member)}.{index:04d}",
+                                os.path.join(out_folder, archive),
+                                password,
+                                dict_size,
+                                mx_level,
+                            ),
+                        )
+                    )
+                manifest_segments = [
+                    {
+                        "archive": archive,
+                        "offset": group[0][0],
+                        "length": sum(length for _, length in group),
+                        "sha256": future.result(),
+                        "extents": group,
+                    }
+                    for archive, group, future in futures
+                ]
+        return {"path": member, "size": size, "sparse": True, "segments": manifest_segments}
+
+    def _extract_segment(
+        self, segment: dict, backup_path: str, dst_path: str, password: str
+    ) -> None:
+        cmd_args = [
+            self.archiver.zip7_path,
+            "e",
+            os.path.join(backup_path, segment["archive"]),
+            "-so",
+            f"-p{password}",
+        ]
+        with self.archiver._popen(
+            cmd_args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, shell=False
+        ) as p:
+            if "extents" in segment:
+                expected = sum(length for _, length in segment["extents"])
+                digest, written = self.write_segment_extents(
+                    p.stdout, dst_path, segment["extents"]
+                )
+            else:
+                expected = segment["length"]
+                digest, written = self.write_segment(p.stdout, dst_path, segment["offset"])
+        self.archiver.supervisor.check(p)
+        if p.returncode != 0:
+            raise RuntimeError(f"7z returned {p.returncode} extracting {segment['archive']}")
+        if digest != segment["sha256"] or written != expected:
+            raise ValueError(f"Segment {segment['archive']} does not match its hash")
+
+    def restore_large_file(
+        self,
+        entry: dict,
+        backup_path: str,
+        restore_folder: str,
+        password: str = "",
+        chain: list = None,
+    ) -> str:
+        """
+        Reassemble a file from its segment archives, verifying each segment hash.
+        Parameters:
+        - chain : for block incremental images, list of (backup_path, entry) of the older runs
+                  from the full backup onwards. Each run's changed blocks are written in order.
+        Returns the path of the restored file.
+        """
+        dst_path = os.path.join(restore_folder, entry["path"])
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        runs = list(chain or []) + [(backup_path, entry)]
+        if entry.get("sparse", False):
+            self.reader.create_sparse_file(dst_path, max(e["size"] for _, e in runs))
+        else:
+            with open(dst_path, "wb") as fout:
+                fout.truncate(entry["size"])
+        for run_path, run_entry in runs:
+            # segments of one run don't overlap so they can be written in parallel
+            with ThreadPoolExecutor(
+                max_workers=self.profile.threads(self.workers)
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        self._extract_segment, segment, run_path, dst_path, password
+                    )
+                    for segment in run_entry["segments"]
+                ]
+                for future in futures:
+                    future.result()
+        if len(runs) > 1:
+            self._clear_zeroed_blocks(dst_path, runs)
+        logging.info(f"Restored {dst_path} from {len(runs)} runs")
+        return dst_path
+
+    def _clear_zeroed_blocks(self, dst_path: str, runs: list) -> None:
+        """
+        Blocks written by an older run that are all zeros in the latest map must be zeroed.
+        """
+        block_map = runs[-1][1]["incremental"]
+        block_size = block_map["block_size"]
+        written = set()
+        for _, run_entry in runs[:-1]:
+            for segment in run_entry["segments"]:
+                for offset, length in segment["extents"]:
+                    written.update(
+                        range(offset // block_size, (offset + length - 1) // block_size + 1)
+                    )
+        with open(dst_path, "r+b") as fout:
+            for index in sorted(written):
+                if index < len(block_map["hashes"]) and block_map["hashes"][index] is None:
+                    fout.seek(index * block_size)
+                    fout.write(bytes(min(block_size, block_map["size"] - index * block_size)))
+            fout.truncate(block_map["size"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    size = os.path.getsize(sys.argv[1])
+    print(SegmentArchiver.plan_segments(size, 1073741824))
+    sys.exit()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import re
+import sys
+import time
+import uuid
+import queue
+import shlex
+import signal
+import atexit
+import logging
+import threading
+import subprocess
+
+
+class ShellSessionError(Exception):
+    """
+    The shell session died or could not be started, the command can be run one-shot.
+    """
+
+
+class ShellStartError(ShellSessionError):
+    """
+    The shell executable could not be started.
+    """
+
+
+class ShellSession:
+    # each command is followed by a line with a unique marker and the exit status
+    frames = {
+        "powershell": (
+            "$global:LASTEXITCODE = 0\n"
+            + "{command}\n"
+            + "$winbackup_ok = $?\n"
+            + "[Console]::Out.WriteLine('{marker} ' + $(if ($LASTEXITCODE) {{ $LASTEXITCODE }} "
+            + "elseif ($winbackup_ok) {{ 0 }} else {{ 1 }}))\n"
+            + "[Console]::Out.Flush()\n"
+        ),
+        "sh": "{command}\nprintf '%s %d\\n' '{marker}' $?\n",
+    }
+
+    def __init__(self, shell_args: list, dialect: str = "powershell") -> None:
+        """
+        One long lived shell process that commands are written to on stdin.
+        The output of a command is read up to a marker line printed after it,
+        the marker line also carries the exit status of the command.
+        Commands on one session run one at a time.
+        """
+        if dialect not in self.frames:
+            raise ValueError(f"Unknown shell dialect {dialect}")
+        self.shell_args = shell_args
+        self.dialect = dialect
+        self.process = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        try:
+            self.process = subprocess.Popen(
+                self.shell_args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                shell=False,
+                # its own process group so kill can stop the commands it started
+                start_new_session=sys.platform != "win32",
+            )
+        except OSError as e:
+            self.process = None
+            raise ShellStartError(f"Could not start {self.shell_args[0]} - {e}")
+        # stdout is read by a thread so reads can time out, stderr is drained to the log
+        self._lines = queue.Queue()
+        threading.Thread(
+            target=self._read_stream, args=(self.process.stdout, self._lines), daemon=True
+        ).start()
+        threading.Thread(
+            target=self._read_stream, args=(self.process.stderr, None), daemon=True
+        ).start()
+        logging.debug(f"Shell session started - pid {self.process.pid}")
+
+    @staticmethod
+    def _read_stream(stream, lines: queue.Queue) -> None:
+        for line in iter(stream.readline, b""):
+            if lines is None:
+                logging.debug(
+                    "shell session stderr: " + line.decode("utf-8", errors="ignore").strip()
+                )
+            else:
+                lines.put(line)
+        if lines is not None:
+            lines.put(None)
+
+    def close(self) -> None:
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self._kill_tree(self.process)
+            self.process.wait()
+        self.process = None
+
+    def kill(self) -> None:
+        if self.process is not None:
+            self._kill_tree(self.process)
+            self.process.wait()
+            self.process = None
+
+    @staticmethod
+    def _kill_tree(process: subprocess.Popen) -> None:
+        """
+        Kill the shell and the commands it started, a timed out command is a child of the
+        shell (e.g. systeminfo) and would keep running if only the shell was killed.
+        """
+        try:
+            if sys.platform == "win32":
+                subprocess.run(
+                    ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=30,
+                )
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.debug(f"Could not kill the process tree of {process.pid} - {e}")
+        if process.poll() is None:
+            process.kill()
+
+    def run(self, command: str, timeout: float = None) -> tuple:
+        """
+        Run a command line in the session.
+        Returns output, exit status. Output is returned as bytes, line endings included.
+        Raises subprocess.TimeoutExpired (the session is killed) or ShellSessionError.
+        """
+        with self._lock:
+            if not self.alive:
+                self.start()
+            marker = f"__WINBACKUP_{uuid.uuid4().hex}__"
+            frame = self.frames[self.dialect].format(command=command, marker=marker)
+            try:
+                self.process.stdin.write(frame.encode("utf-8"))
+                self.process.stdin.flush()
+            except OSError as e:
+                self.kill()
+                raise ShellSessionError(f"Shell session stdin closed - {e}")
+
+            output = []
+            marker_bytes = marker.encode("utf-8")
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                try:
+                    if deadline is None:
+                        line = self._lines.get()
+                    else:
+                        line = self._lines.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    self.kill()
+                    raise subprocess.TimeoutExpired(command, timeout)
+                if line is None:
+                    self.kill()
+                    raise ShellSessionError("Shell session exited during command")
+                if marker_bytes in line:
+                    # output not ending with a newline shares the line with the marker
+                    prefix, status = line.split(marker_bytes, 1)
+                    output.append(prefix)
+                    returncode = int(status.strip() or 0)
+                    break
+                output.append(line)
+        return b"".join(output), returncode
+
+
+class ShellPool:
+    # flag a one-shot shell takes the command line with
+    command_flags = {"powershell": "-Command", "sh": "-c"}
+
+    def __init__(
+        self,
+        shell_args: list = None,
+        dialect: str = "powershell",
+        max_sessions: int = 8,
+        enabled: bool = None,
+    ) -> None:
+        """
+        Runs shell commands through a few reused shell sessions to avoid the shell
+        start up time on every command (0.5-2s for powershell).
+        Commands are given as for subprocess, e.g. ["powershell.exe", "Get-Service", "x"],
+        if the first argument is the pool's shell the rest is run in a session,
+        anything else runs as a normal one-shot process.
+        If a session can't be started or dies the command falls back to a one-shot process.
+        """
+        if shell_args is None:
+            shell_args = [
+                "powershell.exe",
+                "-NoLogo",
+                "-NoProfile",
+                "-NonInteractive",
+                "-Command",
+                "-",
+            ]
+        if enabled is None:
+            enabled = sys.platform == "win32"
+        self.shell_args = shell_args
+        self.shell_name = os.path.basename(shell_args[0]).lower()
+        self.dialect = dialect
+        self.max_sessions = max_sessions
+        self.enabled = enabled
+        self._sessions = []
+        self._idle = []
+        self._condition = threading.Condition()
+        atexit.register(self.close)
+
+    @staticmethod
+    def run_one_shot(shell_commands: list, timeout: float = None) -> bytes:
+        return subprocess.run(shell_commands, stdout=subprocess.PIPE, timeout=timeout).stdout
+
+    def _is_shell_command(self, shell_commands: list) -> bool:
+        return (
+            len(shell_commands) >= 2
+            and os.path.basename(shell_commands[0]).lower() == self.shell_name
+        )
+
+    def command_line(self, shell_commands: list) -> str:
+        """
+        The arguments after the shell as one command line for it, each argument quoted
+        so spaces and quotes in it reach the command unchanged.
+        For powershell arguments are single quoted with embedded ' doubled and the first
+        is run with the call operator. Switches (e.g. -noimage) are left bare, quoted
+        they would be passed to a script or cmdlet as strings.
+        """
+        args = shell_commands[1:]
+        if self.dialect == "sh":
+            return " ".join(shlex.quote(arg) for arg in args)
+        quoted = [
+            (
+                arg
+                if re.fullmatch(r"--?[A-Za-z][\w-]*", arg)
+                else "'" + arg.replace("'", "''") + "'"
+            )
+            for arg in args
+        ]
+        return "& " + " ".join(quoted)
+
+    def _one_shot(self, shell_commands: list, timeout: float = None) -> bytes:
+        # the shell is given the same command line as a session so both run it alike
+        if self._is_shell_command(shell_commands):
+            shell_commands = [
+                shell_commands[0],
+                self.command_flags[self.dialect],
+                self.command_line(shell_commands),
+            ]
+        return self.run_one_shot(shell_commands, timeout)
+
+    def _uses_session(self, shell_commands: list) -> bool:
+        if not self.enabled or not self._is_shell_command(shell_commands):
+            return False
+        # the session reads commands as utf-8 which the shell may not decode, keep to ascii
+        return all(arg.isascii() for arg in shell_commands)
+
+    def _acquire(self) -> ShellSession:
+        with self._condition:
+            while len(self._idle) == 0 and len(self._sessions) >= self.max_sessions:
+                self._condition.wait()
+            if len(self._idle) != 0:
+                return self._idle.pop()
+            session = ShellSession(self.shell_args, self.dialect)
+            self._sessions.append(session)
+            return session
+
+    def _release(self, session: ShellSession) -> None:
+        with self._condition:
+            self._idle.append(session)
+            self._condition.notify()
+
+    def run(self, shell_commands: list, timeout: float = None) -> bytes:
+        """
+        Run the command and return its stdout as bytes.
+        Raises subprocess.TimeoutExpired if the command runs longer than timeout.
+        """
+        if not self._uses_session(shell_commands):
+            return self._one_shot(shell_commands, timeout)
+        session = self._acquire()
+        try:
+            output, returncode = session.run(self.command_line(shell_commands), timeout)
+            logging.debug(f"Shell session command exit status {returncode}")
+            return output
+        except ShellStartError as e:
+            logging.warning(f"Shell sessions disabled, running commands one-shot - {e}")
+            self.enabled = False
+            return self._one_shot(shell_commands, timeout)
+        except ShellSessionError as e:
+            logging.debug(f"Shell session failed, running one-shot - {e}")
+            return self._one_shot(shell_commands, timeout)
+        finally:
+            self._release(session)
+
+    def close(self) -> None:
+        with self._condition:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._idle = []
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    if sys.platform == "win32":
+        pool = ShellPool()
+        command = ["powershell.exe"] + sys.argv[1:]
+    else:
+        pool = ShellPool(["sh"], "sh", enabled=True)
+        command = ["sh"] + sys.argv[1:]
+    print(pool.run(command).decode("utf-8", errors="ignore"))
+    pool.close()
+    sys.exit()
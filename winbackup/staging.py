@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import shutil
+import logging
+
+
+class ArchiveStaging:
+    policies = ("delete", "recycle", "keep")
+
+    def __init__(
+        self, out_path: str, staging_path: str, keep_path: str = None, policy: str = "delete"
+    ) -> None:
+        """
+        New archives of a target are written to a staging folder and only moved into
+        out_path once the target succeeded, so a failed run never costs the previous backup.
+        staging_path must be on the same volume as out_path so each file is swapped in
+        with an atomic rename.
+        Archives of a previous run with the same names are handled by policy:
+        - delete  : deleted permanently (overwritten by the rename)
+        - recycle : sent to the recycle bin
+        - keep    : moved to keep_path, replacing the version kept before
+        """
+        if policy not in self.policies:
+            raise ValueError(
+                f"Unknown old archive policy {policy}, expected one of {self.policies}"
+            )
+        if policy == "keep" and keep_path is None:
+            raise ValueError("keep_path needed to keep old archives")
+        self.out_path = out_path
+        self.staging_path = staging_path
+        self.keep_path = keep_path
+        self.policy = policy
+
+    def _folder(self, name: str) -> str:
+        return os.path.join(self.staging_path, name)
+
+    def begin(self, name: str) -> str:
+        """
+        Returns an empty staging folder for the archives of name, left overs of an
+        interrupted run are removed.
+        """
+        folder = self._folder(name)
+        if os.path.exists(folder):
+            logging.debug(f"Removing partial archives of an earlier run from {folder}")
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+        return folder
+
+    def discard(self, name: str) -> None:
+        """
+        Remove the staged archives of a failed target, the previous archives are kept.
+        """
+        folder = self._folder(name)
+        if os.path.exists(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+        logging.info(f"Partial archives of {name} removed, previous archives kept")
+
+    @staticmethod
+    def existing(folder: str, prefixes: list) -> list:
+        """
+        Files in folder belonging to a target, i.e. starting with one of prefixes.
+        """
+        if not os.path.isdir(folder):
+            return []
+        return sorted(
+            file
+            for file in os.listdir(folder)
+            if file.startswith(tuple(prefixes)) and os.path.isfile(os.path.join(folder, file))
+        )
+
+    def _retire(self, file: str) -> None:
+        path = os.path.join(self.out_path, file)
+        if self.policy == "recycle":
+            from send2trash import send2trash
+
+            send2trash(path)
+        elif self.policy == "keep":
+            os.makedirs(self.keep_path, exist_ok=True)
+            os.replace(path, os.path.join(self.keep_path, file))
+        else:
+            os.remove(path)
+        logging.debug(f"Old archive {file} - {self.policy}")
+
+    def commit(self, name: str, prefixes: list) -> list:
+        """
+        Swap the staged archives of name into out_path. Old files matching prefixes
+        are handled by the policy, old volumes not replaced by a new file are removed
+        the same way. Returns the names of the files moved in.
+        """
+        folder = self._folder(name)
+        new_files = sorted(os.listdir(folder))
+        old_files = self.existing(self.out_path, prefixes)
+        if self.policy == "keep" and len(old_files) != 0:
+            # only the last version is kept
+            for file in self.existing(self.keep_path, prefixes):
+                os.remove(os.path.join(self.keep_path, file))
+        for file in old_files:
+            # with delete the rename below replaces same name files
+            if self.policy != "delete" or file not in new_files:
+                self._retire(file)
+        for file in new_files:
+            os.replace(os.path.join(folder, file), os.path.join(self.out_path, file))
+        os.rmdir(folder)
+        logging.info(
+            f"{len(new_files)} new archive files of {name} moved in, "
+            + f"{len(old_files)} old files ({self.policy})"
+        )
+        return new_files
+
+    def cleanup(self) -> None:
+        """
+        Remove the staging folder of the run if nothing is left in it.
+        """
+        try:
+            os.rmdir(self.staging_path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    staging = ArchiveStaging(sys.argv[1], os.path.join(sys.argv[1], ".staging"))
+    folder = staging.begin("demo.7z")
+    with open(os.path.join(folder, "demo.7z"), "w") as fout:
+        fout.write("demo")
+    print(staging.commit("demo.7z", ["demo.7z"]))
+    sys.exit()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import sys
+import time
+import logging
+import threading
+import subprocess
+from typing import Callable
+from contextlib import contextmanager
+
+
+class Cancelled(Exception):
+    """
+    The run was cancelled (Ctrl-C), its child processes were stopped.
+    """
+
+
+class TargetTimeout(RuntimeError):
+    """
+    A target ran past its timeout, its child processes were stopped.
+    """
+
+
+class Stalled(RuntimeError):
+    """
+    A child process reported no progress for the stall timeout and was stopped.
+    """
+
+
+class ProcessSupervisor:
+    def __init__(
+        self,
+        stall_timeout: float = 0,
+        poll: float = 1.0,
+        grace: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Watches the child processes of the archiver from a watchdog thread:
+        - cancel() stops every running child and refuses new ones
+        - children still running past the deadline (see deadline()) are stopped
+        - watched children reporting no progress() for stall_timeout seconds are stopped,
+          e.g. 7z hanging on a network path. 0 disables.
+        A child is stopped with terminate, then kill if it is still running after grace
+        seconds. check() raises Cancelled, TargetTimeout or Stalled for a stopped child.
+        The watchdog thread runs while there are children and ends when the last is done.
+        """
+        self.stall_timeout = stall_timeout
+        self.poll = poll
+        self.grace = grace
+        self.clock = clock
+        self.processes = {}
+        self.stopped = {}
+        self.cancelled = False
+        self.deadline_at = None
+        self.children = []
+        # reentrant as cancel() runs in the Ctrl-C handler of the main thread
+        self.lock = threading.RLock()
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, global_config: dict) -> "ProcessSupervisor":
+        return cls(stall_timeout=global_config.get("stall_timeout", 900))
+
+    def child(self) -> "ProcessSupervisor":
+        """
+        Supervisor with its own deadline for one of several targets run at once,
+        cancel() of this supervisor also cancels the child.
+        """
+        child = ProcessSupervisor(self.stall_timeout, self.poll, self.grace, self.clock)
+        with self.lock:
+            child.cancelled = self.cancelled
+            self.children.append(child)
+        return child
+
+    def register(self, process: subprocess.Popen) -> None:
+        """
+        Supervise a started child. Children started after cancel() are stopped at once.
+        """
+        with self.lock:
+            self.processes[process] = {"watched": False, "last": self.clock()}
+            cancelled = self.cancelled
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._watchdog, daemon=True)
+                self.thread.start()
+        if cancelled:
+            self._stop([(process, Cancelled("Run cancelled"))])
+
+    def watch(self, process: subprocess.Popen) -> None:
+        """
+        Enable the stall check for a child reporting its progress.
+        """
+        with self.lock:
+            if process in self.processes:
+                self.processes[process].update(watched=True, last=self.clock())
+
+    def progress(self, process: subprocess.Popen) -> None:
+        with self.lock:
+            if process in self.processes:
+                self.processes[process]["last"] = self.clock()
+
+    def check(self, process: subprocess.Popen) -> None:
+        """
+        Raise the reason a finished child was stopped, if it was.
+        """
+        with self.lock:
+            self.processes.pop(process, None)
+            reason = self.stopped.pop(process, None)
+        if reason is not None:
+            raise reason
+
+    @contextmanager
+    def deadline(self, seconds: float):
+        """
+        Children still running seconds from now are stopped with TargetTimeout.
+        0, a negative value or None for no deadline.
+        """
+        if not seconds or seconds <= 0:
+            yield
+            return
+        self.deadline_at = self.clock() + seconds
+        try:
+            yield
+        finally:
+            self.deadline_at = None
+
+    def _stop(self, victims: list) -> None:
+        for process, reason in victims:
+            logging.warning(f"Stopping child process {process.pid} - {reason}")
+            with self.lock:
+                self.stopped[process] = reason
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        for process, _ in victims:
+            try:
+                process.wait(self.grace)
+            except subprocess.TimeoutExpired:
+                logging.warning(f"Child process {process.pid} did not stop - killing")
+                process.kill()
+
+    def cancel(self) -> None:
+        """
+        Stop every running child, children started later are stopped at once.
+        The child supervisors are cancelled too.
+        """
+        with self.lock:
+            self.cancelled = True
+            victims = [
+                (process, Cancelled("Run cancelled"))
+                for process in self.processes
+                if process not in self.stopped and process.poll() is None
+            ]
+            children = list(self.children)
+        self._stop(victims)
+        for child in children:
+            child.cancel()
+
+    def sweep(self) -> list:
+        """
+        One watchdog pass, stops the children past the deadline or stalled.
+        Returns the stopped children.
+        """
+        now = self.clock()
+        victims = []
+        with self.lock:
+            for process, state in list(self.processes.items()):
+                if process in self.stopped:
+                    continue
+                if process.poll() is not None:
+                    # finished without being stopped, nothing to report
+                    del self.processes[process]
+                    continue
+                if self.deadline_at is not None and now >= self.deadline_at:
+                    victims.append((process, TargetTimeout("Target timeout reached")))
+                elif (
+                    state["watched"]
+                    and self.stall_timeout
+                    and now - state["last"] >= self.stall_timeout
+                ):
+                    victims.append(
+                        (process, Stalled(f"No progress for {self.stall_timeout:0.0f}s"))
+                    )
+        self._stop(victims)
+        return [process for process, _ in victims]
+
+    def _watchdog(self) -> None:
+        while True:
+            time.sleep(self.poll)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Process watchdog error - {e}")
+            with self.lock:
+                # register() starts a new watchdog for the next child
+                if len(self.processes) == 0:
+                    self.thread = None
+                    return
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    supervisor = ProcessSupervisor(stall_timeout=2)
+    with subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"]) as p:
+        supervisor.register(p)
+        supervisor.watch(p)
+    try:
+        supervisor.check(p)
+    except Stalled as e:
+        print(f"stopped - {e}")
+    sys.exit()
@@ -14,69 +14,271 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see < https: // www.gnu.org/licenses/>.
 
+import io
 import sys
 import os
+import time
 import subprocess
 from colorama import Fore, Style
 import logging
 import traceback
-import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Union
+
+from . import shellsession
+from . import collectorcache
+from . import inventory
+from . import configsink
+
+
+class CollectorResult(NamedTuple):
+    name: str
+    status: str  # ok, cached, skipped, failed or timeout
+    duration: float  # seconds
+    error: str
 
 
 class SystemConfigSaver:
-    def __init__(self, config_save_path=None) -> None:
+    def __init__(self, config_save_path=None, shell: shellsession.ShellPool = None) -> None:
         """
         Saves system configuration to files for backup.
         Config save path should be an empty folder to save all config files/folders to.
         winbackup script -> create 'config' folder, save config, 7z config, delete folder.
+        The collectors are independent and run concurrently, each command has a timeout.
+        Powershell commands run through the shell session pool, shared with WinBackup if given.
         """
+        if shell is None:
+            shell = shellsession.ShellPool()
+        self.shell = shell
         real_path = os.path.dirname(os.path.realpath(__file__))
         self.config_save_path = config_save_path
         self.winfetch_path = os.path.join(real_path, "scripts", "winfetch.ps1")
         self.winfetch_config_path = os.path.join(real_path, "scripts", "config.ps1")
         self.installed_prog_path = os.path.join(real_path, "scripts", "installed_programs.ps1")
         self.videos_path = os.path.join(os.path.expanduser("~"), "Videos")
+        # seconds a collector command may run before it is killed
+        self.default_timeout = 120
+        self.timeouts = {
+            "winfetch": 300,
+            "installed_programs": 300,
+            "drivers": 300,
+            "systeminfo": 300,
+        }
+        self.collector_report = []
+        # outputs of slow collectors are reused for ttl seconds unless their trigger changes
+        self.cache = None
+        self.cache_ttls = {
+            "installed_programs": 604800,
+            "file_associations": 604800,
+            "drivers": 604800,
+            "choco_packages": 604800,
+            "vscode_extensions": 604800,
+            "systeminfo": 86400,
+            "python_packages": 86400,
+        }
+        self.cache_triggers = {
+            "installed_programs": lambda: self._registry_timestamp(
+                [
+                    r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall",
+                    r"SOFTWARE\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall",
+                ],
+                subkeys=True,
+            ),
+            "file_associations": lambda: self._registry_timestamp([r"SOFTWARE\Classes"]),
+            "drivers": lambda: self._path_mtime(
+                os.path.join(
+                    os.environ.get("SystemRoot", "C:\\Windows"),
+                    "System32",
+                    "DriverStore",
+                    "FileRepository",
+                )
+            ),
+            "choco_packages": lambda: self._path_mtime(
+                os.path.join(
+                    os.environ.get("ChocolateyInstall", "C:\\ProgramData\\chocolatey"), "lib"
+                )
+            ),
+            "vscode_extensions": lambda: self._path_mtime(
+                os.path.join(os.path.expanduser("~"), ".vscode", "extensions")
+            ),
+        }
 
-    @staticmethod
-    def _command_runner(shell_commands: list) -> str:
+    def _command_runner(self, shell_commands: list, timeout: float = None) -> str:
         logging.debug(f"Command runner cmds: {shell_commands}")
-        return subprocess.run(shell_commands, stdout=subprocess.PIPE).stdout.decode(
-            "utf-8", errors="ignore"
-        )
+        return self.shell.run(shell_commands, timeout=timeout).decode("utf-8", errors="ignore")
+
+    def _timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
 
     def set_videos_directory_path(self, videos_path: str) -> None:
         logging.debug(f"Video path set: {videos_path}")
         self.videos_path = videos_path
 
-    def save_config_files(self, out_path: str = None, quiet: bool = False) -> str:
+    def set_cache_directory(self, cache_path: str) -> None:
+        """
+        Enable the collector cache, kept in cache_path between runs. None disables it.
+        """
+        logging.debug(f"Collector cache path set: {cache_path}")
+        self.cache = None if cache_path is None else collectorcache.CollectorCache(cache_path)
+
+    @staticmethod
+    def _registry_timestamp(keys: list, subkeys: bool = False) -> int:
+        """
+        Latest last-write time of the HKLM keys (and their subkeys if subkeys is set).
+        Returns None if the registry can't be read.
+        """
+        try:
+            import winreg
+        except ImportError:
+            return None
+        latest = 0
+        for key_path in keys:
+            try:
+                with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, key_path) as key:
+                    num_subkeys, _, modified = winreg.QueryInfoKey(key)
+                    latest = max(latest, modified)
+                    if subkeys:
+                        for index in range(num_subkeys):
+                            with winreg.OpenKey(key, winreg.EnumKey(key, index)) as subkey:
+                                latest = max(latest, winreg.QueryInfoKey(subkey)[2])
+            except OSError as e:
+                logging.debug(f"Registry key {key_path} not readable - {e}")
+        return latest
+
+    @staticmethod
+    def _path_mtime(path: str) -> float:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _cached(self, name: str, function: Callable) -> Callable:
+        def cached_function(out_path):
+            return self.cache.run(
+                name, function, out_path, self.cache_ttls[name], self.cache_triggers.get(name)
+            )
+
+        return cached_function
+
+    def collectors(self) -> list:
+        """
+        Returns the (name, description, function) of every config collector.
+        Collector functions take the output folder path or a configsink sink,
+        return False if there was nothing to save and raise if saving failed.
+        """
+        return [
+            ("winfetch", "Winfetch", self.save_winfetch),
+            ("installed_programs", "Installed Programs", self.save_installed_programs),
+            ("python_packages", "Global Python Packages", self.save_global_python_packages),
+            ("choco_packages", "Choco Packages", self.save_choco_packages),
+            ("vscode_extensions", "VSCode Extensions", self.save_vscode_extensions),
+            ("path_env", "Path env", self.save_path_env),
+            ("ssh_directory", ".ssh folder", self.save_ssh_directory),
+            ("videos_filenames", "Videos file list", self.save_videos_directory_filenames),
+            ("file_associations", "File associations", self.save_file_associations),
+            ("drivers", "Drivers", self.save_drivers),
+            ("systeminfo", "Systeminfo", self.save_systeminfo),
+            ("battery_report", "Battery report", self.save_battery_report),
+        ]
+
+    @staticmethod
+    def _run_collector(
+        name: str, description: str, function: Callable, out_path: str, quiet: bool
+    ) -> CollectorResult:
+        start = time.perf_counter()
+        error = ""
+        try:
+            result = function(out_path)
+            if result is False:
+                status = "skipped"
+            elif result == collectorcache.CollectorCache.CACHED:
+                status = "cached"
+            else:
+                status = "ok"
+        except subprocess.TimeoutExpired as e:
+            status = "timeout"
+            error = str(e)
+        except Exception as e:
+            status = "failed"
+            error = str(e)
+            logging.debug(traceback.format_exc())
+        duration = time.perf_counter() - start
+
+        if status == "ok":
+            message = f" > {description} saved."
+            logging.info(f"{description} Saved.")
+        elif status == "cached":
+            message = f" > {description} unchanged, reused from cache."
+            logging.info(f"{description} reused from cache.")
+        elif status == "skipped":
+            message = f" - skipping {description} - nothing to save."
+            logging.info(f"{description} skipped, nothing to save.")
+        else:
+            message = (
+                Fore.RED + f" XX Unable to backup {description} ({status})." + Style.RESET_ALL
+            )
+            logging.warning(f"Unable to save {description} ({status}). Exception: {error}")
+        if not quiet:
+            print(message)
+        return CollectorResult(name, status, duration, error)
+
+    def run_collectors(
+        self, collectors: list, out_path: str, quiet: bool = False, workers: int = None
+    ) -> list:
+        """
+        Run the collectors concurrently in a thread pool, the collectors mostly wait on
+        external commands so the total time is close to the slowest single collector.
+        Returns a CollectorResult (name, status, duration, error) per collector.
+        """
+        if workers is None:
+            workers = max(1, len(collectors))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    self._run_collector, name, description, function, out_path, quiet
+                )
+                for name, description, function in collectors
+            ]
+            report = [future.result() for future in futures]
+        total = time.perf_counter() - start
+
+        for result in report:
+            logging.info(
+                f"Collector {result.name:<20} {result.status:<8} {result.duration:6.2f}s"
+            )
+        if len(report) != 0:
+            slowest = max(report, key=lambda result: result.duration)
+            summary = (
+                f"{len(report)} collectors in {total:0.1f}s, "
+                + f"{sum(1 for result in report if result.status in ('ok', 'skipped'))} ok, "
+                + f"{sum(1 for result in report if result.status == 'cached')} cached, "
+                + f"slowest {slowest.name} {slowest.duration:0.1f}s"
+            )
+            logging.info(summary)
+            if not quiet:
+                print(f" >> {summary}")
+        return report
+
+    def save_config_files(
+        self, out_path: Union[str, configsink.MemorySink] = None, quiet: bool = False
+    ) -> Union[str, configsink.MemorySink]:
         """
         Save all the configuration elements.
-        Returns the path the files were saved to.
+        out_path can be a MemorySink to collect the files in memory instead of a folder.
+        If the cache is enabled the slow collectors are only rerun when their output may have changed.
+        The timing and status of each collector is kept in self.collector_report.
+        Returns the path (or sink) the files were saved to.
         """
         if out_path is None:
             out_path = self.config_save_path
-
-        if quiet:
-            null_dev = open(os.devnull, "w")
-            sys.stdout = null_dev
-
-        self.save_winfetch(out_path)
-        self.save_installed_programs(out_path)
-        self.save_global_python_packages(out_path)
-        self.save_choco_packages(out_path)
-        self.save_vscode_extensions(out_path)
-        self.save_path_env(out_path)
-        self.save_ssh_directory(out_path)
-        self.save_videos_directory_filenames(out_path, self.videos_path)
-        self.save_file_associations(out_path)
-        self.save_drivers(out_path)
-        self.save_systeminfo(out_path)
-        self.save_battery_report(out_path)
-
-        if quiet:
-            sys.stdout = sys.__stdout__
-            null_dev.close()
-
+        collectors = []
+        for name, description, function in self.collectors():
+            if self.cache is not None and name in self.cache_ttls:
+                function = self._cached(name, function)
+            collectors.append((name, description, function))
+        self.collector_report = self.run_collectors(collectors, out_path, quiet)
         return out_path
 
     def save_winfetch(self, out_path: str) -> None:
@@ -88,175 +290,134 @@ class SystemConfigSaver:
                 "-stripansi",
                 "-configpath",
                 self.winfetch_config_path,
-            ]
+            ],
+            timeout=self._timeout("winfetch"),
         ).replace("\r\n", "\n")
-        with open(os.path.join(out_path, "winfetch_output.txt"), "w") as out_file:
-            out_file.write(winfetch_output)
-        print(" > Winfetch saved.")
-        logging.info("Winfetch Saved.")
+        configsink.as_sink(out_path).write("winfetch_output.txt", winfetch_output)
 
     def save_installed_programs(self, out_path: str) -> None:
         installed_output = self._command_runner(
-            ["powershell.exe", self.installed_prog_path]
+            ["powershell.exe", self.installed_prog_path],
+            timeout=self._timeout("installed_programs"),
         ).replace("\r\n", "\n")
         installed_output = installed_output.split("\n", 1)[1].strip()
-        with open(os.path.join(out_path, "installed_programs.csv"), "w") as out_file:
-            out_file.write(installed_output)
-        print(" > Installed Programs saved.")
-        logging.info("Installed Programs Saved.")
+        configsink.as_sink(out_path).write("installed_programs.csv", installed_output)
 
     def save_global_python_packages(self, out_path: str) -> None:
-        try:
-            py_version = self._command_runner(["powershell.exe", "python", "-V"]).replace(
-                "\r\n", "\n"
-            )
-            pip_output = self._command_runner(["powershell.exe", "pip", "freeze"]).replace(
-                "\r\n", "\n"
-            )
-            pip_output = py_version + pip_output
-            with open(os.path.join(out_path, "python_packages.txt"), "w") as out_file:
-                out_file.write(pip_output)
-            print(" > Global Python Packages saved.")
-            logging.info("Global Python Packages Saved.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup global python packages" + Style.RESET_ALL)
-            logging.warning(f"Unable to save global python packages. Exception: {e}")
+        py_version = self._command_runner(
+            ["powershell.exe", "python", "-V"], timeout=self._timeout("python_packages")
+        ).replace("\r\n", "\n")
+        pip_output = self._command_runner(
+            ["powershell.exe", "pip", "freeze"], timeout=self._timeout("python_packages")
+        ).replace("\r\n", "\n")
+        pip_output = py_version + pip_output
+        configsink.as_sink(out_path).write("python_packages.txt", pip_output)
 
     def save_choco_packages(self, out_path: str) -> None:
-        try:
-            choco_output = self._command_runner(
-                ["powershell.exe", "choco", "list", "--local-only"]
-            ).replace("\r\n", "\n")
-            with open(os.path.join(out_path, "choco_packages.txt"), "w") as out_file:
-                out_file.write(choco_output)
-            print(" > Choco Packages saved.")
-            logging.info("Choco Packages Saved.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup choco packages." + Style.RESET_ALL)
-            logging.warning(f"Unable to save choco packages. Exception: {e}")
+        choco_output = self._command_runner(
+            ["powershell.exe", "choco", "list", "--local-only"],
+            timeout=self._timeout("choco_packages"),
+        ).replace("\r\n", "\n")
+        configsink.as_sink(out_path).write("choco_packages.txt", choco_output)
 
     def save_vscode_extensions(self, out_path: str) -> None:
-        try:
-            choco_output = self._command_runner(
-                ["powershell.exe", "code", "--list-extensions"]
-            ).replace("\r\n", "\n")
-            with open(os.path.join(out_path, "vscode_extensions.txt"), "w") as out_file:
-                out_file.write(choco_output)
-            print(" > VSCode Extensions saved.")
-            logging.info("VSCode extensions Saved.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup VSCode extensions." + Style.RESET_ALL)
-            logging.warning(f"Unable to save VSCode extensions packages. Exception: {e}")
+        code_output = self._command_runner(
+            ["powershell.exe", "code", "--list-extensions"],
+            timeout=self._timeout("vscode_extensions"),
+        ).replace("\r\n", "\n")
+        configsink.as_sink(out_path).write("vscode_extensions.txt", code_output)
 
     def save_path_env(self, out_path: str) -> None:
         path_list = os.environ["PATH"].split(";")
-        with open(os.path.join(out_path, "path.txt"), "w") as out_file:
-            for path in path_list:
-                fixed_path = path.replace("\\", "/")
-                out_file.write(fixed_path + "\n")
-        print(" > Path env saved.")
-        logging.info("Path env Saved.")
-
-    def save_ssh_directory(self, out_path: str) -> None:
-        try:
-            ssh_path = os.path.join(os.path.expanduser("~"), ".ssh")
-            logging.debug(f"ssh path {ssh_path}")
-            if os.path.exists(ssh_path):
-                shutil.copytree(ssh_path, os.path.join(out_path, ".ssh"))
-                print(" > .ssh folder saved.")
-                logging.info(".ssh folder Saved.")
-            else:
-                print(" > .ssh folder does not exist - skipping")
-                logging.info(".ssh folder does not exist, skipping.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup .ssh folder." + Style.RESET_ALL)
-            logging.warning(f"Unable to backup .ssh folder. Exception: {e}")
-
-    def save_videos_directory_filenames(self, out_path: str, videos_path: str) -> None:
+        fixed_paths = "".join(path.replace("\\", "/") + "\n" for path in path_list)
+        configsink.as_sink(out_path).write("path.txt", fixed_paths)
+
+    def save_ssh_directory(self, out_path: str) -> bool:
+        ssh_path = os.path.join(os.path.expanduser("~"), ".ssh")
+        logging.debug(f"ssh path {ssh_path}")
+        if not os.path.exists(ssh_path):
+            logging.info(".ssh folder does not exist, skipping.")
+            return False
+        configsink.as_sink(out_path).add_tree(".ssh", ssh_path)
+        return True
+
+    def save_videos_directory_filenames(self, out_path: str, videos_path: str = None) -> bool:
+        """
+        Save a CSV inventory (path, size, mtime) of the videos folder.
+        With the cache enabled only folders changed since the last run are listed again.
+        """
+        if videos_path is None:
+            videos_path = self.videos_path
         logging.debug(f"Videos file list directory: {videos_path}")
-        response = self._command_runner(["powershell.exe", "tree", videos_path]).replace(
-            "\r\n", "\n"
+        if not os.path.isdir(videos_path):
+            logging.info(f"Videos folder {videos_path} does not exist, skipping.")
+            return False
+        state_path = None
+        if self.cache is not None:
+            state_path = os.path.join(self.cache.cache_dir, "videos_inventory.json")
+        videos_inventory = inventory.DirectoryInventory(state_path)
+        csv_buffer = io.StringIO(newline="")
+        videos_inventory.write_rows(videos_path, csv_buffer)
+        configsink.as_sink(out_path).write(
+            "videos_inventory.csv", csv_buffer.getvalue().encode("utf-8")
         )
-        with open(os.path.join(out_path, "videos_tree.txt"), "w") as out_file:
-            out_file.write(response)
-        print(" > Videos file list saved.")
-        logging.info("Video Files list Saved.")
+        return True
 
     def save_file_associations(self, out_path: str) -> None:
-        try:
-            file_assoc = self._command_runner(
-                ["powershell.exe", "cmd", "/c", "assoc"]
-            ).replace("\r\n", "\n")
-            with open(os.path.join(out_path, "file_associations.txt"), "w") as out_file:
-                out_file.write(file_assoc)
-            print(" > File associations saved.")
-            logging.info("File associations Saved.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup file associations." + Style.RESET_ALL)
-            logging.warning(f"Unable to save file associations. Exception: {e}")
+        file_assoc = self._command_runner(
+            ["powershell.exe", "cmd", "/c", "assoc"],
+            timeout=self._timeout("file_associations"),
+        ).replace("\r\n", "\n")
+        configsink.as_sink(out_path).write("file_associations.txt", file_assoc)
 
     def save_drivers(self, out_path: str) -> None:
-        try:
-            drivers = self._command_runner(["powershell.exe", "driverquery"]).replace(
-                "\r\n", "\n"
-            )
-            with open(os.path.join(out_path, "drivers.txt"), "w") as out_file:
-                out_file.write(drivers)
-            print(" > Drivers saved.")
-            logging.info("Drivers Saved.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup drivers." + Style.RESET_ALL)
-            logging.warning(f"Unable to save Drivers. Exception: {e}")
+        drivers = self._command_runner(
+            ["powershell.exe", "driverquery"], timeout=self._timeout("drivers")
+        ).replace("\r\n", "\n")
+        configsink.as_sink(out_path).write("drivers.txt", drivers)
 
     def save_systeminfo(self, out_path: str) -> None:
-        try:
-            sysinfo = self._command_runner(["powershell.exe", "systeminfo"]).replace(
-                "\r\n", "\n"
-            )
-            with open(os.path.join(out_path, "systeminfo.txt"), "w") as out_file:
-                out_file.write(sysinfo)
-            print(" > Systeminfo saved.")
-            logging.info("Systeminfo Saved.")
-        except Exception as e:
-            print(Fore.RED + " XX Unable to backup systeminfo." + Style.RESET_ALL)
-            logging.warning(f"Unable to save systeminfo. Exception: {e}")
+        sysinfo = self._command_runner(
+            ["powershell.exe", "systeminfo"], timeout=self._timeout("systeminfo")
+        ).replace("\r\n", "\n")
+        configsink.as_sink(out_path).write("systeminfo.txt", sysinfo)
 
-    def save_battery_report(self, out_path: str) -> None:
-        try:
+    def save_battery_report(self, out_path: str) -> bool:
+        # powercfg writes the report itself, it goes to the system temp folder first
+        # so nothing is written to the backup disk when collecting to memory
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_path = os.path.join(temp_dir, "batteryreport.html")
             shell_commands = [
                 "powershell.exe",
                 "powercfg",
                 "/batteryreport",
                 "/output",
-                os.path.join(out_path, "batteryreport.html"),
+                report_path,
             ]
             batreport = (
-                subprocess.run(shell_commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                subprocess.run(
+                    shell_commands,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=self._timeout("battery_report"),
+                )
                 .stderr.decode("utf-8", errors="ignore")
                 .replace("\r\n", "\n")
             )
-
-            if "Unable to perform operation." not in batreport:
-                print(" > Battery report saved.")
-                logging.info("Battery report Saved.")
-            elif "media pool is empty" in batreport:
-                print(" - skipping battery report - this is not a battery powered device.")
-                logging.info("skipping battery report - this is not a battery powered device.")
-            else:
-                print(
-                    Fore.RED
-                    + " X unable to save battery report - unknown error (Is this a battery powered device?)"
-                    + Style.RESET_ALL
-                )
-                logging.error(
-                    "Unable to save battery report - unknown error (Is this a battery powered device?)"
-                )
-                logging.debug(f"battery report response unknown: {batreport}")
-                raise ValueError("unknown response from batreport")
-        except Exception as e:
-            print(Fore.RED + " XX unable to backup battery report." + Style.RESET_ALL)
-            logging.warning(f"Unable to save battery report. Exception: {e}")
-            logging.debug(traceback.format_exc())
+            if os.path.exists(report_path):
+                configsink.as_sink(out_path).add_file("batteryreport.html", report_path)
+
+        if "Unable to perform operation." not in batreport:
+            return True
+        elif "media pool is empty" in batreport:
+            logging.info("skipping battery report - this is not a battery powered device.")
+            return False
+        else:
+            logging.error(
+                "Unable to save battery report - unknown error (Is this a battery powered device?)"
+            )
+            logging.debug(f"battery report response unknown: {batreport}")
+            raise ValueError("unknown response from batreport")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import logging
+import threading
+
+
+class BandwidthLimiter:
+    def __init__(self, rate: int, burst: int = None, clock=time.monotonic, sleep=time.sleep):
+        """
+        Token bucket shared by all threads of a run, caps the bytes per second they read
+        or write together. Callers going over the rate sleep until their bytes are paid for.
+        A rate of 0 disables the cap. burst defaults to one second of the rate.
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._time = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> float:
+        """
+        Account for nbytes, sleeping if over the rate. Returns the seconds slept.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+class RunProfile:
+    profiles = ("normal", "background")
+    # Windows process priority classes and modes
+    below_normal_priority_class = 0x00004000
+    process_mode_background_begin = 0x00100000
+    # NtSetInformationProcess ProcessIoPriority class and the IoPriorityLow value
+    process_io_priority = 33
+    io_priority_low = 1
+
+    def __init__(
+        self,
+        name: str = "normal",
+        bandwidth: int = 0,
+        max_load: float = 0.75,
+        nice: int = 10,
+    ) -> None:
+        """
+        How hard a run may use the machine. The normal profile changes nothing.
+        The background profile is for backups while the PC is in use:
+        - the 7z children (and winbackup itself, which does the hashing) run at low
+          process priority, and low I/O priority where the OS supports it
+        - the Python side read/write pipelines are capped at bandwidth bytes/s (0 no cap)
+        - thread counts are reduced when the system load is over max_load (0-1)
+        """
+        if name not in self.profiles:
+            raise ValueError(f"Unknown run profile {name}, expected one of {self.profiles}")
+        self.name = name
+        self.max_load = max_load
+        self.nice = nice
+        self.limiter = BandwidthLimiter(bandwidth if name == "background" else 0)
+        self._cpu_sample = None
+
+    @classmethod
+    def from_config(cls, global_config: dict) -> "RunProfile":
+        return cls(
+            global_config.get("run_profile", "normal"),
+            bandwidth=global_config.get("background_bandwidth", 0),
+            max_load=global_config.get("background_max_load", 0.75),
+        )
+
+    @property
+    def background(self) -> bool:
+        return self.name == "background"
+
+    def popen_kwargs(self) -> dict:
+        """
+        Extra subprocess.Popen / run arguments for every child process.
+        """
+        if not self.background:
+            return {}
+        if sys.platform == "win32":
+            return {"creationflags": self.below_normal_priority_class}
+        # Linux derives the I/O priority of the best-effort class from the nice value
+        return {"preexec_fn": lambda: os.nice(self.nice)}
+
+    def after_start(self, process) -> None:
+        """
+        Lower the I/O priority of a started child, only possible on Windows.
+        Failing to set it is logged and the child keeps running.
+        """
+        if not self.background or sys.platform != "win32":
+            return
+        try:
+            import ctypes
+
+            priority = ctypes.c_ulong(self.io_priority_low)
+            status = ctypes.windll.ntdll.NtSetInformationProcess(
+                int(process._handle),
+                self.process_io_priority,
+                ctypes.byref(priority),
+                ctypes.sizeof(priority),
+            )
+            if status != 0:
+                logging.debug(f"Could not lower I/O priority of {process.pid} - {status:#x}")
+        except Exception as e:
+            logging.debug(f"Could not lower I/O priority of {process.pid} - {e}")
+
+    def lower_current_process(self) -> None:
+        """
+        Run winbackup itself (the hashing and copy threads) at background priority.
+        """
+        if not self.background:
+            return
+        try:
+            if sys.platform == "win32":
+                import ctypes
+
+                kernel32 = ctypes.windll.kernel32
+                kernel32.SetPriorityClass(
+                    kernel32.GetCurrentProcess(), self.process_mode_background_begin
+                )
+            else:
+                os.nice(self.nice)
+            logging.info("Background run profile - running at low priority")
+        except Exception as e:
+            logging.warning(f"Could not lower the process priority - {e}")
+
+    def _windows_cpu_load(self) -> float:
+        import ctypes
+
+        def sample() -> tuple:
+            idle, kernel, user = (ctypes.c_ulonglong() for _ in range(3))
+            ctypes.windll.kernel32.GetSystemTimes(
+                ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)
+            )
+            return idle.value, kernel.value + user.value
+
+        if self._cpu_sample is None:
+            self._cpu_sample = sample()
+            time.sleep(0.25)
+        idle, total = sample()
+        last_idle, last_total = self._cpu_sample
+        self._cpu_sample = (idle, total)
+        if total == last_total:
+            return None
+        # kernel time includes the idle time
+        return 1 - (idle - last_idle) / (total - last_total)
+
+    def system_load(self) -> float:
+        """
+        CPU load of the whole system as a fraction of all cores, None if unknown.
+        """
+        try:
+            if sys.platform == "win32":
+                return self._windows_cpu_load()
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except Exception as e:
+            logging.debug(f"System load unknown - {e}")
+            return None
+
+    def threads(self, requested: int) -> int:
+        """
+        Number of threads to use instead of requested. In the background profile the
+        count is scaled down with the load over max_load, to 1 at full load.
+        """
+        if not self.background or self.max_load >= 1:
+            return requested
+        load = self.system_load()
+        if load is None or load <= self.max_load:
+            return requested
+        spare = max(0.0, 1 - load) / (1 - self.max_load)
+        threads = max(1, int(requested * spare))
+        if threads != requested:
+            logging.debug(f"System load {load:0.2f} - using {threads} of {requested} threads")
+        return threads
+
+    def limit(self, nbytes: int) -> None:
+        self.limiter.consume(nbytes)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    profile = RunProfile("background", bandwidth=1048576)
+    print(f"system load {profile.system_load()}, threads {profile.threads(os.cpu_count())}")
+    start = time.monotonic()
+    for _ in range(8):
+        profile.limit(524288)
+    print(f"4 MiB at 1 MiB/s took {time.monotonic() - start:0.1f}s")
+    sys.exit()
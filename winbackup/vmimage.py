@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY
+# without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see < https: // www.gnu.org/licenses/>.
+
+import os
+import sys
+import errno
+import ctypes
+import logging
+from typing import Iterator
+
+
+class VMImageReader:
+    def __init__(self, block_size: int = 1048576) -> None:
+        """
+        Reads VM disk images skipping the regions that hold no data.
+        Sparse holes are found with SEEK_DATA/SEEK_HOLE where the OS supports it,
+        the remaining data is read in blocks and all-zero blocks are skipped.
+        The data that is kept is described as extents (offset, length) so restore can
+        recreate the image sparse with only the real data written.
+        """
+        self.block_size = block_size
+        self._zero_block = bytes(block_size)
+        self.image_extensions = {".vdi", ".vhd", ".vhdx", ".avhdx", ".vmdk", ".qcow2", ".img"}
+
+    def is_vm_image(self, path: str) -> bool:
+        return os.path.splitext(path)[1].lower() in self.image_extensions
+
+    @staticmethod
+    def data_ranges(fd: int, start: int, end: int) -> list:
+        """
+        Returns (start, end) ranges holding data between start and end of the open file.
+        Falls back to the whole range if the OS or filesystem can't report holes.
+        """
+        if not hasattr(os, "SEEK_DATA") or start >= end:
+            return [(start, end)]
+        ranges = []
+        position = start
+        try:
+            while position < end:
+                try:
+                    data_start = os.lseek(fd, position, os.SEEK_DATA)
+                except OSError as e:
+                    if e.errno == errno.ENXIO:
+                        # no more data after position
+                        break
+                    raise
+                if data_start >= end:
+                    break
+                data_end = min(os.lseek(fd, data_start, os.SEEK_HOLE), end)
+                ranges.append((data_start, data_end))
+                position = data_end
+        except OSError as e:
+            logging.debug(f"SEEK_DATA not supported, reading full range - {e}")
+            return [(start, end)]
+        return ranges
+
+    def iter_data_blocks(self, fin, start: int, end: int) -> Iterator[tuple]:
+        """
+        Yield (offset, data) for every block between start and end that is not a hole
+        and not all zeros. Blocks are aligned to block_size from the start of the file.
+        """
+        for range_start, range_end in self.data_ranges(fin.fileno(), start, end):
+            position = range_start
+            fin.seek(position)
+            while position < range_end:
+                block_end = min((position // self.block_size + 1) * self.block_size, range_end)
+                data = fin.read(block_end - position)
+                if not data:
+                    raise EOFError(f"{fin.name} shorter than expected at {position}")
+                if data != self._zero_block[: len(data)]:
+                    yield position, data
+                position += len(data)
+
+    @staticmethod
+    def merge_extents(extents: list, offset: int, length: int) -> None:
+        """
+        Append the extent to the list, merging it with the last one if they touch.
+        """
+        if len(extents) != 0 and extents[-1][0] + extents[-1][1] == offset:
+            extents[-1][1] += length
+        else:
+            extents.append([offset, length])
+
+    @staticmethod
+    def create_sparse_file(path: str, size: int) -> None:
+        """
+        Create an empty file of size bytes with no data allocated.
+        On NTFS the sparse flag must be set before extending the file.
+        """
+        with open(path, "wb") as fout:
+            if sys.platform == "win32":
+                try:
+                    import msvcrt
+
+                    handle = msvcrt.get_osfhandle(fout.fileno())
+                    FSCTL_SET_SPARSE = 0x000900C4
+                    returned = ctypes.c_ulong(0)
+                    ctypes.windll.kernel32.DeviceIoControl(
+                        handle,
+                        FSCTL_SET_SPARSE,
+                        None,
+                        0,
+                        None,
+                        0,
+                        ctypes.byref(returned),
+                        None,
+                    )
+                except Exception as e:
+                    logging.debug(f"Could not set sparse flag on {path} - {e}")
+            fout.truncate(size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.DEBUG,
+    )
+    reader = VMImageReader()
+    extents = []
+    with open(sys.argv[1], "rb") as fin:
+        for offset, data in reader.iter_data_blocks(fin, 0, os.path.getsize(sys.argv[1])):
+            reader.merge_extents(extents, offset, len(data))
+    print(f"{len(extents)} extents, {sum(length for _, length in extents)} bytes of data")
+    sys.exit()
@@ -15,43 +15,62 @@
 # along with this program.  If not, see < https: // www.gnu.org/licenses/>.
 
 import os
+import re
 import sys
+import copy
+import time
 import signal
 import shutil
+import threading
 import logging
 import ctypes
 import getpass
 import hashlib
-import subprocess
 import traceback
-from io import StringIO
 from datetime import datetime
-from send2trash import send2trash
 from colorama import Fore, Back, Style, init
 from pathlib import Path
-import humanize
 
-from . import systemconfigsaver
-from . import zip7archiver
+# only modules needed by every command are imported here, the archiving and restore
+# modules (and tqdm, humanize, send2trash) are imported when first used
 from . import windowspaths
 from . import configagent
+from . import envprobe
+from . import logpipeline
 from . import __version__
 
 init(autoreset=False)
 
 
+class _LazyAttribute:
+    def __init__(self, factory) -> None:
+        """
+        Instance attribute created by the decorated method on first access.
+        The value is then stored on the instance so the method runs only once.
+        """
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.factory(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
 class WinBackup:
     def __init__(self, log_level) -> None:
         """
         Backup windows files to 7z archives
         """
-        self.archiver = zip7archiver.Zip7Archiver()
-        self.config_saver = systemconfigsaver.SystemConfigSaver()
         self.windows_paths = windowspaths.WindowsPaths()
         self.config_agent = configagent.ConfigAgent()
+        self.target_scans = {}
 
-        self.log_buffer = StringIO()
         self.log_level = log_level
+        self.log_pipeline = logpipeline.LogPipeline(log_level)
         self.logger_tempfile = self._start_logger(log_level)
 
         self.paths = self.windows_paths.get_paths()
@@ -61,10 +80,6 @@ class WinBackup:
         real_path = os.path.dirname(os.path.realpath(__file__))
         self.hyperv_paths_script = os.path.join(real_path, "scripts", "hyperv_paths.ps1")
 
-        self.config_saver.set_videos_directory_path(
-            self.config_agent._target_config["14_videos"]["path"]
-        )
-
         ## ** Plex Specific setup
         plex_config_item = {
             "name": "Plex Server",
@@ -84,39 +99,105 @@ class WinBackup:
             "name": "VirtualBox VMs",
             "path": os.path.join(os.path.expanduser("~"), "VirtualBox VMs"),
             "dict_size": "128m",
+            "large_file_threshold": 4294967296,
+            "vm_image_mode": True,
         }
         if os.path.exists(os.path.join(os.path.expanduser("~"), "VirtualBox VMs")):
             logging.debug("VirtualboxVMs item added to config")
             self.config_agent.add_item("31_virtualboxvms", virtualbox_config_item)
 
-        ## ** HyperV specific setup
-        hyperv_config_item = {
-            "name": "HyperV VMs",
-            "type": "folder",
-            "path": None,
-            "dict_size": "128m",
-            "full_path": True,
-        }
-        if self.check_if_admin() and self._hyperv_possible():
-            logging.debug("HyperV item added to config")
-            hyperv_config_item["path"] = self._get_hyperv_paths()
-            self.config_agent.add_item("32_hypervvms", hyperv_config_item)
+        ## ** powershell probes, only run when a command needs them (see _add_hyperv_target)
+        self.probes = envprobe.EnvProbes(
+            os.path.join(self.paths["local_appdata"], "winbackup", "probe_cache.json")
+        )
+        self.probes.register("is_admin", self.check_if_admin)
+        self.probes.register("hyperv_possible", self._hyperv_possible, cacheable=True)
+        self.probes.register("hyperv_vm_paths", self._get_hyperv_paths, cacheable=True)
+        self.probes.register("hyperv_paths", self._hyperv_target_paths)
+        self.probes.register("plex_running", self._plex_server_running)
 
         ## ** onenote specific setup
         ## 33_onenote
         ## default compression settings, to be implemented
 
-    @staticmethod
-    def _command_runner(shell_commands: list) -> str:
+    ## ** archiving and restore helpers, created when a command first uses them
+    @_LazyAttribute
+    def run_profile(self):
+        """
+        Priority, bandwidth and thread limits from the global config, see throttle.RunProfile.
+        """
+        from . import throttle
+
+        return throttle.RunProfile.from_config(self.config_agent.global_config)
+
+    @_LazyAttribute
+    def archiver(self):
+        from . import zip7archiver
+        from . import supervisor
+
+        return zip7archiver.Zip7Archiver(
+            profile=self.run_profile,
+            process_supervisor=supervisor.ProcessSupervisor.from_config(
+                self.config_agent.global_config
+            ),
+        )
+
+    @_LazyAttribute
+    def shell(self):
+        from . import shellsession
+
+        return shellsession.ShellPool()
+
+    @_LazyAttribute
+    def config_saver(self):
+        from . import systemconfigsaver
+
+        config_saver = systemconfigsaver.SystemConfigSaver(shell=self.shell)
+        config_saver.set_videos_directory_path(
+            self.config_agent._target_config["14_videos"]["path"]
+        )
+        return config_saver
+
+    @_LazyAttribute
+    def scanner(self):
+        from . import filescanner
+
+        return filescanner.FileScanner()
+
+    @_LazyAttribute
+    def deduplicator(self):
+        from . import deduplicator
+
+        return deduplicator.Deduplicator()
+
+    @_LazyAttribute
+    def vm_image_reader(self):
+        from . import vmimage
+
+        return vmimage.VMImageReader()
+
+    @_LazyAttribute
+    def segment_archiver(self):
+        from . import segmentarchiver
+
+        return segmentarchiver.SegmentArchiver(self.archiver, reader=self.vm_image_reader)
+
+    @_LazyAttribute
+    def block_map(self):
+        from . import blockmap
+
+        return blockmap.BlockMap(profile=self.run_profile)
+
+    def _command_runner(self, shell_commands: list, timeout: float = None) -> str:
         logging.debug(f"Command runner cmds: {shell_commands}")
-        return subprocess.run(
-            shell_commands,
-            stdout=subprocess.PIPE,
-        ).stdout.decode("utf-8", errors="ignore")
+        return self.shell.run(shell_commands, timeout=timeout).decode("utf-8", errors="ignore")
 
     def _ctrl_c_handler(self, signum, frame):
         print()
         print(Fore.RED + " Ctrl-C received - Exiting." + Style.RESET_ALL)
+        # stop the 7z children, their partial archives are removed as the run unwinds
+        if "archiver" in self.__dict__:
+            self.archiver.supervisor.cancel()
         sys.exit(1)
 
     def cli_get_output_root_path(self) -> str:
@@ -153,60 +234,15 @@ class WinBackup:
     def _start_logger(self, log_level) -> None:
         """
         if log level is debug, write logger to file in pwd unless a backup is run, then move file to backup output dir
-        if log level is info or above, write logger to buffer and flush to disk in backup output dir when backup is run.
+        if log level is info or above, keep the log in a ring buffer and write it to the backup output dir when backup is run.
+        Records are written by a background thread (see logpipeline).
         """
-
-        # get the root logger
-        logger = logging.getLogger()
-        logger.setLevel(log_level)
-
-        if log_level == logging.DEBUG:
-            log_format = "%(asctime)s - %(levelname)s [%(module)s:%(funcName)s:%(lineno)d] -> %(message)s"
-            log_handler = logging.FileHandler(
-                os.path.join(os.getcwd(), "winbackup.log"), mode="w", encoding="utf-8"
-            )
-        else:
-            log_format = "%(asctime)s - %(levelname)s -> %(message)s"
-            log_handler = logging.StreamHandler(self.log_buffer)
-
-        formatter = logging.Formatter(log_format)
-        log_handler.setFormatter(formatter)
-        logger.addHandler(log_handler)
+        self.log_pipeline.start(os.path.join(os.getcwd(), "winbackup.log"))
         logging.debug("Log Handler Started")
 
     def _redirect_logger(self, out_path, log_level) -> None:
         logging.debug("Log Handler Redirect Started")
-        logger = logging.getLogger()
-
-        # remove root log handlers
-        for handler in logger.handlers:
-            logger.removeHandler(handler)
-            handler.close()
-
-        logger.setLevel(log_level)
-        if log_level == logging.DEBUG:
-            # move temp log in cwd to output path
-            shutil.move(
-                os.path.join(os.getcwd(), "winbackup.log"),
-                os.path.join(out_path, "winbackup.log"),
-            )
-            # create new handler to append to the new log location
-            log_format = "%(asctime)s - %(levelname)s [%(module)s:%(funcName)s:%(lineno)d] -> %(message)s"
-        else:
-            # write the log buffer to disk and close the buffer
-            with open(os.path.join(out_path, "winbackup.log"), "w", encoding="utf-8") as fout:
-                self.log_buffer.seek(0)
-                shutil.copyfileobj(self.log_buffer, fout)
-                self.log_buffer.close()
-            log_format = "%(asctime)s - %(levelname)s -> %(message)s"
-
-        # create new handler to append the rest of the log in the output dir
-        log_handler = logging.FileHandler(
-            os.path.join(out_path, "winbackup.log"), mode="a", encoding="utf-8"
-        )
-        formatter = logging.Formatter(log_format)
-        log_handler.setFormatter(formatter)
-        logger.addHandler(log_handler)
+        self.log_pipeline.redirect(os.path.join(out_path, "winbackup.log"))
         logging.debug(f"Log Handler Redirected to: {os.path.join(out_path, 'winbackup.log')}")
 
     def _hyperv_possible(self) -> bool:
@@ -231,13 +267,41 @@ class WinBackup:
 
     def _plex_server_running(self) -> bool:
         response = self._command_runner(
-            ["powershell.exe", "Get-Process", '"Plex Media Server"']
+            ["powershell.exe", "Get-Process", "Plex Media Server"]
         ).split("\r\n")[0]
         if "Cannot find a process with the name" in response:
             return False
         else:
             return True
 
+    def _hyperv_target_paths(self) -> list:
+        """
+        Paths of the HyperV VMs if HyperV can be backed up (admin and HyperV installed), else None.
+        """
+        if self.probes.get("is_admin") and self.probes.get("hyperv_possible"):
+            return self.probes.get("hyperv_vm_paths")
+        return None
+
+    def _add_hyperv_target(self) -> None:
+        ## ** HyperV specific setup
+        hyperv_config_item = {
+            "name": "HyperV VMs",
+            "type": "folder",
+            "path": None,
+            "dict_size": "128m",
+            "full_path": True,
+            "large_file_threshold": 4294967296,
+            "vm_image_mode": True,
+        }
+        try:
+            hyperv_paths = self.probes.get("hyperv_paths")
+        except PermissionError:
+            hyperv_paths = None
+        if hyperv_paths and "32_hypervvms" not in self.config_agent.target_config:
+            logging.debug("HyperV item added to config")
+            hyperv_config_item["path"] = hyperv_paths
+            self.config_agent.add_item("32_hypervvms", hyperv_config_item)
+
     def _get_hyperv_paths(self) -> list:
         """
         Needs to be run as admin
@@ -310,15 +374,17 @@ class WinBackup:
         return output_path, output_folder_name, path_created
 
     @staticmethod
-    def _save_file_hashes(out_path: str) -> None:
+    def _save_file_hashes(out_path: str, profile=None) -> None:
         hashes_list = []
         for file in os.listdir(out_path):
-            if not file.endswith(".log") and not file.endswith(".txt"):
+            if not WinBackup._is_log_file(file) and not file.endswith(".txt"):
                 h = hashlib.sha256()
                 b = bytearray(128 * 1024)
                 mv = memoryview(b)
                 with open(os.path.join(out_path, file), "rb", buffering=0) as f:
                     for n in iter(lambda: f.readinto(mv), 0):
+                        if profile is not None:
+                            profile.limit(n)
                         h.update(mv[:n])
                 hashes_list.append((file, h.hexdigest()))
                 logging.debug(f" Hash {file} {h.hexdigest()}")
@@ -326,6 +392,253 @@ class WinBackup:
             for item in hashes_list:
                 hash_file.write(f"{item[0]} {item[1]}\n")
 
+    @staticmethod
+    def _is_log_file(name: str) -> bool:
+        # winbackup.log and the winbackup.log.1, .2 ... the rotating handler rolls it over to
+        return re.fullmatch(r".+\.log(\.\d+)?", name) is not None
+
+    @staticmethod
+    def _fan_out_skip(name: str) -> bool:
+        # every destination writes its own sha256.txt, the log is still being written
+        return name == "sha256.txt" or WinBackup._is_log_file(name)
+
+    def _start_fan_out(self, out_path: str, quiet: bool = False):
+        """
+        Start copying the output folder to the extra_output_dirs of the global config,
+        returns the fanout.FanOut or None if there are no usable extra destinations.
+        """
+        from . import fanout
+
+        folders = []
+        for root in self.config_agent.global_config.get("extra_output_dirs", []):
+            if os.path.isdir(root):
+                folders.append(os.path.join(root, os.path.basename(out_path)))
+            else:
+                logging.warning(f"Extra output directory {root} does not exist - skipped")
+                if not quiet:
+                    print(
+                        Fore.RED
+                        + f" XX - Extra output directory {root} does not exist - skipped"
+                        + Style.RESET_ALL
+                    )
+        if len(folders) == 0:
+            return None
+        if not quiet:
+            print(f" >> Archives are also written to {', '.join(folders)}")
+        return fanout.FanOut(
+            folders,
+            self.config_agent.global_config.get("fanout_buffer_size", 268435456),
+            limit=self.run_profile.limit,
+        )
+
+    def _finish_fan_out(self, fan_out, out_path: str, quiet: bool = False) -> None:
+        if not quiet:
+            print()
+            print(Fore.GREEN + " >>> Finishing other destinations ... " + Style.RESET_ALL)
+        fan_out.add_new(out_path, skip=self._fan_out_skip)
+        for folder, copied, errors in fan_out.close():
+            if len(errors) != 0:
+                logging.error(f"{len(errors)} files not written to {folder}: {errors}")
+                print(
+                    Fore.RED
+                    + f" XX - {len(errors)} files not written to {folder}. See logs."
+                    + Style.RESET_ALL
+                )
+            elif not quiet:
+                print(f" >> {copied} files and sha256.txt written to {folder}")
+
+    def save_archive_index(
+        self, filename: str, archive_path: str, passwd: str, quiet: bool = False
+    ) -> None:
+        """
+        Save the offset index of a target's archives (see archiveindex.ArchiveIndex) next
+        to them for restore_file. The archives are kept if indexing fails.
+        """
+        from . import archiveindex
+        from . import restore
+
+        try:
+            archives = [
+                os.path.join(archive_path, file)
+                for file in restore.Restorer.find_archives(archive_path)
+            ]
+            index = archiveindex.ArchiveIndex(self.archiver).build(filename, archives, passwd)
+            self.archiver.save_manifest(index, f"{filename[:-3]}_Index", archive_path, passwd)
+        except Exception as e:
+            logging.error(f"could not index {filename} - exception {e}")
+            logging.debug(traceback.format_exc())
+            print(Fore.RED + f" XX - Could not index {filename}. See logs." + Style.RESET_ALL)
+            return
+        if not quiet:
+            blocks = sum(len(archive["blocks"]) for archive in index["archives"])
+            print(f" >> Index of {blocks} solid blocks saved for single file restore")
+
+    def retry_unread_files(
+        self,
+        key: str,
+        target: dict,
+        filename: str,
+        since: float,
+        archive_path: str,
+        passwd: str,
+        excluded: list,
+        quiet: bool = False,
+    ) -> list:
+        """
+        Retry the files of a target 7z could not read or that changed while the target
+        was archived into a supplemental archive (see retrypass.RetryPass), the rest of
+        the target is kept. Returns the affected files of the Retry manifest, which is
+        saved next to the archives if there are any.
+        """
+        from . import retrypass
+
+        excluded = set(excluded)
+        entries = [e for e in self.target_scans.get(key, []) if e.path not in excluded]
+        roots = target["path"] if type(target["path"]) == list else [target["path"]]
+
+        def member_name(path: str) -> str:
+            try:
+                root = self.archiver._find_root(path, roots)
+            except ValueError:
+                return path
+            return self.archiver.member_name(path, root, target.get("full_path", False))
+
+        try:
+            manifest = retrypass.RetryPass(
+                self.archiver, self.config_agent.global_config.get("locked_file_retries", 3)
+            ).run(
+                filename,
+                list(self.archiver.unread_files),
+                entries,
+                since,
+                archive_path,
+                member_name,
+                passwd,
+                quiet,
+            )
+            if len(manifest["files"]) != 0:
+                self.archiver.save_manifest(
+                    manifest, f"{filename[:-3]}_Retry", archive_path, passwd
+                )
+        except Exception as e:
+            logging.error(f"Retry of unread files of {filename} failed. Exception: {e}")
+            logging.debug(traceback.format_exc())
+            return []
+        failed = [entry for entry in manifest["files"] if entry["result"] == "failed"]
+        if len(manifest["files"]) != 0 and not quiet:
+            print(
+                Fore.YELLOW
+                + f" >> {len(manifest['files'])} files locked or changing while archived, "
+                + f"{len(manifest['files']) - len(failed)} retried to {manifest['archive']}"
+                + Style.RESET_ALL
+            )
+        if len(failed) != 0:
+            print(
+                Fore.RED
+                + f" XX - {len(failed)} files could not be read and are not in the backup. "
+                + "See logs."
+                + Style.RESET_ALL
+            )
+        return manifest["files"]
+
+    def save_composition_report(
+        self,
+        run_stats: dict,
+        out_path: str,
+        passwd: str,
+        quiet: bool = False,
+        retried: dict = None,
+    ) -> None:
+        """
+        Save the composition report of the run (see composition.CompositionReport) next
+        to the archives. The report lists file paths, so with a password it is only saved
+        as json in an encrypted 7z.
+        """
+        from . import composition
+
+        if not quiet:
+            print()
+            print(Fore.GREEN + " >>> Saving composition report ... " + Style.RESET_ALL)
+        stem = self._create_filename("Composition")[:-3]
+        try:
+            report = composition.CompositionReport().build(
+                run_stats, self.target_scans, retried
+            )
+            if len(passwd) == 0:
+                paths = composition.CompositionReport.save(report, out_path, stem)
+            else:
+                paths = [self.archiver.save_manifest(report, stem, out_path, passwd)]
+        except Exception as e:
+            logging.error(f"could not save composition report - exception {e}")
+            logging.debug(traceback.format_exc())
+            return
+        logging.info(f"Composition report saved to {paths}")
+        if not quiet:
+            print(f" >> Composition report saved to {', '.join(map(os.path.basename, paths))}")
+
+    def space_preflight(self, config: dict, out_path: str, quiet: bool = False) -> bool:
+        """
+        Estimate the output size of the enabled targets (see preflight.SpacePreflight) and
+        check it against the free space of the output root and the extra output dirs.
+        Prints the suggested fixes and returns False if a volume is too small.
+        """
+        import humanize
+        from . import preflight
+
+        if not quiet:
+            print(Fore.GREEN + " >>> Checking free space ... " + Style.RESET_ALL)
+        space = preflight.SpacePreflight(self._run_history(os.path.dirname(out_path)))
+        estimates = {}
+        for key, target in sorted(config.items()):
+            if not target["enabled"]:
+                continue
+            entries = None
+            if target["type"] == "folder":
+                try:
+                    entries = self._scan_target(key, target)
+                except Exception as e:
+                    logging.error(f"could not scan {target['name']} - exception {e}")
+            estimates[key] = space.estimate_target(key, target, entries)
+            logging.debug(f"Space estimate {key}: {estimates[key]}")
+        extra_roots = [
+            root
+            for root in self.config_agent.global_config.get("extra_output_dirs", [])
+            if os.path.isdir(root)
+        ]
+        volumes = space.check(
+            estimates,
+            os.path.dirname(out_path),
+            extra_roots,
+            self.config_agent.global_config.get("concurrent_targets", 1),
+        )
+        unknown = [e["name"] for e in estimates.values() if e["method"] == "unknown"]
+        for volume in volumes:
+            line = (
+                f"{', '.join(volume['roots'])} - needs ~"
+                + f"{humanize.naturalsize(volume['needed'], True)}"
+                + (
+                    f" (incl. {humanize.naturalsize(volume['scratch'], True)} tar scratch)"
+                    if volume["scratch"] > 0
+                    else ""
+                )
+                + f", {humanize.naturalsize(volume['free'], True)} free"
+            )
+            logging.info(f"Free space check: {line}")
+            if volume["ok"]:
+                if not quiet:
+                    print(f" >> {line}")
+                continue
+            print(Fore.RED + f" XX - Not enough space: {line}" + Style.RESET_ALL)
+            print(Fore.YELLOW + " To fit the backup:" + Style.RESET_ALL)
+            for suggestion in space.suggestions(estimates, volume, extra_roots):
+                print(f"  - {suggestion}")
+                logging.info(f"Suggested fix: {suggestion}")
+        if len(unknown) != 0 and not quiet:
+            print(f" >> No size estimate for {', '.join(unknown)}")
+        if not quiet:
+            print()
+        return all(volume["ok"] for volume in volumes)
+
     def _recursive_loop_check(self, target_path: str, config: dict) -> bool:
         """
         Returns True if the output directory is a child of a backup directory.
@@ -424,16 +737,36 @@ class WinBackup:
         print()
         return passwd
 
-    def cli_config_summary(self, config: dict, passwd: str, path_created: bool) -> None:
+    def cli_config_summary(
+        self, config: dict, passwd: str, path_created: bool, out_path: str = None
+    ) -> None:
+        history = None if out_path is None else self._run_history(os.path.dirname(out_path))
+        total_estimate = 0
+        no_estimate = 0
         print(
             Fore.BLACK + Back.WHITE + " ** CONFIG SUMMARY ** " + Style.RESET_ALL + Fore.GREEN
         )
         for key, target in sorted(config.items()):
+            eta = ""
+            if target["enabled"] and history is not None:
+                estimate = history.estimate(key)
+                if estimate is None:
+                    no_estimate += 1
+                else:
+                    total_estimate += estimate
+                    eta = f" (~{history.format_duration(estimate)})"
             print(
                 f" Backup {target['name']:<14} - {'Yes' if target['enabled']==True else 'No'}"
+                + eta
             )
-            logging.info(f"Config > {target['name']} - {target['enabled']}")
+            logging.info(f"Config > {target['name']} - {target['enabled']}{eta}")
         print(f" Encryption            - {'No' if len(passwd)==0 else 'Yes'}")
+        if total_estimate > 0:
+            unknown = f" + {no_estimate} not yet timed" if no_estimate else ""
+            print(
+                f" Estimated duration    - ~{history.format_duration(total_estimate)}{unknown}"
+            )
+            logging.info(f"Estimated duration {total_estimate:0.0f}s{unknown}")
         print(Style.RESET_ALL)
 
         if len(passwd) <= 12 and len(passwd) != 0:
@@ -455,7 +788,7 @@ class WinBackup:
                 "Output directory already exists - Contents may be destroyed if you proceed."
             )
         if "30_plexserver" in config:
-            if config["30_plexserver"]["enabled"] and self._plex_server_running():
+            if config["30_plexserver"]["enabled"] and self.probes.get("plex_running"):
                 print(
                     Fore.YELLOW
                     + " !! CAUTION - Plex Media Server is running - Recommend stopping Plex Server before backing up."
@@ -474,7 +807,7 @@ class WinBackup:
                 logging.info(
                     "HyperV has been enabled - Please check VMs are stopped before running."
                 )
-        if self._hyperv_possible() and not self.check_if_admin():
+        if self.probes.get("hyperv_possible") and not self.probes.get("is_admin"):
             print(
                 Fore.CYAN
                 + " -- INFO - HyperV detected on system. To backup HyperV run winbackup as admin."
@@ -489,79 +822,638 @@ class WinBackup:
         )
         print()
 
+    def _archive_staging(self, out_path: str):
+        """
+        New archives are staged in the output root and swapped in when a target succeeds,
+        see staging.ArchiveStaging. The old archive policy comes from the global config.
+        """
+        from . import staging
+
+        run = os.path.basename(out_path)
+        return staging.ArchiveStaging(
+            out_path,
+            os.path.join(self._state_dir(out_path, "partial"), run),
+            keep_path=os.path.join(self._state_dir(out_path, "previous"), run),
+            policy=self.config_agent.global_config.get("old_archive_policy", "delete"),
+        )
+
+    def _target_worker(self):
+        """
+        Copy of self for a target run at the same time as others, with its own archiver
+        (unread files, target deadline) and segment archiver. Everything else is shared.
+        """
+        worker = copy.copy(self)
+        worker.archiver = self.archiver.for_target()
+        worker.__dict__.pop("segment_archiver", None)
+        return worker
+
     @staticmethod
-    def remove_existing_archive(filename, path):
-        paths_to_remove = [
-            os.path.join(path, file) for file in os.listdir(path) if file.startswith(filename)
-        ]
-        logging.debug(
-            f"existing archives to be removed before backing up: {len(paths_to_remove)}"
+    def _run_history(root_path: str):
+        """
+        Per-target stats of past runs, kept in the output root.
+        """
+        from . import runhistory
+
+        return runhistory.RunHistory(
+            os.path.join(root_path, ".winbackup_state", "history", "runs.json")
         )
-        for path in paths_to_remove:
-            try:
-                send2trash(path)
-                logging.debug(f"deleted file: {path}")
-            except Exception as e:
-                logging.error(f"could not delete file: {path}, exception {e}")
-                logging.debug(traceback.format_exc())
 
-    def backup_run(
+    @staticmethod
+    def _archive_bytes(out_path: str, filename: str) -> int:
+        """
+        Size of a target's archives, volumes, segments, partitions and manifests.
+        """
+        stem = filename[:-3]
+        return sum(
+            os.path.getsize(os.path.join(out_path, file))
+            for file in os.listdir(out_path)
+            if file.startswith((f"{stem}.", f"{stem}_"))
+        )
+
+    def _scan_target(self, key: str, target: dict) -> list:
+        """
+        Scan a folder target once per run, later steps reuse the cached scan.
+        """
+        if key not in self.target_scans:
+            self.target_scans[key] = self.scanner.scan(target["path"])
+        return self.target_scans[key]
+
+    def dedup_targets(
         self,
         config: dict,
         out_path: str,
         passwd: str,
         quiet: bool = False,
-    ) -> None:
+        staging=None,
+    ) -> dict:
+        """
+        Find files shared between the enabled folder targets and store one copy of each
+        in a shared blob archive. A manifest maps the target paths to the blobs for restore.
+        The blob archive and manifest replace those of an earlier run only if both are saved.
+        Returns dict of target archive filename -> file paths to exclude from that target.
+        """
+        target_entries = {}
+        full_paths = {}
         for key, target in sorted(config.items()):
-            if not target["enabled"]:
+            if not target["enabled"] or target["type"] != "folder" or not target["path"]:
                 continue
+            filename = self._create_filename(target["name"].replace(" ", ""))
+            target_entries[filename] = self._scan_target(key, target)
+            full_paths[filename] = target["full_path"]
+        if len(target_entries) < 2:
+            logging.debug("Less than two folder targets enabled - skipping dedup")
+            return {}
 
+        if not quiet:
+            print(Fore.GREEN + " >>> Deduplicating targets ... " + Style.RESET_ALL)
+        duplicates = self.deduplicator.find_duplicates(target_entries)
+        if len(duplicates) == 0:
             if not quiet:
-                print(Fore.GREEN + f" >>> Backing up {target['name']} ... " + Style.RESET_ALL)
-            logging.info(f"Backup starting - {target['name']}")
-            filename = self._create_filename(target["name"].replace(" ", ""))
-            if target["type"] == "special" and key == "01_config":
-                try:
-                    config_path = os.path.join(out_path, "config")
-                    os.mkdir(config_path)
-                    self.config_saver.save_config_files(config_path, quiet=quiet)
-                    in_target_path = str(config_path)
-                except Exception as e:
-                    logging.debug(f"could not backup config - Exception {e}")
+                print(" >> No files shared between targets.")
+            return {}
+
+        blob_filename = self._create_filename("DedupBlobs")
+        manifest_name = self._create_filename("Dedup")[:-3]
+        manifest = self.deduplicator.build_manifest(
+            duplicates,
+            blob_filename,
+            lambda entry: self.archiver.member_name(entry.path, entry.root, True),
+            lambda target, entry: self.archiver.member_name(
+                entry.path, entry.root, full_paths[target]
+            ),
+        )
+        if staging is None:
+            staging = self._archive_staging(out_path)
+        try:
+            staged_path = staging.begin(blob_filename)
+            self.archiver.backup_file_list(
+                blob_filename,
+                self.deduplicator.blob_paths(duplicates),
+                staged_path,
+                passwd,
+                quiet=quiet,
+            )
+            self.archiver.save_manifest(manifest, manifest_name, staged_path, passwd)
+            staging.commit(blob_filename, [blob_filename, f"{manifest_name}."])
+        except Exception as e:
+            staging.discard(blob_filename)
+            # without the blob archive the targets must keep their own copies
+            logging.error(f"Dedup blob archive {blob_filename} failed. Exception: {e}")
+            logging.debug(traceback.format_exc())
+            print(
+                Fore.RED
+                + " XX - Dedup failed, targets stored in full. See logs."
+                + Style.RESET_ALL
+            )
+            return {}
+        if not quiet:
+            print(f" >> {len(duplicates)} shared files saved once to {blob_filename}")
+        return self.deduplicator.excluded_paths(duplicates)
+
+    def backup_large_files(
+        self,
+        filename: str,
+        target: dict,
+        entries: list,
+        out_path: str,
+        passwd: str,
+        quiet: bool = False,
+        progress=None,
+        archive_path: str = None,
+    ) -> list:
+        """
+        Compress the files over the target's large_file_threshold as segments on all cores.
+        With vm_image_mode VM disk images skip sparse holes and zero blocks.
+        The segment list and hashes are saved to a Segments manifest for restore.
+        progress is a progress.TargetProgress for the large files, updated per file.
+        archive_path is where the archives are written (the staging folder), default out_path.
+        Returns the block maps of the incremental images, to be saved with save_block_maps
+        once the target is committed.
+        """
+        import humanize
+
+        stem = filename[:-3]
+        archive_path = out_path if archive_path is None else archive_path
+        manifest = {"version": 1, "target": filename, "files": []}
+        block_maps = []
+        total_bytes = max(1, sum(entry.size for entry in entries))
+        done_bytes = 0
+        report = None if progress is None else progress.job(f"{stem}_Segments")
+        for index, entry in enumerate(entries):
+            if not quiet:
+                print(
+                    Fore.CYAN
+                    + f" >> Large file {os.path.basename(entry.path)}"
+                    + f" ({humanize.naturalsize(entry.size, True)}) - compressing in segments"
+                    + Style.RESET_ALL
+                )
+            member = self.archiver.member_name(entry.path, entry.root, target["full_path"])
+            archive_stub = f"{stem}_Segments_{index:03d}"
+            sparse = target.get("vm_image_mode", False) and self.vm_image_reader.is_vm_image(
+                entry.path
+            )
+            if sparse and target.get("incremental", False):
+                manifest_entry = self._backup_image_incremental(
+                    entry, member, archive_stub, target, out_path, passwd, quiet, archive_path
+                )
+                block_maps.append(manifest_entry["incremental"])
             else:
-                config_path = None
-                in_target_path = target["path"]
-            try:
-                self.remove_existing_archive(filename, out_path)
-                self.archiver.backup_folder(
-                    filename,
-                    in_target_path,
-                    out_path,
+                manifest_entry = self.segment_archiver.backup_large_file(
+                    entry.path,
+                    member,
+                    archive_stub,
+                    archive_path,
                     passwd,
                     dict_size=target["dict_size"],
                     mx_level=target["mx_level"],
-                    full_path=target["full_path"],
                     quiet=quiet,
-                    tar_before_7z=target.get("tar_before_7z", False),
-                    extra_tar_flags=target.get("extra_tar_flags", []),
-                    extra_7z_flags=target.get("extra_7z_flags", []),
+                    sparse=sparse,
+                )
+            manifest["files"].append(manifest_entry)
+            done_bytes += entry.size
+            if report is not None:
+                report(done_bytes / total_bytes)
+        self.archiver.save_manifest(manifest, f"{stem}_Segments", archive_path, passwd)
+        return block_maps
+
+    def save_block_maps(self, out_path: str, block_maps: list) -> None:
+        """
+        Keep the block maps of a committed target for the next incremental run.
+        """
+        for block_map in block_maps:
+            try:
+                self.block_map.save(
+                    self._state_dir(out_path, "blockmaps"), block_map["image_id"], block_map
+                )
+            except OSError as e:
+                # without its map the image is backed up in full next run
+                logging.error(f"could not save block map {block_map['image_id']} - {e}")
+
+    @staticmethod
+    def _state_dir(out_path: str, name: str) -> str:
+        """
+        Folder in the output root for state kept between runs (block maps, caches).
+        """
+        return os.path.join(os.path.dirname(out_path), ".winbackup_state", name)
+
+    def _backup_image_incremental(
+        self,
+        entry,
+        member: str,
+        archive_stub: str,
+        target: dict,
+        out_path: str,
+        passwd: str,
+        quiet: bool = False,
+        archive_path: str = None,
+    ) -> dict:
+        """
+        Hash the image in blocks and archive only the blocks changed since the previous run.
+        A full backup is taken if there is no previous map, its run has no segments of the
+        image or the incremental chain has reached max_chain.
+        Returns the Segments manifest entry including the new block map.
+        """
+        run = os.path.basename(out_path)
+        image_id = self.block_map.image_id(entry.path)
+        new_map = self.block_map.hash_image(entry.path)
+        old_map = self.block_map.load_previous(
+            self._state_dir(out_path, "blockmaps"), image_id
+        )
+        if old_map is not None and (
+            old_map["run"] == run
+            or old_map["chain_length"] >= self.block_map.max_chain
+            or not self._parent_saved(out_path, old_map, passwd)
+        ):
+            logging.info(f"Previous block map of {entry.path} not usable - full backup")
+            old_map = None
+        changed = self.block_map.changed_blocks(new_map, old_map)
+        logging.info(
+            f"{entry.path} - {len(changed)} of {len(new_map['hashes'])} blocks changed"
+            + (f" since {old_map['run']}" if old_map else " (full)")
+        )
+        if not quiet:
+            print(
+                f" >> {len(changed)} of {len(new_map['hashes'])} blocks to archive"
+                + (f" - incremental from {old_map['run']}" if old_map else " - full")
+            )
+        manifest_entry = self.segment_archiver.backup_extents(
+            entry.path,
+            member,
+            self.block_map.block_extents(new_map, changed),
+            archive_stub,
+            out_path if archive_path is None else archive_path,
+            passwd,
+            dict_size=target["dict_size"],
+            mx_level=target["mx_level"],
+            quiet=quiet,
+        )
+        new_map["image_id"] = image_id
+        new_map["run"] = run
+        new_map["parent"] = old_map["run"] if old_map else None
+        new_map["chain_length"] = old_map["chain_length"] + 1 if old_map else 0
+        manifest_entry["incremental"] = new_map
+        return manifest_entry
+
+    def _parent_saved(self, out_path: str, old_map: dict, passwd: str) -> bool:
+        """
+        Whether the run of old_map saved the image in its Segments manifest, a run folder
+        can exist while the target holding the image was discarded.
+        """
+        from . import restore
+
+        parent_path = os.path.join(os.path.dirname(out_path), old_map["run"])
+        try:
+            return (
+                restore.Restorer(self.archiver).find_image_entry(
+                    parent_path, old_map["image_id"], passwd
+                )
+                is not None
+            )
+        except Exception as e:
+            logging.warning(f"Could not read the segments of run {old_map['run']} - {e}")
+            return False
+
+    def _target_source(self, key: str, target: dict, out_path: str, passwd: str, quiet: bool):
+        """
+        Source of a target, returns (config sink, config folder, source path). The System
+        Config collectors write to an in memory sink or a temporary config folder.
+        """
+        from . import configsink
+
+        if not (target["type"] == "special" and key == "01_config"):
+            return None, None, target["path"]
+        # cached collector outputs are stored unencrypted so not used with a password
+        self.config_saver.set_cache_directory(
+            self._state_dir(out_path, "collectors") if len(passwd) == 0 else None
+        )
+        config_path = None
+        try:
+            if target.get("in_memory", False):
+                config_sink = configsink.MemorySink()
+                self.config_saver.save_config_files(config_sink, quiet=quiet)
+                return config_sink, None, None
+            config_path = os.path.join(out_path, "config")
+            os.mkdir(config_path)
+            self.config_saver.save_config_files(config_path, quiet=quiet)
+        except Exception as e:
+            logging.debug(f"could not backup config - Exception {e}")
+        return None, config_path, config_path
+
+    def _target_large_files(
+        self, key: str, target: dict, filename: str, excluded_paths: dict
+    ) -> list:
+        """
+        Files of a folder target saved by large file or VM image mode, they are added
+        to the paths excluded from the target archive.
+        """
+        threshold = target.get("large_file_threshold", 0)
+        vm_image_mode = target.get("vm_image_mode", False)
+        if target["type"] != "folder" or not (threshold > 0 or vm_image_mode):
+            return []
+        already_excluded = set(excluded_paths.get(filename, []))
+        large_files = [
+            entry
+            for entry in self._scan_target(key, target)
+            if entry.path not in already_excluded
+            and (
+                (threshold > 0 and entry.size >= threshold)
+                or (vm_image_mode and self.vm_image_reader.is_vm_image(entry.path))
+            )
+        ]
+        excluded_paths.setdefault(filename, []).extend(entry.path for entry in large_files)
+        return large_files
+
+    def _archive_target(
+        self,
+        key: str,
+        target: dict,
+        filename: str,
+        source,
+        staged_path: str,
+        passwd: str,
+        exclude_paths: list,
+        progress,
+        quiet: bool,
+    ) -> None:
+        """
+        Save a target to the staged archive, from the config sink or source path.
+        """
+        config_sink, _, in_target_path = source
+        if config_sink is not None:
+            self.archiver.backup_stream(
+                filename,
+                lambda stream: config_sink.write_tar(stream, "config"),
+                f"{filename[:-3]}.tar",
+                staged_path,
+                passwd,
+                dict_size=target["dict_size"],
+                mx_level=target["mx_level"],
+                quiet=quiet,
+            )
+            return
+        partitions = target.get("partitions", 1)
+        read_order = target.get("read_order", "directory")
+        self.archiver.backup_folder(
+            filename,
+            in_target_path,
+            staged_path,
+            passwd,
+            dict_size=target["dict_size"],
+            mx_level=target["mx_level"],
+            full_path=target["full_path"],
+            quiet=quiet,
+            tar_before_7z=target.get("tar_before_7z", False),
+            extra_tar_flags=target.get("extra_tar_flags", []),
+            extra_7z_flags=target.get("extra_7z_flags", []),
+            exclude_paths=exclude_paths,
+            partitions=partitions,
+            scan_entries=(
+                self._scan_target(key, target)
+                if (partitions > 1 or read_order != "directory") and target["type"] == "folder"
+                else None
+            ),
+            progress=progress,
+            solid_block_size=target.get("solid_block_size", ""),
+            read_order=read_order,
+        )
+        if target.get("solid_block_size", "") and not target.get("tar_before_7z", False):
+            self.save_archive_index(filename, staged_path, passwd, quiet)
+
+    def _backup_target(
+        self,
+        key: str,
+        target: dict,
+        out_path: str,
+        passwd: str,
+        staging,
+        excluded_paths: dict,
+        target_progress,
+        source_size: int,
+        run_stats: dict,
+        retried: dict,
+        quiet: bool,
+    ) -> str:
+        """
+        Back up one target into staging and commit it, retrying a stalled 7z up to
+        stall_retries times. Records the target in run_stats and its retry pass in
+        retried. Returns the archive filename.
+        """
+        from . import supervisor
+
+        target_start = time.perf_counter()
+        status = "ok"
+        if not quiet:
+            print(Fore.GREEN + f" >>> Backing up {target['name']} ... " + Style.RESET_ALL)
+        logging.info(f"Backup starting - {target['name']}")
+        filename = self._create_filename(target["name"].replace(" ", ""))
+        source = self._target_source(key, target, out_path, passwd, quiet)
+        config_sink, config_path, _ = source
+        large_files = self._target_large_files(key, target, filename, excluded_paths)
+        large_share = 0
+        if len(large_files) != 0 and source_size:
+            large_share = min(1, sum(entry.size for entry in large_files) / source_size)
+        attempts = self.config_agent.global_config.get("stall_retries", 1) + 1
+        block_maps = []
+        for attempt in range(1, attempts + 1):
+            self.archiver.unread_files.clear()
+            block_maps = []
+            archive_started = time.time()
+            try:
+                # children still running at the target timeout are stopped
+                with self.archiver.supervisor.deadline(target.get("timeout", 0)):
+                    staged_path = staging.begin(filename)
+                    self._archive_target(
+                        key,
+                        target,
+                        filename,
+                        source,
+                        staged_path,
+                        passwd,
+                        excluded_paths.get(filename, []),
+                        target_progress.part(1 - large_share),
+                        quiet,
+                    )
+                    if len(large_files) != 0:
+                        block_maps = self.backup_large_files(
+                            filename,
+                            target,
+                            large_files,
+                            out_path,
+                            passwd,
+                            quiet,
+                            progress=target_progress.part(large_share),
+                            archive_path=staged_path,
+                        )
+                    if config_sink is None and config_path is None:
+                        retried[key] = self.retry_unread_files(
+                            key,
+                            target,
+                            filename,
+                            archive_started,
+                            staged_path,
+                            passwd,
+                            excluded_paths.get(filename, []),
+                            quiet,
+                        )
+                # the previous archives are only replaced once the whole target is saved
+                staging.commit(
+                    filename,
+                    [
+                        filename,
+                        f"{filename[:-3]}_Part",
+                        f"{filename[:-3]}_Segments",
+                        f"{filename[:-3]}_Index",
+                        f"{filename[:-3]}_Retry",
+                    ],
                 )
+                # the maps only point at a run once the target's segments are saved in it
+                self.save_block_maps(out_path, block_maps)
+            except (KeyboardInterrupt, SystemExit, supervisor.Cancelled):
+                # the 7z children are stopped, remove what they left behind
+                staging.discard(filename)
+                staging.cleanup()
+                if config_path is not None:
+                    shutil.rmtree(config_path, ignore_errors=True)
+                raise
             except Exception as e:
+                staging.discard(filename)
+                if isinstance(e, supervisor.Stalled) and attempt < attempts:
+                    logging.warning(f"{filename} stalled - {e}. Retrying.")
+                    print(
+                        Fore.YELLOW
+                        + f" >> {target['name']} stalled - retry {attempt} of "
+                        + f"{attempts - 1}"
+                        + Style.RESET_ALL
+                    )
+                    continue
+                status = "failed"
                 logging.error(f"backup {filename} failed. Exception: {e}")
                 logging.debug(traceback.format_exc())
                 print(
                     Fore.RED + f" XX - Backup {filename} failed. See logs." + Style.RESET_ALL
                 )
-            if config_path is not None:
-                send2trash(config_path)
+            break
+        if config_path is not None:
+            shutil.rmtree(config_path, ignore_errors=True)
+        source_bytes = None
+        if config_sink is not None:
+            source_bytes = config_sink.total_size
+        elif key in self.target_scans:
+            source_bytes = sum(entry.size for entry in self.target_scans[key])
+        run_stats[key] = {
+            "name": target["name"],
+            "duration": time.perf_counter() - target_start,
+            "source_bytes": source_bytes,
+            "archive_bytes": self._archive_bytes(out_path, filename),
+            "status": status,
+        }
+        return filename
 
+    def backup_run(
+        self,
+        config: dict,
+        out_path: str,
+        passwd: str,
+        quiet: bool = False,
+    ) -> None:
+        import humanize
+        from . import progress
+        from . import scheduler
+
+        excluded_paths = {}
+        if self.run_profile.background:
             if not quiet:
-                print(f" >> {target['name']} saved to 7z - {filename}")
-            logging.debug(f"Backup finished for - {target['name']} - filename: {filename}")
+                print(
+                    Fore.CYAN
+                    + " >> Background run profile - low priority, throttled"
+                    + Style.RESET_ALL
+                )
+            self.run_profile.lower_current_process()
+        history = self._run_history(os.path.dirname(out_path))
+        staging = self._archive_staging(out_path)
+        fan_out = self._start_fan_out(out_path, quiet)
+        run_started = time.time()
+        run_stats = {}
+        retried = {}
+        enabled_keys = [key for key, target in sorted(config.items()) if target["enabled"]]
+        # folder targets are scanned once up front, the scans weight the run progress
+        # and are reused by deduplication, partitions and large file mode
+        if not quiet:
+            print(Fore.GREEN + " >>> Scanning targets ... " + Style.RESET_ALL)
+        sizes = {}
+        for key in enabled_keys:
+            if config[key]["type"] == "folder":
+                try:
+                    sizes[key] = sum(
+                        entry.size for entry in self._scan_target(key, config[key])
+                    )
+                except Exception as e:
+                    logging.error(f"could not scan {config[key]['name']} - exception {e}")
+        run_progress = progress.RunProgress(sizes, quiet=quiet)
+        if not quiet:
+            print(
+                f" >> {len(sizes)} folder targets, "
+                + f"{humanize.naturalsize(run_progress.total_bytes, True)} to back up"
+            )
+            print()
+        if self.config_agent.global_config.get("deduplicate", False):
+            excluded_paths = self.dedup_targets(config, out_path, passwd, quiet, staging)
+
+        device_scheduler = scheduler.DeviceScheduler.from_config(
+            self.config_agent.global_config
+        )
+        concurrent = device_scheduler.max_workers > 1
+        if concurrent and not quiet:
+            print(
+                Fore.CYAN
+                + f" >> Up to {device_scheduler.max_workers} targets at once, "
+                + f"{device_scheduler.per_device} per source disk"
+                + Style.RESET_ALL
+            )
+        finish_lock = threading.Lock()
+
+        def backup_target(key: str) -> None:
+            # targets run at once each get their own archiver, see _target_worker
+            worker = self._target_worker() if concurrent else self
+            target = config[key]
+            target_progress = run_progress.target(key)
+            filename = worker._backup_target(
+                key,
+                target,
+                out_path,
+                passwd,
+                staging,
+                excluded_paths,
+                target_progress,
+                sizes.get(key),
+                run_stats,
+                retried,
+                quiet,
+            )
+            with finish_lock:
+                run_status = target_progress.finish()
+                if not quiet:
+                    print(f" >> {target['name']} saved to 7z - {filename}")
+                    print(Fore.CYAN + f" >> {run_status}" + Style.RESET_ALL)
+                logging.debug(f"Backup finished for - {target['name']} - filename: {filename}")
+                # the finished archives are copied while the next target is compressed
+                if fan_out is not None:
+                    fan_out.add_new(out_path, skip=self._fan_out_skip)
+
+        device_scheduler.run(
+            [
+                (key, config[key]["path"] if config[key]["type"] == "folder" else None)
+                for key in history.order_longest_first(enabled_keys, sizes)
+            ],
+            backup_target,
+        )
+        staging.cleanup()
+        if self.config_agent.global_config.get("composition_report", True):
+            self.save_composition_report(run_stats, out_path, passwd, quiet, retried)
         if not quiet:
             print()
             print(Fore.GREEN + " >>> Saving File hashes ... " + Style.RESET_ALL)
-        self._save_file_hashes(out_path)
+        self._save_file_hashes(out_path, self.run_profile)
         if not quiet:
             print(" >> SHA-256 hashes of all archive files saved to sha256.txt")
             logging.info("SHA-256 hashes of all archive files saved to sha256.txt")
@@ -570,7 +1462,18 @@ class WinBackup:
             with open(os.path.join(out_path, "Archives_are_encrypted.txt"), "w") as file:
                 file.write("7z Archives in this folder are encrypted.")
 
+        if fan_out is not None:
+            self._finish_fan_out(fan_out, out_path, quiet)
+
+        history.add_run(run_stats, run_started)
+        try:
+            history.save()
+        except OSError as e:
+            logging.error(f"could not save run history - exception {e}")
+
     def cli_exit(self, out_path: str, start_time: datetime) -> None:
+        import humanize
+
         duration = datetime.now() - start_time
         backup_size = self.archiver._get_paths_size(out_path)
         print()
@@ -585,6 +1488,107 @@ class WinBackup:
         print(Fore.WHITE + f" Total backup size {humanize.naturalsize(backup_size, True)}")
         print(Fore.GREEN + " Backups done! " + Style.RESET_ALL)
 
+    def run_restore(
+        self,
+        backup_path: str,
+        restore_path: str,
+        quiet: bool = False,
+        file_pattern: str = None,
+    ) -> None:
+        """
+        Restore a backup folder created by winbackup to restore_path.
+        Deduplicated files are copied back into every target that referenced them.
+        With file_pattern only the matching files of indexed targets are restored.
+        """
+        signal.signal(signal.SIGINT, self._ctrl_c_handler)
+        if not backup_path or not os.path.isdir(backup_path):
+            print(
+                Fore.RED
+                + " XX - Backup folder must be a real path. Exiting."
+                + Style.RESET_ALL
+            )
+            logging.critical(f"given backup path {backup_path} is not a real path. Exiting")
+            sys.exit(1)
+        backup_path = os.path.abspath(backup_path)
+        restore_path = os.path.abspath(restore_path)
+        passwd = ""
+        if os.path.exists(os.path.join(backup_path, "Archives_are_encrypted.txt")):
+            print(Fore.GREEN + " > Archive password: " + Style.RESET_ALL, end="")
+            passwd = getpass.getpass(prompt="")
+        logging.info(f"Restore of {backup_path} to {restore_path} starting")
+        from . import restore
+
+        restorer = restore.Restorer(self.archiver, self.segment_archiver)
+        try:
+            if file_pattern is not None:
+                restored = restorer.restore_file(
+                    backup_path, file_pattern, restore_path, passwd, quiet=quiet
+                )
+            else:
+                restored = restorer.restore_backup(
+                    backup_path, restore_path, passwd, quiet=quiet
+                )
+        except Exception as e:
+            logging.critical(f"Restore failed. Exception: {e}")
+            logging.debug(traceback.format_exc())
+            print(Fore.RED + " XX - Restore failed. See logs." + Style.RESET_ALL)
+            sys.exit(1)
+        kind = "archives" if file_pattern is None else "files"
+        logging.info(f"Restore complete - {len(restored)} {kind} restored")
+        print(
+            Fore.GREEN
+            + f" Restored {len(restored)} {kind} to {restore_path}"
+            + Style.RESET_ALL
+        )
+
+    def show_stats(self, root_path: str) -> None:
+        """
+        Print the per-target history of the backups in an output root: number of runs,
+        last and median duration, throughput, compression ratio and duration trend.
+        """
+        if not root_path or not os.path.isdir(root_path):
+            print(
+                Fore.RED + " XX - Backup root must be a real path. Exiting." + Style.RESET_ALL
+            )
+            logging.critical(f"given backup root {root_path} is not a real path. Exiting")
+            sys.exit(1)
+        history = self._run_history(os.path.abspath(root_path))
+        if len(history.runs) == 0:
+            print(Fore.YELLOW + f" !! No run history in {root_path}" + Style.RESET_ALL)
+            return
+        print(Fore.BLACK + Back.WHITE + " ** RUN HISTORY ** " + Style.RESET_ALL)
+        print(
+            f" {len(history.runs)} runs, last on "
+            + f"{datetime.fromtimestamp(history.runs[-1]['time']):%Y-%m-%d %H:%M}"
+        )
+        print(
+            Fore.GREEN
+            + f" {'Target':<16}{'Runs':>5}{'Last':>10}{'Median':>10}"
+            + f"{'MiB/s':>8}{'Ratio':>7}{'Trend':>8}"
+            + Style.RESET_ALL
+        )
+        for key in history.keys():
+            stats = history.target_stats(key)
+            if stats is None:
+                continue
+            throughput = (
+                "-" if stats["throughput"] is None else f"{stats['throughput'] / 1048576:0.1f}"
+            )
+            ratio = "-" if stats["ratio"] is None else f"{stats['ratio']:0.0%}"
+            trend = "-" if stats["trend"] is None else f"{stats['trend']:+0.0%}"
+            print(
+                f" {stats['name'][:15]:<16}{stats['runs']:>5}"
+                + f"{history.format_duration(stats['last_duration']):>10}"
+                + f"{history.format_duration(stats['median_duration']):>10}"
+                + f"{throughput:>8}{ratio:>7}{trend:>8}"
+            )
+        totals = [sum(t["duration"] for t in run["targets"].values()) for run in history.runs]
+        print()
+        print(
+            " Last runs: "
+            + ", ".join(history.format_duration(total) for total in totals[-history.window :])
+        )
+
     def generate_blank_configfile(self, path=None):
         if not path:
             path = os.getcwd()
@@ -619,6 +1623,7 @@ class WinBackup:
         )
         print()
 
+        self._add_hyperv_target()
         self.config_agent.target_config = self.cli_config(
             self.config_agent.target_config,
             all_selected=all_selected,
@@ -662,6 +1667,7 @@ class WinBackup:
         path: str,
         quiet: bool = False,
         auto_confirm: bool = False,
+        skip_space_check: bool = False,
     ) -> None:
         if path:
             if os.path.exists(path) and path.lower().endswith((".yaml", ".yml")):
@@ -704,6 +1710,7 @@ class WinBackup:
             config_set=True,
             quiet=quiet,
             auto_confirm=auto_confirm,
+            skip_space_check=skip_space_check,
         )
 
     def cli(
@@ -713,9 +1720,15 @@ class WinBackup:
         all_selected: bool = False,
         quiet: bool = False,
         auto_confirm: bool = False,
+        skip_space_check: bool = False,
     ) -> None:
         signal.signal(signal.SIGINT, self._ctrl_c_handler)
         logging.debug("sigint connected to ctrl_c_handler")
+        # probes for the target list and summary run in the background during the prompts
+        prefetch = ["is_admin", "hyperv_possible", "hyperv_paths"]
+        if "30_plexserver" in self.config_agent.target_config:
+            prefetch.append("plex_running")
+        self.probes.prefetch(prefetch)
 
         if not root_path:
             self.config_agent.output_root_dir = self.cli_get_output_root_path()
@@ -748,6 +1761,7 @@ class WinBackup:
 
         if not config_set:
             logging.debug("Config not set - getting config interactively")
+            self._add_hyperv_target()
             self.config_agent.target_config = self.cli_config(
                 self.config_agent.target_config,
                 all_selected=all_selected,
@@ -782,12 +1796,33 @@ class WinBackup:
             )
             print(" Aborted. Exiting.")
             sys.exit(0)
+        for root in self.config_agent.global_config.get("extra_output_dirs", []):
+            extra_path = os.path.join(root, os.path.basename(self.output_path))
+            if self._recursive_loop_check(extra_path, self.config_agent.target_config):
+                print(
+                    Fore.RED
+                    + f" XX - Extra output directory {root} is a child of a path that will be"
+                    + " backed up. Choose a different path."
+                    + Style.RESET_ALL
+                )
+                logging.critical(f"Extra output directory {root} is inside a backup target.")
+                print(" Aborted. Exiting.")
+                sys.exit(0)
 
         self.cli_config_summary(
             self.config_agent.target_config,
             self.config_agent.encryption_password,
             self.path_created,
+            self.output_path,
         )
+        # the preflight scans are reused by backup_run
+        self.target_scans = {}
+        if not skip_space_check and not self.space_preflight(
+            self.config_agent.target_config, self.output_path, quiet
+        ):
+            logging.critical("Not enough free space for the backup. Exiting.")
+            print(" Aborted - not enough free space. Use --skip-space-check to run anyway.")
+            sys.exit(1)
         if not auto_confirm:
             if not self._yes_no_prompt("Do you want to continue?"):
                 logging.info("Backup cancelled after summary. Exiting.")
@@ -16,20 +16,134 @@
 
 import sys
 import os
+import copy
+import json
 import subprocess
 import logging
+import heapq
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from colorama import Fore, Style
 from send2trash import send2trash
-from typing import Union
+from typing import Callable, Union
 import humanize
 
+from . import filescanner
+from . import readorder
+from . import throttle
+from . import supervisor
+
+
+class _CountingWriter:
+    def __init__(self, stream, limit: Callable[[int], None] = None) -> None:
+        self.stream = stream
+        self.limit = limit
+        self.count = 0
+
+    def write(self, data) -> int:
+        self.count += len(data)
+        if self.limit is not None:
+            self.limit(len(data))
+        return self.stream.write(data)
+
+
+class _OutputSampler:
+    def __init__(self, filename: str, step: int) -> None:
+        """
+        Logs 7z output at debug level. Progress lines are only logged every step percent,
+        with the number of progress lines left out since the last one logged.
+        """
+        self.filename = filename
+        self.step = step
+        self.enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+        self.next_percent = 0
+        self.skipped = 0
+
+    def log(self, line: str, percent: int = None) -> None:
+        if not self.enabled:
+            return
+        line = line.strip()
+        if percent is None:
+            if len(line) != 0:
+                logging.debug("archive line output: " + line)
+            return
+        if percent < self.next_percent and percent != 100:
+            self.skipped += 1
+            return
+        self.next_percent = (percent // self.step + 1) * self.step
+        skipped = f" ({self.skipped} progress lines not logged)" if self.skipped else ""
+        logging.debug(f"{self.filename} progress: {line}{skipped}")
+        self.skipped = 0
+
+
+class _FileWarnings:
+    def __init__(self) -> None:
+        """
+        Collects the files listed in the warning and error summaries 7z prints at the
+        end of a run, "<path> : <message>" lines, e.g. files locked by another process.
+        The ERROR: lines printed while running are kept with the line after them, which
+        names the file for a file read error, see fatal_errors.
+        """
+        self.files = []
+        self.in_summary = False
+        self.errors = []
+        self._error = None
+
+    def feed(self, line: str) -> None:
+        line = line.strip()
+        if self._error is not None:
+            self.errors.append((self._error, line))
+            self._error = None
+        if line.startswith(("ERROR:", "System ERROR:")):
+            self._error = line
+        elif line.endswith("for files:") or line.endswith("for files and folders:"):
+            self.in_summary = True
+        elif line == "ERRORS:":
+            self.in_summary = True
+        elif line.startswith("----"):
+            self.in_summary = False
+        elif self.in_summary and " : " in line:
+            # paths can't hold " : ", messages can
+            path, _, message = line.partition(" : ")
+            self.files.append((path, message))
+
+    def fatal_errors(self) -> list:
+        """
+        ERROR: lines not about one of the files in the summaries, e.g. a write error.
+        """
+        paths = {path for path, _ in self.files}
+        errors = self.errors + ([(self._error, "")] if self._error is not None else [])
+        return [
+            error
+            for error, following in errors
+            if following not in paths and not any(path in error for path in paths)
+        ]
+
 
 class Zip7Archiver:
-    def __init__(self):
+    # 7z progress lines are logged once per this many percent
+    progress_log_step = 10
+
+    def __init__(
+        self,
+        profile: throttle.RunProfile = None,
+        process_supervisor: supervisor.ProcessSupervisor = None,
+    ):
         """
         Class exposing 7z compression methods for creating the 7z and tar archives.
+        Every child process is started with the priority of the run profile and stopped
+        by the process supervisor on cancel, timeout or when 7z stalls.
+        Files 7z could not read are added to unread_files as (path, message) and kept in
+        the archive without them, the caller clears the list.
         """
+        self.profile = throttle.RunProfile() if profile is None else profile
+        self.supervisor = (
+            supervisor.ProcessSupervisor()
+            if process_supervisor is None
+            else process_supervisor
+        )
+        self.unread_files = []
         real_path = os.path.dirname(os.path.realpath(__file__))
         self.zip7_path = os.path.join(real_path, "bin", "7z", "7z.exe")
         self.onenote_ex_path = os.path.join(
@@ -39,6 +153,17 @@ class Zip7Archiver:
         )
         self.onenote_ex_files_path = os.path.join(real_path, "OneNoteMdExporter")
 
+    def for_target(self) -> "Zip7Archiver":
+        """
+        Archiver for one of several targets compressed at once, with its own unread_files
+        and a child supervisor for the target deadline. Cancelling this archiver's
+        supervisor stops the children of the target archivers too.
+        """
+        archiver = copy.copy(self)
+        archiver.unread_files = []
+        archiver.supervisor = self.supervisor.child()
+        return archiver
+
     @staticmethod
     def _get_size(path: str) -> int:
         """
@@ -70,7 +195,118 @@ class Zip7Archiver:
         return total_bytes
 
     @staticmethod
-    def _archiver(filename: str, cmd_args: list, quiet: bool = False) -> tuple:
+    def member_name(file_path: str, root: str, full_path: bool = False) -> str:
+        """
+        Returns the path 7z stores for file_path when root is added to an archive.
+        Relative archives store paths from the root folder name,
+        full path archives (-spf2) store the absolute path without the drive.
+        """
+        if full_path:
+            return os.path.splitdrive(os.path.abspath(file_path))[1].lstrip("\\/")
+        root = os.path.normpath(os.path.abspath(root))
+        return os.path.join(os.path.basename(root), os.path.relpath(file_path, root))
+
+    @staticmethod
+    def _find_root(file_path: str, input_paths: list) -> str:
+        file_path = os.path.abspath(file_path)
+        for root in input_paths:
+            root = os.path.abspath(root)
+            try:
+                if os.path.commonpath([root, file_path]) == root:
+                    return root
+            except ValueError:
+                # paths on different drives
+                continue
+        raise ValueError(f"{file_path} is not inside any of {input_paths}")
+
+    @staticmethod
+    def _write_listfile(lines: list) -> str:
+        """
+        Write a 7z list file (UTF-8, one path per line) to the temp dir.
+        The list file is written outside the backup folder, caller removes it.
+        """
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", suffix=".txt", prefix="winbackup_", delete=False
+        ) as fout:
+            for line in lines:
+                fout.write(line + "\n")
+        logging.debug(f"7z list file with {len(lines)} lines written to {fout.name}")
+        return fout.name
+
+    @staticmethod
+    def plan_partitions(entries: list, num_partitions: int) -> list:
+        """
+        Bin-pack the subtrees of the scanned entries into num_partitions roughly equal parts.
+        Folders bigger than an even share are split into their children until they fit,
+        then the pieces are assigned largest first to the smallest partition.
+        Returns a list of dicts with the paths (folders or files) and size of each partition.
+        """
+        if num_partitions < 1:
+            raise ValueError("num_partitions must be at least 1")
+        limit = sum(entry.size for entry in entries) / num_partitions
+        pending = {}
+        for entry in entries:
+            pending.setdefault(entry.root, []).append(entry)
+        pending = list(pending.items())
+        units = []
+        while pending:
+            path, unit_entries = pending.pop()
+            size = sum(entry.size for entry in unit_entries)
+            if size <= limit or (len(unit_entries) == 1 and unit_entries[0].path == path):
+                units.append((size, path))
+                continue
+            children = {}
+            for entry in unit_entries:
+                child = os.path.relpath(entry.path, path).split(os.sep)[0]
+                children.setdefault(os.path.join(path, child), []).append(entry)
+            pending.extend(children.items())
+
+        partitions = [{"paths": [], "size": 0} for _ in range(num_partitions)]
+        heap = [(0, index) for index in range(num_partitions)]
+        for size, path in sorted(units, key=lambda unit: (-unit[0], unit[1])):
+            part_size, index = heapq.heappop(heap)
+            partitions[index]["paths"].append(path)
+            partitions[index]["size"] += size
+            heapq.heappush(heap, (part_size + size, index))
+        return [partition for partition in partitions if len(partition["paths"]) != 0]
+
+    @staticmethod
+    def _percent(line: str) -> int:
+        """
+        Percent done from a 7z -bsp1 progress line e.g. ' 45% 12 + file', else None.
+        """
+        head = line.split("%")[0].strip(" \b\r\n\t")
+        if not head.isdigit():
+            return None
+        return int(head)
+
+    @staticmethod
+    def _job_progress(progress, name: str, share: float = 1.0) -> Callable:
+        return None if progress is None else progress.job(name, share)
+
+    def _popen(self, cmd_args: list, **kwargs) -> subprocess.Popen:
+        """
+        subprocess.Popen with the process and I/O priority of the run profile, registered
+        with the supervisor. Callers call supervisor.check once the process has ended.
+        """
+        process = subprocess.Popen(cmd_args, **kwargs, **self.profile.popen_kwargs())
+        self.profile.after_start(process)
+        self.supervisor.register(process)
+        return process
+
+    def _archiver(
+        self,
+        filename: str,
+        cmd_args: list,
+        quiet: bool = False,
+        cwd: str = None,
+        progress: Callable[[float], str] = None,
+    ) -> tuple:
+        """
+        Run 7z with a tqdm progress bar unless quiet.
+        progress is called with the fraction done on each 7z progress line and returns
+        the run status shown after the bar.
+        """
         b_size_line = ""
         a_size_line = ""
         # run the backup task with a tqdm progress bar.
@@ -78,9 +314,11 @@ class Zip7Archiver:
             desc_stub = "Tarball"
         else:
             desc_stub = "Compress"
+        output_log = _OutputSampler(filename, self.progress_log_step)
+        file_warnings = _FileWarnings()
         try:
             logging.debug(f"cli args - {' '.join(cmd_args)}")
-            with subprocess.Popen(
+            with self._popen(
                 cmd_args,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
@@ -88,7 +326,10 @@ class Zip7Archiver:
                 bufsize=1,
                 universal_newlines=True,
                 errors="ignore",
+                cwd=cwd,
             ) as p:
+                # 7z prints a progress line at least as often as the percentage changes
+                self.supervisor.watch(p)
                 if not quiet:
                     with tqdm(
                         total=100,
@@ -101,8 +342,10 @@ class Zip7Archiver:
                         for (
                             line
                         ) in p.stdout:  # cp1252 decoded string, ignore invalid chars like 0x81
-                            if len(line.strip()) != 0:
-                                logging.debug("archive line output: " + line.strip())
+                            percent = self._percent(line) if "%" in line else None
+                            output_log.log(line, percent)
+                            file_warnings.feed(line)
+                            self.supervisor.progress(p)
                             if "Add new data to archive: " in line:
                                 b_size_line = line.split("Add new data to archive: ")[1].strip()  # fmt: skip
                                 tqdm.write(
@@ -119,16 +362,42 @@ class Zip7Archiver:
                                     + Style.RESET_ALL
                                 )
                                 logging.debug(f"{filename} {desc_stub}ed Size: {a_size_line}")
-                            if "%" in line:
-                                pbar.update(int(line.split("%")[0].strip()) - pbar.n)
+                            if percent is not None:
+                                if progress is not None:
+                                    pbar.set_postfix_str(
+                                        progress(percent / 100), refresh=False
+                                    )
+                                pbar.update(percent - pbar.n)
                 else:
                     for line in p.stdout:
                         if "Add new data to archive: " in line:
                             b_size_line = line.split("Add new data to archive: ")[1].strip()
                         if "Archive size: " in line:
                             a_size_line = line.split("Archive size: ")[1].strip()
-                        if len(line.strip()) != 0:
-                            logging.debug("archive line output: " + line.strip())
+                        percent = self._percent(line) if "%" in line else None
+                        if progress is not None and percent is not None:
+                            progress(percent / 100)
+                        output_log.log(line, percent)
+                        file_warnings.feed(line)
+                        self.supervisor.progress(p)
+            self.supervisor.check(p)
+            fatal_errors = file_warnings.fatal_errors()
+            if cwd is not None:
+                # 7z reports the paths of a list file as given, relative to cwd
+                file_warnings.files = [
+                    (os.path.join(cwd, path), message) for path, message in file_warnings.files
+                ]
+            for path, message in file_warnings.files:
+                logging.warning(f"{filename} - could not read {path} - {message}")
+            self.unread_files.extend(file_warnings.files)
+            # 7z exit codes - 0 ok, 1 warning (e.g. locked files skipped), 2+ fatal error
+            # an archive finished with only file read errors keeps what was read
+            if p.returncode >= 2 and not (
+                file_warnings.files and a_size_line and len(fatal_errors) == 0
+            ):
+                for error in fatal_errors:
+                    logging.error(f"{filename} - 7z {error}")
+                raise RuntimeError(f"7z returned fatal error code {p.returncode}")
         except Exception as e:
             logging.debug(f"Exception: {e}", exc_info=True, stack_info=True)
             if not quiet:
@@ -139,10 +408,144 @@ class Zip7Archiver:
                 )
             logging.error(f"Failed to archive {filename}. Set log level to debug for info.")
             raise e
-        before_bytes = int(b_size_line.split("bytes")[0].split()[-1].strip())
-        after_bytes = int(a_size_line.split("bytes")[0].split()[-1].strip())
+        before_bytes = 0
+        after_bytes = 0
+        if b_size_line:
+            before_bytes = int(b_size_line.split("bytes")[0].split()[-1].strip())
+        if a_size_line:
+            after_bytes = int(a_size_line.split("bytes")[0].split()[-1].strip())
         return before_bytes, after_bytes
 
+    @staticmethod
+    def _input_modes(
+        zip_filename: str,
+        input_paths: list,
+        partitions: int,
+        read_order: str,
+        full_path: bool,
+        tar_before_7z: bool,
+    ) -> tuple:
+        """
+        Whether the input is split into partitions and whether it is passed in read order,
+        both need the input paths in one folder unless full paths are stored.
+        Returns (partitioned, ordered).
+        """
+        parents = {os.path.dirname(os.path.normpath(os.path.abspath(p))) for p in input_paths}
+        partitioned = False
+        if partitions > 1:
+            if tar_before_7z:
+                logging.warning(f"{zip_filename} - partitions not used with tar_before_7z")
+            elif not full_path and len(parents) != 1:
+                logging.warning(
+                    f"{zip_filename} - partitions need full_path if the input paths are "
+                    + "not in the same folder"
+                )
+            else:
+                partitioned = True
+        ordered = False
+        if read_order != "directory" and not partitioned:
+            if not full_path and len(parents) != 1:
+                logging.warning(
+                    f"{zip_filename} - read_order needs full_path if the input paths are "
+                    + "not in the same folder"
+                )
+            else:
+                ordered = True
+        return partitioned, ordered
+
+    def _zip_options(
+        self,
+        zip_filename: str,
+        input_paths: Union[str, list],
+        password: str,
+        full_path: bool,
+        split: bool,
+        split_size: int,
+        tar_before_7z: bool,
+        extra_7z_flags: list,
+        solid_block_size: str,
+        partitioned: bool,
+    ) -> list:
+        """
+        7z switches for volumes, encryption, full paths, solid blocks and thread count.
+        """
+        options = []
+        if split:
+            # only split if input files are bigger than the split size.
+            if self._get_paths_size(input_paths) >= split_size:
+                logging.debug(f"Path size > split limit - Splitting {zip_filename}")
+                options.append("-v4092m")
+            else:
+                logging.debug(f"Path size < split limit - Not Splitting {zip_filename}")
+        if len(password) != 0:
+            options.append("-mhe=on")
+            options.append(f"-p{password}")
+        if full_path:
+            options.append("-spf2")
+        if solid_block_size:
+            if tar_before_7z:
+                logging.warning(
+                    f"{zip_filename} - solid_block_size has no effect with tar_before_7z"
+                )
+            options.append(f"-ms={solid_block_size}")
+        # partitions set their own thread count
+        if (
+            self.profile.background
+            and not partitioned
+            and not any(flag.startswith("-mmt") for flag in extra_7z_flags)
+        ):
+            options.append(f"-mmt={self.profile.threads(os.cpu_count() or 2)}")
+        return options
+
+    def _read_order_listfile(
+        self,
+        input_paths: list,
+        scan_entries: list,
+        exclude_paths: list,
+        read_order: str,
+        full_path: bool,
+    ) -> tuple:
+        """
+        Write the files of input_paths, less exclude_paths, to a list file in read order.
+        Without full_path the names are relative to the parent folder of the input paths,
+        7z has to run there.
+        Returns (list file path, folder 7z runs in or None), (None, None) if every file is
+        excluded.
+        """
+        if scan_entries is None:
+            scan_entries = filescanner.FileScanner().scan(input_paths)
+        excluded = {os.path.abspath(path) for path in exclude_paths}
+        entries = readorder.ReadOrder(read_order).sort(
+            [entry for entry in scan_entries if entry.path not in excluded]
+        )
+        if len(entries) == 0:
+            return None, None
+        if full_path:
+            return (
+                self._write_listfile([os.path.abspath(entry.path) for entry in entries]),
+                None,
+            )
+        cwd = os.path.dirname(os.path.normpath(os.path.abspath(input_paths[0])))
+        return (
+            self._write_listfile([os.path.relpath(entry.path, cwd) for entry in entries]),
+            cwd,
+        )
+
+    def _exclude_listfile(
+        self, exclude_paths: list, input_paths: list, full_path: bool
+    ) -> str:
+        """
+        Write exclude_paths as the archive member paths 7z matches them by to a list file.
+        """
+        exclude_patterns = []
+        for path in exclude_paths:
+            if full_path:
+                exclude_patterns.append(os.path.abspath(path))
+            else:
+                root = self._find_root(path, input_paths)
+                exclude_patterns.append(self.member_name(path, root))
+        return self._write_listfile(exclude_patterns)
+
     def backup_folder(
         self,
         zip_filename: str,
@@ -157,6 +560,12 @@ class Zip7Archiver:
         tar_before_7z: bool = False,
         extra_tar_flags: list = [],
         extra_7z_flags: list = [],
+        exclude_paths: list = [],
+        partitions: int = 1,
+        scan_entries: list = None,
+        progress=None,
+        solid_block_size: str = "",
+        read_order: str = "directory",
     ) -> tuple:
         """
         Main function for creating 7z archives.
@@ -174,6 +583,13 @@ class Zip7Archiver:
         - tar_before_7z  : tarball input files before compressing
         - extra_tar_flags: extra flags to pass with the tar function (if used)
         - extra_7z_flags : extra flags to pass with the 7z function
+        - exclude_paths  : files under input_paths to leave out of the archive (e.g. deduplicated files)
+        - partitions     : compress the input as this many archives in parallel, see backup_partitions
+        - scan_entries   : FileScanner entries of input_paths, scanned if needed and not given
+        - progress       : progress.TargetProgress the 7z jobs report to, or None
+        - solid_block_size: bound on the solid blocks (7z -ms, e.g. 64m) so a single file can be extracted quickly
+        - read_order     : order 7z reads the files in, see readorder.ReadOrder. Other than directory
+                           the files are passed as a list file and empty folders are not stored
 
         Returns:
         - before_size, after_size : tuple of before/after as int in bytes
@@ -196,6 +612,16 @@ class Zip7Archiver:
         else:
             raise TypeError("output path must be a string")
 
+        # convert input paths to list
+        if type(input_paths) is str:
+            input_cmd_args = [input_paths]
+        else:
+            input_cmd_args = input_paths
+
+        partitioned, ordered = self._input_modes(
+            zip_filename, input_cmd_args, partitions, read_order, full_path, tar_before_7z
+        )
+
         # 7z normally disables progress reporting when output redirected, bsp1 fixes this.
         base_args = [
             self.zip7_path,
@@ -222,75 +648,479 @@ class Zip7Archiver:
         zip_args = base_args + base_7z_args + extra_7z_flags
         tar_args = base_args + base_tar_args + extra_tar_flags
         tar_filename = zip_filename[:-3] + ".tar"
-        out_zip_path = os.path.join(out_folder, zip_filename)
-        out_tar_path = os.path.join(out_folder, tar_filename)
+        # absolute as 7z runs in the parent of the input paths when reading a list file
+        out_zip_path = os.path.join(os.path.abspath(out_folder), zip_filename)
+        out_tar_path = os.path.join(os.path.abspath(out_folder), tar_filename)
         logging.debug(f"Base zip_args -> {' '.join(zip_args)}")
         logging.debug(f"Base tar_args -> {' '.join(tar_args)}")
         logging.debug(f"7z path       -> {out_zip_path}")
         logging.debug(f"tar path      -> {out_tar_path}")
 
-        # get input filesize
-        path_size = self._get_paths_size(input_paths)
-
         # parse split limit
         split_size_bytes = 4290772992
         logging.debug(f"Archive Split size -> {split_size_bytes:,} bytes")
+        zip_args += self._zip_options(
+            zip_filename,
+            input_paths,
+            password,
+            full_path,
+            split and not partitioned,
+            split_size_bytes,
+            tar_before_7z,
+            extra_7z_flags,
+            solid_block_size,
+            partitioned,
+        )
 
-        # add additional flags
-        if split:
-            # only split if input files are bigger than the split size.
-            if path_size >= split_size_bytes:
-                logging.debug(f"Path size > split limit - Splitting {zip_filename}")
-                zip_args.append("-v4092m")
-            else:
-                logging.debug(f"Path size < split limit - Not Splitting {zip_filename}")
-        if len(password) != 0:
-            zip_args.append("-mhe=on")
-            zip_args.append(f"-p{password}")
-        if full_path:
-            zip_args.append("-spf2")
-
-        # add output archive path
-        tar_args.append(out_tar_path)
-        zip_args.append(out_zip_path)
+        # in read order the input list file holds every file, excluded files are left out
+        input_listfile = None
+        cwd = None
+        if ordered:
+            input_listfile, cwd = self._read_order_listfile(
+                input_cmd_args,
+                scan_entries,
+                exclude_paths,
+                read_order,
+                full_path,
+            )
+            if input_listfile is None:
+                # e.g. every file deduplicated or saved as large file segments
+                logging.info(f"No files left for {zip_filename} - main archive skipped")
+                return 0, 0
+            input_cmd_args = ["-scsUTF-8", f"@{input_listfile}"]
 
-        # convert input paths to list
-        if type(input_paths) is str:
-            input_cmd_args = [input_paths]
-        elif type(input_paths) is list:
-            input_cmd_args = input_paths
-        else:
-            raise ValueError
+        # excluded files are passed as a list file of archive member paths
+        exclude_listfile = None
+        if len(exclude_paths) != 0 and not ordered:
+            exclude_listfile = self._exclude_listfile(exclude_paths, input_cmd_args, full_path)
+            exclude_args = ["-scsUTF-8", f"-x@{exclude_listfile}"]
+            if tar_before_7z:
+                tar_args += exclude_args
+            else:
+                zip_args += exclude_args
+            logging.debug(f"{len(exclude_paths)} files excluded from {zip_filename}")
 
         try:
-            if tar_before_7z:
-                full_tar_args = tar_args + input_cmd_args
-                full_7z_args = zip_args + [out_tar_path]
-                before_tar_bytes, after_tar_bytes = self._archiver(tar_filename, full_tar_args, quiet)  # fmt: skip
-                before_7z_bytes, after_7z_bytes = self._archiver(zip_filename, full_7z_args, quiet)  # fmt: skip
+            if partitioned:
+                if scan_entries is None:
+                    scan_entries = filescanner.FileScanner().scan(input_cmd_args)
+                excluded = {os.path.abspath(path) for path in exclude_paths}
+                before_bytes, after_bytes = self.backup_partitions(
+                    zip_filename,
+                    [entry for entry in scan_entries if entry.path not in excluded],
+                    zip_args,
+                    out_folder,
+                    partitions,
+                    password=password,
+                    full_path=full_path,
+                    split_size=split_size_bytes if split else 0,
+                    quiet=quiet,
+                    progress=progress,
+                )
+            elif tar_before_7z:
+                full_tar_args = tar_args + [out_tar_path] + input_cmd_args
+                full_7z_args = zip_args + [out_zip_path, out_tar_path]
+                # tar and 7z each read the whole target, count each as half of it
+                before_tar_bytes, after_tar_bytes = self._archiver(
+                    tar_filename,
+                    full_tar_args,
+                    quiet,
+                    cwd=cwd,
+                    progress=self._job_progress(progress, tar_filename, 0.5),
+                )
+                before_7z_bytes, after_7z_bytes = self._archiver(
+                    zip_filename,
+                    full_7z_args,
+                    quiet,
+                    progress=self._job_progress(progress, zip_filename, 0.5),
+                )
                 logging.debug(f"tar size: {before_tar_bytes} --> {after_tar_bytes} bytes")
                 logging.debug(f"7z size : {before_7z_bytes} --> {after_7z_bytes} bytes")
                 try:
+                    # the tar is scratch space, deleted permanently
                     logging.debug(f"Deleting tar from -> {out_tar_path}")
-                    send2trash(out_tar_path)
+                    os.remove(out_tar_path)
                 except Exception as e:
                     logging.error(f"Could not delete {out_tar_path} - Exception {e}")
                 before_bytes = before_tar_bytes
                 after_bytes = after_7z_bytes
             else:
-                full_7z_args = zip_args + input_cmd_args
-                before_bytes, after_bytes = self._archiver(zip_filename, full_7z_args, quiet)
+                full_7z_args = zip_args + [out_zip_path] + input_cmd_args
+                before_bytes, after_bytes = self._archiver(
+                    zip_filename,
+                    full_7z_args,
+                    quiet,
+                    cwd=cwd,
+                    progress=self._job_progress(progress, zip_filename),
+                )
                 logging.debug(f"7z size : {before_bytes} -> {after_bytes} bytes")
         except Exception as e:
             raise e
+        finally:
+            if exclude_listfile is not None:
+                os.remove(exclude_listfile)
+            if input_listfile is not None:
+                os.remove(input_listfile)
+
+        logging.info(
+            f"Backup {zip_filename} complete. Size: {humanize.naturalsize(before_bytes, True)}"
+            + f" >> {humanize.naturalsize(after_bytes, True)}"
+            + f" (Compressed to {(after_bytes/max(before_bytes, 1))*100:0.1f}% of input size)"
+        )
+        return before_bytes, after_bytes
+
+    def backup_partitions(
+        self,
+        zip_filename: str,
+        entries: list,
+        zip_args: list,
+        out_folder: str,
+        num_partitions: int,
+        password: str = "",
+        full_path: bool = False,
+        split_size: int = 0,
+        quiet: bool = False,
+        progress=None,
+    ) -> tuple:
+        """
+        Compress the scanned entries as num_partitions independent archives in parallel.
+        Archives are named <name>_PartNN.7z and keep the same member paths as a single archive,
+        the <name>_Partitions manifest maps the stored paths to the partition archives
+        so restore can put the target back together.
+        Folders only holding empty folders inside a split folder are not stored.
+        Parameters:
+        - zip_args   : 7z command and switches (from backup_folder) without archive or input paths
+        - split_size : partitions at least this big are split into volumes, 0 to never split
+        - progress   : progress.TargetProgress, each partition reports its share of the bytes
+        Returns:
+        - before_size, after_size : tuple of before/after as int in bytes, summed over partitions
+          0, 0 without partitions or manifest if no entries are left (e.g. all deduplicated)
+        """
+        plan = self.plan_partitions(entries, num_partitions)
+        if len(plan) == 0:
+            logging.info(f"No files left for {zip_filename} - partitions skipped")
+            return 0, 0
+        roots = {os.path.normpath(entry.root) for entry in entries}
+        cwd = None if full_path else os.path.dirname(roots.pop())
+        # each 7z process gets a share of the cores (fewer if the profile backs off)
+        threads = max(1, self.profile.threads(os.cpu_count() or 2) // len(plan))
+        stem = zip_filename[:-3]
+
+        index = {
+            "version": 1,
+            "target": zip_filename,
+            "full_path": full_path,
+            "partitions": [],
+        }
+        jobs = []
+        listfiles = []
+        try:
+            for number, partition in enumerate(plan, start=1):
+                part_filename = f"{stem}_Part{number:02d}.7z"
+                if full_path:
+                    input_names = partition["paths"]
+                    members = [self.member_name(path, None, True) for path in input_names]
+                else:
+                    input_names = [os.path.relpath(path, cwd) for path in partition["paths"]]
+                    members = input_names
+                listfiles.append(self._write_listfile(input_names))
+                part_args = zip_args + [f"-mmt={threads}", "-scsUTF-8"]
+                if split_size > 0 and partition["size"] >= split_size:
+                    part_args.append("-v4092m")
+                part_args += [os.path.join(out_folder, part_filename), f"@{listfiles[-1]}"]
+                share = partition["size"] / max(1, sum(p["size"] for p in plan))
+                jobs.append(
+                    (
+                        part_filename,
+                        part_args,
+                        self._job_progress(progress, part_filename, share),
+                    )
+                )
+                index["partitions"].append(
+                    {
+                        "archive": part_filename,
+                        "size": partition["size"],
+                        "paths": sorted(members),
+                    }
+                )
+                logging.debug(
+                    f"{part_filename} - {len(members)} paths, {partition['size']} bytes"
+                )
+            if not quiet:
+                print(
+                    Fore.CYAN
+                    + f" >> Compressing {len(jobs)} partitions in parallel "
+                    + f"({humanize.naturalsize(sum(p['size'] for p in plan), True)})"
+                    + Style.RESET_ALL
+                )
+            with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                futures = [
+                    executor.submit(self._archiver, part_filename, part_args, True, cwd, job)
+                    for part_filename, part_args, job in jobs
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            for listfile in listfiles:
+                os.remove(listfile)
+
+        self.save_manifest(index, f"{stem}_Partitions", out_folder, password)
+        return sum(before for before, _ in results), sum(after for _, after in results)
+
+    def backup_stream(
+        self,
+        zip_filename: str,
+        feed,
+        member: str,
+        out_folder: str,
+        password: str = "",
+        dict_size: str = "192m",
+        mx_level: int = 9,
+        quiet: bool = False,
+    ) -> tuple:
+        """
+        Create a 7z archive with a single member read from 7z's stdin.
+        feed(stream) writes the member data, e.g. a tarball generated in memory,
+        so nothing is staged on disk before compression.
+        Returns:
+        - before_size, after_size : tuple of before/after as int in bytes
+        """
+        if len(password) != 0:
+            password_args = ["-mhe=on", f"-p{password}"]
+        else:
+            password_args = []
+        if mx_level == 0:
+            method_args = ["-mx=0"]
+        else:
+            method_args = ["-m0=lzma2", f"-md={dict_size}", f"-mx={str(mx_level)}"]
+        out_zip_path = os.path.join(out_folder, zip_filename)
+        cmd_args = (
+            [self.zip7_path, "a", "-t7z"]
+            + method_args
+            + ["-bso0", "-bsp0", f"-si{member}"]
+            + password_args
+            + [out_zip_path]
+        )
+        logging.debug(f"cli args - {' '.join(a for a in cmd_args if not a.startswith('-p'))}")
+
+        with self._popen(
+            cmd_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            shell=False,
+        ) as p:
+            writer = _CountingWriter(p.stdin, self.profile.limit)
+            try:
+                feed(writer)
+            except OSError:
+                # the pipe breaks when the supervisor stopped 7z
+                self.supervisor.check(p)
+                raise
+            finally:
+                p.stdin.close()
+            errors = p.stderr.read().decode("utf-8", errors="ignore").strip()
+        self.supervisor.check(p)
+        if p.returncode >= 2:
+            logging.error(f"Failed to archive {zip_filename}. 7z error: {errors}")
+            raise RuntimeError(f"7z returned fatal error code {p.returncode}")
+        before_bytes = writer.count
+        after_bytes = os.path.getsize(out_zip_path)
+        if not quiet:
+            print(
+                Fore.CYAN
+                + f" >> Streamed {humanize.naturalsize(before_bytes, True)} to {zip_filename}"
+                + f" - Compressed Size : {humanize.naturalsize(after_bytes, True)}"
+                + Style.RESET_ALL
+            )
+        logging.info(
+            f"Backup {zip_filename} complete. Size: {humanize.naturalsize(before_bytes, True)}"
+            + f" >> {humanize.naturalsize(after_bytes, True)}"
+        )
+        return before_bytes, after_bytes
+
+    def backup_file_list(
+        self,
+        zip_filename: str,
+        file_paths: list,
+        out_folder: str,
+        password: str = "",
+        dict_size: str = "192m",
+        mx_level: int = 9,
+        quiet: bool = False,
+    ) -> tuple:
+        """
+        Create a 7z archive from an explicit list of files.
+        Files are stored with their full path (without drive) so files from several
+        targets can share one archive, as used for the dedup blob archive.
+        Returns:
+        - before_size, after_size : tuple of before/after as int in bytes
+        """
+        if not type(file_paths) == list or len(file_paths) == 0:
+            raise ValueError("file_paths must be a non empty list")
+        if not os.path.isdir(out_folder):
+            raise FileNotFoundError()
 
+        zip_args = [self.zip7_path, "a", "-t7z"]
+        if mx_level == 0:
+            zip_args += ["-mx=0"]
+        else:
+            zip_args += ["-m0=lzma2", f"-md={dict_size}", f"-mx={str(mx_level)}"]
+        zip_args += ["-bsp1", "-spf2", "-scsUTF-8"]
+        total_bytes = sum(os.path.getsize(path) for path in file_paths)
+        if total_bytes >= 4290772992:
+            zip_args.append("-v4092m")
+        if len(password) != 0:
+            zip_args.append("-mhe=on")
+            zip_args.append(f"-p{password}")
+
+        listfile = self._write_listfile([os.path.abspath(path) for path in file_paths])
+        try:
+            zip_args += [os.path.join(out_folder, zip_filename), f"@{listfile}"]
+            before_bytes, after_bytes = self._archiver(zip_filename, zip_args, quiet)
+        finally:
+            os.remove(listfile)
         logging.info(
             f"Backup {zip_filename} complete. Size: {humanize.naturalsize(before_bytes, True)}"
             + f" >> {humanize.naturalsize(after_bytes, True)}"
-            + f" (Compressed to {(after_bytes/before_bytes)*100:0.1f}% of input size)"
         )
         return before_bytes, after_bytes
 
+    def extract_archive(
+        self,
+        archive_path: str,
+        out_folder: str,
+        password: str = "",
+        members: list = None,
+        quiet: bool = False,
+    ) -> None:
+        """
+        Extract a 7z archive (first volume if split) to out_folder, keeping paths.
+        Parameters:
+        - archive_path : path to the .7z or .7z.001 file
+        - out_folder   : folder extracted files are written to
+        - password     : password if the archive is encrypted
+        - members      : optional list of archive paths to extract, all if None
+        - quiet        : dont print progress
+        """
+        if not os.path.exists(archive_path):
+            raise FileNotFoundError(archive_path)
+        cmd_args = [self.zip7_path, "x", archive_path, f"-o{out_folder}", "-y", "-bsp1"]
+        listfile = None
+        if members:
+            listfile = self._write_listfile(members)
+            cmd_args += ["-scsUTF-8", f"-i@{listfile}"]
+        logging.debug(f"extract cli args - {' '.join(cmd_args)}")
+        # always pass -p so 7z never waits for a password on stdin
+        cmd_args.append(f"-p{password}")
+        try:
+            with self._popen(
+                cmd_args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                shell=False,
+                bufsize=1,
+                universal_newlines=True,
+                errors="ignore",
+            ) as p:
+                with tqdm(
+                    total=100,
+                    colour="Cyan",
+                    leave=False,
+                    desc=" Extracting ",
+                    unit="%",
+                    disable=quiet,
+                ) as pbar:
+                    for line in p.stdout:
+                        if len(line.strip()) != 0:
+                            logging.debug("extract line output: " + line.strip())
+                        if "%" in line:
+                            try:
+                                pbar.update(int(line.split("%")[0].strip()) - pbar.n)
+                            except ValueError:
+                                pass
+            self.supervisor.check(p)
+            if p.returncode != 0:
+                raise RuntimeError(
+                    f"7z returned {p.returncode} extracting {os.path.basename(archive_path)}"
+                )
+        finally:
+            if listfile is not None:
+                os.remove(listfile)
+        logging.info(f"Extracted {os.path.basename(archive_path)} to {out_folder}")
+
+    def list_archive(self, archive_path: str, password: str = "") -> list:
+        """
+        Technical listing (7z l -slt) of an archive (first volume if split).
+        Returns the output lines.
+        """
+        if not os.path.exists(archive_path):
+            raise FileNotFoundError(archive_path)
+        cmd_args = [self.zip7_path, "l", "-slt", archive_path]
+        logging.debug(f"list cli args - {' '.join(cmd_args)}")
+        cmd_args.append(f"-p{password}")
+        with self._popen(
+            cmd_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=False,
+            universal_newlines=True,
+            errors="ignore",
+        ) as p:
+            lines = p.stdout.read().splitlines()
+        self.supervisor.check(p)
+        if p.returncode != 0:
+            raise RuntimeError(
+                f"7z returned {p.returncode} listing {os.path.basename(archive_path)}"
+            )
+        return lines
+
+    def save_manifest(
+        self, manifest: dict, manifest_name: str, out_folder: str, password: str = ""
+    ) -> str:
+        """
+        Save a restore manifest next to the archives.
+        Manifests hold file paths, so if a password is set the manifest is written to an
+        encrypted 7z instead of plain json to keep the file names hidden.
+        Returns the path of the saved manifest.
+        """
+        json_name = manifest_name + ".manifest.json"
+        if len(password) == 0:
+            out_path = os.path.join(out_folder, json_name)
+            with open(out_path, "w", encoding="utf-8") as fout:
+                json.dump(manifest, fout, indent=2)
+        else:
+            out_path = os.path.join(out_folder, manifest_name + ".manifest.7z")
+            with tempfile.TemporaryDirectory() as temp_dir:
+                json_path = os.path.join(temp_dir, json_name)
+                with open(json_path, "w", encoding="utf-8") as fout:
+                    json.dump(manifest, fout, indent=2)
+                self.backup_folder(
+                    os.path.basename(out_path),
+                    json_path,
+                    out_folder,
+                    password,
+                    dict_size="16m",
+                    split=False,
+                    quiet=True,
+                )
+        logging.debug(f"Manifest saved to {out_path}")
+        return out_path
+
+    def load_manifest(self, manifest_path: str, password: str = "") -> dict:
+        """
+        Load a manifest saved with save_manifest, decrypting it if needed.
+        """
+        if manifest_path.endswith(".json"):
+            with open(manifest_path, "r", encoding="utf-8") as fin:
+                return json.load(fin)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.extract_archive(manifest_path, temp_dir, password, quiet=True)
+            for file in os.listdir(temp_dir):
+                if file.endswith(".manifest.json"):
+                    with open(os.path.join(temp_dir, file), "r", encoding="utf-8") as fin:
+                        return json.load(fin)
+        raise FileNotFoundError(f"No manifest found in {manifest_path}")
+
     def backup_onenote_files(self, out_folder: str, password: str = "") -> None:
         """
         CURRENTLY NOT WORKING CORRECTLY.
@@ -315,7 +1145,8 @@ class Zip7Archiver:
                     "--all-notebooks",
                     "-f 1",
                     "--no-input",
-                ]
+                ],
+                **self.profile.popen_kwargs(),
             )
             subprocess.run(
                 [
@@ -323,7 +1154,8 @@ class Zip7Archiver:
                     "move",
                     os.path.join(self.onenote_ex_files_path, "Output", "*"),
                     os.path.join(out_folder, "onenote", "md"),
-                ]
+                ],
+                **self.profile.popen_kwargs(),
             )
             send2trash(os.path.join(self.onenote_ex_files_path, "Output"))
         except Exception as e:
@@ -343,7 +1175,8 @@ class Zip7Archiver:
                     "--all-notebooks",
                     "-f 2",
                     "--no-input",
-                ]
+                ],
+                **self.profile.popen_kwargs(),
             )
             subprocess.run(
                 [
@@ -351,7 +1184,8 @@ class Zip7Archiver:
                     "move",
                     os.path.join(self.onenote_ex_files_path, "Output", "*"),
                     os.path.join(out_folder, "onenote", "joplin"),
-                ]
+                ],
+                **self.profile.popen_kwargs(),
             )
             send2trash(os.path.join(self.onenote_ex_files_path, "Output"))
         except Exception as e: